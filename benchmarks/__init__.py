@@ -0,0 +1 @@
+# reciper benchmarks - offline performance and accuracy benchmarks of the solver path
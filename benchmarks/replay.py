@@ -0,0 +1,19 @@
+# replay fatsecret client - the recorded fatsecret responses of the benchmarks (see reciper.fixtures)
+
+import os
+
+from reciper import fixtures
+
+# the recorded foods_search/food_get responses
+FIXTURES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'fatsecret.json')
+
+
+def load_fixtures(filename=FIXTURES_FILE):
+    '''Load the recorded fatsecret responses (see reciper.fixtures.load_fixtures())'''
+    return fixtures.load_fixtures(filename)
+
+
+class ReplayFatsecret(fixtures.FixtureSource):
+    def __init__(self, filename=FIXTURES_FILE, latency=0.0, fixtures=None):
+        '''A nutrient source replaying the recorded fatsecret responses (see reciper.fixtures.FixtureSource)'''
+        super().__init__(filename, latency=latency, fixtures=fixtures)
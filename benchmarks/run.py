@@ -0,0 +1,491 @@
+# reciper benchmarks - run the offline solver benchmarks
+#
+# python -m benchmarks.run --output bench.json
+# python -m benchmarks.run --compare bench.json (exit code 1 on a timing regression)
+
+from logging import getLogger, basicConfig
+import argparse
+import json
+import sys
+import threading
+import time
+
+import numpy as np
+
+from reciper.backend import LPBackend, METHODS
+from reciper.batch import solve_products
+from reciper.joint import solve_joint
+from reciper.cache import NutrientCache
+from reciper.fixtures import make_server
+from reciper.lookup import LookupService, resolve_ingredients
+from reciper.matrix import IngredientStore, NUTRIENTS
+from reciper.metrics import metrics
+from reciper.solver import solve_recipe
+from reciper.sources import HttpSource
+from reciper.tolerance import round_label
+from reciper.units import normalize_food
+
+from .replay import ReplayFatsecret, load_fixtures
+from .synthetic import PARAMS, make_ingredients, make_products, make_shared_products, make_variant, recovery_error
+
+logger = getLogger(__name__)
+
+
+def bench_scaling(sizes=(5, 10, 20, 40, 80), param_counts=(4, 8, 12, 17), repeats=20, method='highs', seed=0):
+    '''Measure the solve time as a function of the number of ingredients and label parameters
+
+    Parameters
+    ----------
+    sizes : list of int, optional
+        the numbers of ingredients per recipe
+    param_counts : list of int, optional
+        the numbers of label parameters (the first ones of the nutrient schema)
+    repeats : int, optional
+        number of random recipes per size
+    method : str, optional
+        the linear program method
+    seed : int, optional
+        the random seed
+
+    Returns
+    -------
+    list of dict
+        per (ingredients, parameters) combination, the median solve time ('solve_seconds'), the median number of
+        'iterations' and the 'success' fraction
+    '''
+    rng = np.random.default_rng(seed)
+    store = IngredientStore.from_servings(make_ingredients(max(sizes) * 2, rng=rng))
+    results = []
+    for cparams_count in param_counts:
+        cparams = NUTRIENTS[:cparams_count]
+        for csize in sizes:
+            products = make_products(repeats, store, csize, params=cparams, rng=rng)
+            times = []
+            iterations = []
+            success = 0
+            for cproduct in products:
+                backend = LPBackend(method, warm_start=False)
+                start = time.perf_counter()
+                res = solve_recipe(store, cproduct['values'], cproduct['ingredients'], backend=backend)
+                times.append(time.perf_counter() - start)
+                iterations.append(res['iterations'])
+                success += res['success']
+            results.append({'ingredients': csize, 'parameters': cparams_count, 'solve_seconds': float(np.median(times)),
+                            'iterations': float(np.median(iterations)), 'success': success / repeats})
+            logger.info('scaling %d ingredients %d parameters: %f seconds' % (csize, cparams_count, results[-1]['solve_seconds']))
+    return results
+
+
+def bench_accuracy(num_products=200, sizes=(4, 8, 12), roundings=(None, 'fda', 'eu'), param_sets=(PARAMS, NUTRIENTS), method='highs',
+                   order=True, seed=0):
+    '''Measure how well the true ingredient amounts are recovered from the (possibly rounded) label values
+
+    The products are solved with the same rounding rules used to create their labels ('exact' for no rounding)
+
+    Parameters
+    ----------
+    num_products : int, optional
+        number of random recipes per setting
+    sizes : list of int, optional
+        the numbers of ingredients per recipe
+    roundings : list of str or None, optional
+        the label rounding rules (None for no rounding)
+    param_sets : list of list of str, optional
+        the label parameters (i.e. the common 8 label values and the full nutrient panel)
+    method : str, optional
+        the linear program method
+    order : bool, optional
+        True to use the label ingredient order constraints
+    seed : int, optional
+        the random seed
+
+    Returns
+    -------
+    list of dict
+        per setting, the median and mean absolute amount error (grams, for 100 g recipes) and the success fraction
+    '''
+    rng = np.random.default_rng(seed)
+    store = IngredientStore.from_servings(make_ingredients(50, rng=rng))
+    backend = LPBackend(method)
+    results = []
+    for cparams in param_sets:
+        for csize in sizes:
+            for crounding in roundings:
+                products = make_products(num_products, store, csize, params=cparams, rng=rng, rounding=crounding)
+                crules = 'exact' if crounding is None else crounding
+                errors = []
+                for cproduct in products:
+                    res = solve_recipe(store, cproduct['values'], cproduct['ingredients'], backend=backend, order=order, rules=crules)
+                    errors.append(recovery_error(res, cproduct))
+                errors = np.array(errors)
+                results.append({'ingredients': csize, 'parameters': len(cparams), 'rounding': crounding,
+                                'median_error': float(np.nanmedian(errors)), 'mean_error': float(np.nanmean(errors)),
+                                'success': float(np.mean(~np.isnan(errors)))})
+                logger.info('accuracy %d ingredients %d parameters (rounding %s): median error %f g' % (
+                    csize, len(cparams), crounding, results[-1]['median_error']))
+    return results
+
+
+def bench_modes(num_products=200, sizes=(4, 8, 12, 20), modes=('lp', 'nnls', 'lsq'), rounding='fda', method='highs', seed=0):
+    '''Compare the solve time and recovery error of the solver modes (without the order constraints)
+
+    Parameters
+    ----------
+    num_products : int, optional
+        number of random recipes per size
+    sizes : list of int, optional
+        the numbers of ingredients per recipe (above the 8 label parameters the problem is underdetermined)
+    modes : list of str, optional
+        the solver modes ('lp', 'nnls', 'lsq')
+    rounding : str or None, optional
+        the label rounding rules (None for no rounding)
+    method : str, optional
+        the linear program method
+    seed : int, optional
+        the random seed
+
+    Returns
+    -------
+    list of dict
+        per (ingredients, mode), the median 'solve_seconds' and the median and mean recovery error (grams)
+    '''
+    rng = np.random.default_rng(seed)
+    store = IngredientStore.from_servings(make_ingredients(50, rng=rng))
+    rules = 'exact' if rounding is None else rounding
+    results = []
+    for csize in sizes:
+        products = make_products(num_products, store, csize, rng=rng, rounding=rounding)
+        for cmode in modes:
+            backend = LPBackend(method)
+            times = []
+            errors = []
+            for cproduct in products:
+                start = time.perf_counter()
+                res = solve_recipe(store, cproduct['values'], cproduct['ingredients'], backend=backend, rules=rules, mode=cmode)
+                times.append(time.perf_counter() - start)
+                errors.append(recovery_error(res, cproduct))
+            results.append({'ingredients': csize, 'mode': cmode, 'solve_seconds': float(np.median(times)),
+                            'median_error': float(np.nanmedian(errors)), 'mean_error': float(np.nanmean(errors))})
+            logger.info('mode %s %d ingredients: %f seconds, median error %f g' % (cmode, csize, results[-1]['solve_seconds'],
+                                                                                  results[-1]['median_error']))
+    return results
+
+
+def bench_milp(num_products=100, num_ingredients=6, max_pieces=4, time_limit=1.0, method='highs', seed=0):
+    '''Compare the lp (rounded) and milp modes on recipes of ingredients counted in pieces (i.e. slices and eggs)
+
+    Parameters
+    ----------
+    num_products : int, optional
+        number of random recipes
+    num_ingredients : int, optional
+        number of ingredients per recipe
+    max_pieces : int, optional
+        the maximal number of pieces of each ingredient
+    time_limit : float, optional
+        the milp search time limit (seconds)
+    method : str, optional
+        the linear program method
+    seed : int, optional
+        the random seed
+
+    Returns
+    -------
+    dict
+        per mode, the median 'solve_seconds', the fraction of recipes with all the piece counts recovered ('exact') and the
+        mean absolute piece count error, and the fraction of milp solves stopped by the time limit
+    '''
+    rng = np.random.default_rng(seed)
+    # per gram ingredients with the weight of a piece, as normalized from foods with a piece serving (i.e. '1 large egg')
+    ingredients = make_ingredients(50, rng=rng)
+    for cserving in ingredients.values():
+        cserving['piece_grams'] = rng.uniform(10, 60)
+    store = IngredientStore.from_servings(ingredients)
+    products = []
+    for idx in range(num_products):
+        cnames = list(rng.choice(store.names, size=num_ingredients, replace=False))
+        camounts = rng.integers(1, max_pieces + 1, size=num_ingredients).astype(float)
+        cgrams = camounts * np.array([ingredients[x]['piece_grams'] for x in cnames])
+        cvalues = [round_label(cparam, cval, 'fda') for cparam, cval in zip(PARAMS, (store.matrix(PARAMS, cnames) @ cgrams).tolist())]
+        products.append({'ingredients': cnames, 'values': dict(zip(PARAMS, cvalues)), 'amounts': dict(zip(cnames, camounts.tolist()))})
+    result = {}
+    for cmode in ('lp', 'milp'):
+        backend = LPBackend(method)
+        times = []
+        errors = []
+        limited = 0
+        for cproduct in products:
+            start = time.perf_counter()
+            res = solve_recipe(store, cproduct['values'], cproduct['ingredients'], backend=backend, mode=cmode, time_limit=time_limit)
+            times.append(time.perf_counter() - start)
+            limited += res['status'] == 1
+            if not res['amounts']:
+                errors.append(np.full(num_ingredients, np.nan))
+                continue
+            errors.append([abs(round(res['amounts'][k] / ingredients[k]['piece_grams']) - v) for k, v in cproduct['amounts'].items()])
+        errors = np.array(errors)
+        result[cmode] = {'solve_seconds': float(np.median(times)), 'exact': float(np.mean(np.all(errors == 0, axis=1))),
+                         'mean_error': float(np.nanmean(errors)), 'time_limited': limited / num_products}
+        logger.info('%s pieces: %f seconds, %.2f exact, mean error %f pieces' % (cmode, result[cmode]['solve_seconds'],
+                                                                               result[cmode]['exact'], result[cmode]['mean_error']))
+    return result
+
+
+def bench_memo(num_products=100, duplicates=2, variants=2, num_ingredients=8, method='highs', seed=0):
+    '''Measure the batch solve time of a catalog with duplicate products and size variants, with and without the result cache
+
+    Parameters
+    ----------
+    num_products : int, optional
+        number of distinct random recipes
+    duplicates : int, optional
+        number of identical copies of each recipe (i.e. regional SKUs)
+    variants : int, optional
+        number of size variants of each recipe (same ingredients, different label values)
+    num_ingredients : int, optional
+        number of ingredients per recipe
+    method : str, optional
+        the linear program method
+    seed : int, optional
+        the random seed
+
+    Returns
+    -------
+    dict
+        the total batch 'seconds' and 'memo_seconds' (with the result cache), the fraction of the products solved
+        from the cache ('exact_hits') or warm started from a similar product ('near_hits'), and the median recovery error
+        (grams) without and with the cache (the same up to alternative optimal solutions)
+    '''
+    rng = np.random.default_rng(seed)
+    store = IngredientStore.from_servings(make_ingredients(50, rng=rng))
+    catalog = []
+    for cproduct in make_products(num_products, store, num_ingredients, rng=rng, rounding='fda'):
+        catalog.append(cproduct)
+        for idx in range(duplicates):
+            catalog.append(dict(cproduct, name='%s_copy_%d' % (cproduct['name'], idx)))
+        for idx in range(variants):
+            catalog.append(make_variant(store, cproduct, rng.uniform(0.5, 2), name='%s_size_%d' % (cproduct['name'], idx),
+                                        rounding='fda'))
+    # shuffle, so the copies are not next to each other
+    catalog = [catalog[x] for x in rng.permutation(len(catalog))]
+
+    start = time.perf_counter()
+    plain = solve_products(catalog, store, processes=1, method=method, order=True, memo=False)
+    seconds = time.perf_counter() - start
+    metrics.pop()
+    start = time.perf_counter()
+    cached = solve_products(catalog, store, processes=1, method=method, order=True, memo=True)
+    memo_seconds = time.perf_counter() - start
+    hits = {x['labels']['kind']: x['value'] for x in metrics.pop()['counters'].get('reciper_memo_hits_total', [])}
+    result = {'products': len(catalog), 'seconds': seconds, 'memo_seconds': memo_seconds,
+              'exact_hits': hits.get('exact', 0) / len(catalog), 'near_hits': hits.get('near', 0) / len(catalog),
+              'median_error': float(np.nanmedian([recovery_error(x, y) for x, y in zip(plain, catalog)])),
+              'memo_median_error': float(np.nanmedian([recovery_error(x, y) for x, y in zip(cached, catalog)]))}
+    logger.info('memo: %f -> %f seconds for %d products (%.2f exact hits)' % (seconds, memo_seconds, len(catalog), result['exact_hits']))
+    return result
+
+
+def bench_joint(num_products=300, num_ingredients=8, num_groups=20, group_size=5, method='highs', seed=0):
+    '''Measure the joint (block diagonal) solve of many products, and the accuracy of coupling shared sub-recipes
+
+    Parameters
+    ----------
+    num_products : int, optional
+        number of independent random recipes for the timing
+    num_ingredients : int, optional
+        number of ingredients per recipe
+    num_groups : int, optional
+        number of product groups sharing a base sub-recipe (with a different filling per product)
+    group_size : int, optional
+        number of products per group
+    method : str, optional
+        the linear program method
+    seed : int, optional
+        the random seed
+
+    Returns
+    -------
+    dict
+        the batch solve 'seconds' (one solve per product) and 'joint_seconds' (one solve for all products), and the
+        median recovery error (grams) of the shared products solved independently and coupled
+    '''
+    rng = np.random.default_rng(seed)
+    store = IngredientStore.from_servings(make_ingredients(50, rng=rng))
+    products = make_products(num_products, store, num_ingredients, rng=rng, rounding='fda')
+    start = time.perf_counter()
+    solve_products(products, store, processes=1, method=method, order=True, memo=False)
+    seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    solve_joint(products, store, method=method, order=True)
+    joint_seconds = time.perf_counter() - start
+
+    errors = []
+    coupled_errors = []
+    for cgroup in range(num_groups):
+        cproducts = make_shared_products(group_size, store, rng=rng, rounding='fda')
+        for cres, cproduct in zip(solve_joint(cproducts, store, method=method, order=True, couple=False), cproducts):
+            errors.append(recovery_error(cres, cproduct))
+        for cres, cproduct in zip(solve_joint(cproducts, store, method=method, order=True), cproducts):
+            coupled_errors.append(recovery_error(cres, cproduct))
+    result = {'products': num_products, 'seconds': seconds, 'joint_seconds': joint_seconds,
+              'median_error': float(np.nanmedian(errors)), 'coupled_median_error': float(np.nanmedian(coupled_errors))}
+    logger.info('joint: %f -> %f seconds for %d products, shared sub-recipe error %f -> %f g' % (
+        seconds, joint_seconds, num_products, result['median_error'], result['coupled_median_error']))
+    return result
+
+
+def bench_end_to_end(num_products=50, num_ingredients=5, latency=0.02, method='highs', seed=0, http=False):
+    '''Measure the lookup + solve latency per product using the recorded fatsecret responses
+
+    Each product ingredient is looked up (through a new in memory nutrient cache) and the recipe is solved
+
+    Parameters
+    ----------
+    num_products : int, optional
+        number of random recipes (from the recorded foods)
+    num_ingredients : int, optional
+        number of ingredients per recipe
+    latency : float, optional
+        the simulated network latency (seconds) of each fatsecret call
+    method : str, optional
+        the linear program method
+    seed : int, optional
+        the random seed
+    http : bool, optional
+        True to serve the recorded responses from the local fixture http server (see reciper.fixtures), False to
+        replay them in process
+
+    Returns
+    -------
+    dict
+        the median and maximal 'product_seconds', the total 'network_calls', the cache 'hit_ratio' and the
+        median recovery error (grams)
+    '''
+    rng = np.random.default_rng(seed)
+    fixtures = load_fixtures()
+    # the true ingredients - the first search result of each recorded query
+    truth = {}
+    for cquery, cfoods in fixtures['searches'].items():
+        cserving = normalize_food(fixtures['foods'][cfoods[0]['food_id']])
+        if cserving is not None:
+            truth[cquery] = cserving
+    products = make_products(num_products, truth, num_ingredients, params=PARAMS, rng=rng, rounding='fda')
+
+    client = ReplayFatsecret(latency=latency, fixtures=fixtures)
+    factory = lambda: client
+    server = None
+    if http:
+        # the latency is simulated by the server, per request
+        client.latency = 0
+        server = make_server(client, latency=latency)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        factory = lambda: HttpSource(server.url)
+    cache = NutrientCache(':memory:')
+    backend = LPBackend(method)
+    times = []
+    errors = []
+    try:
+        with LookupService(factory, cache=cache, offline=False, rate=None) as service:
+            for cproduct in products:
+                start = time.perf_counter()
+                cingredients = resolve_ingredients(cproduct['ingredients'], service)
+                res = solve_recipe(cingredients, cproduct['values'], cproduct['ingredients'], backend=backend, order=True)
+                times.append(time.perf_counter() - start)
+                errors.append(recovery_error(res, cproduct))
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+    stats = cache.stats()
+    hits = sum(x['hits'] for x in stats.values())
+    misses = sum(x['misses'] for x in stats.values())
+    result = {'products': num_products, 'latency': latency, 'http': http, 'product_seconds': float(np.median(times)),
+              'max_product_seconds': float(np.max(times)), 'network_calls': client.calls,
+              'hit_ratio': hits / max(hits + misses, 1), 'median_error': float(np.nanmedian(errors))}
+    logger.info('end to end: %f seconds per product, %d network calls' % (result['product_seconds'], client.calls))
+    return result
+
+
+def compare(results, baseline, tolerance=1.5):
+    '''Find the timings that regressed compared to a baseline run
+
+    Parameters
+    ----------
+    results : dict
+        the current benchmark results
+    baseline : dict
+        the baseline benchmark results
+    tolerance : float, optional
+        the maximal allowed ratio between the current and baseline timings
+
+    Returns
+    -------
+    list of str
+        a description of each regression
+    '''
+    regressions = []
+    for cbase, ccur in zip(baseline.get('scaling', []), results.get('scaling', [])):
+        if ccur['solve_seconds'] > tolerance * cbase['solve_seconds']:
+            regressions.append('scaling %d ingredients %d parameters: %f -> %f seconds' % (
+                ccur['ingredients'], ccur['parameters'], cbase['solve_seconds'], ccur['solve_seconds']))
+    if 'end_to_end' in baseline and 'end_to_end' in results:
+        cbase = baseline['end_to_end']['product_seconds']
+        ccur = results['end_to_end']['product_seconds']
+        if ccur > tolerance * cbase:
+            regressions.append('end to end: %f -> %f seconds per product' % (cbase, ccur))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the reciper solver benchmarks (offline)')
+    parser.add_argument('-b', '--benchmarks', help='the benchmarks to run', nargs='+',
+                        choices=['scaling', 'accuracy', 'modes', 'milp', 'memo', 'joint', 'end_to_end'],
+                        default=['scaling', 'accuracy', 'modes', 'milp', 'memo', 'joint', 'end_to_end'])
+    parser.add_argument('-m', '--method', help='linear program method', choices=METHODS, default='highs')
+    parser.add_argument('-o', '--output', help='save the results to this json file')
+    parser.add_argument('--compare', help='baseline results json file to compare the timings to')
+    parser.add_argument('--tolerance', help='the maximal allowed slowdown ratio compared to the baseline', type=float, default=1.5)
+    parser.add_argument('--seed', help='random seed', type=int, default=0)
+    parser.add_argument('--http', help='serve the recorded responses of the end_to_end benchmark from the local fixture http server',
+                        action='store_true')
+    parser.add_argument('--log-level', help='debug log level', default=20, type=int)
+
+    args = parser.parse_args(argv)
+    basicConfig(format='%(levelname)s:%(message)s', level=args.log_level)
+    # the solver warnings are expected for the random recipes
+    getLogger('reciper').setLevel(max(args.log_level, 40))
+
+    results = {}
+    if 'scaling' in args.benchmarks:
+        results['scaling'] = bench_scaling(method=args.method, seed=args.seed)
+    if 'accuracy' in args.benchmarks:
+        results['accuracy'] = bench_accuracy(method=args.method, seed=args.seed)
+    if 'modes' in args.benchmarks:
+        results['modes'] = bench_modes(method=args.method, seed=args.seed)
+    if 'milp' in args.benchmarks:
+        results['milp'] = bench_milp(method=args.method, seed=args.seed)
+    if 'memo' in args.benchmarks:
+        results['memo'] = bench_memo(method=args.method, seed=args.seed)
+    if 'joint' in args.benchmarks:
+        results['joint'] = bench_joint(method=args.method, seed=args.seed)
+    if 'end_to_end' in args.benchmarks:
+        results['end_to_end'] = bench_end_to_end(method=args.method, seed=args.seed, http=args.http)
+
+    if args.output is not None:
+        with open(args.output, 'w') as fl:
+            json.dump(results, fl, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.compare is not None:
+        with open(args.compare) as fl:
+            baseline = json.load(fl)
+        regressions = compare(results, baseline, args.tolerance)
+        for cregression in regressions:
+            logger.error('regression: %s' % cregression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
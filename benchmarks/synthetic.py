@@ -0,0 +1,221 @@
+# synthetic recipes - random ingredients and recipes with known ingredient amounts
+
+from logging import getLogger
+
+import numpy as np
+
+from reciper.matrix import IngredientStore, NUTRIENTS
+from reciper.tolerance import round_label
+
+logger = getLogger(__name__)
+
+# the label parameters used by default (as in the gui)
+PARAMS = ('calories', 'carbohydrate', 'fat', 'fiber', 'sodium', 'protein', 'sugar', 'saturated_fat')
+
+
+def make_ingredients(num_ingredients, rng=None):
+    '''Create random per gram ingredient nutritional values
+
+    The macronutrients (carbohydrate, protein, fat) are random fractions of the weight, and the calories are derived
+    from them, so the ingredients look like real foods
+
+    Parameters
+    ----------
+    num_ingredients : int
+    rng : numpy.random.Generator or None, optional
+
+    Returns
+    -------
+    dict of {str: dict}
+        the per gram serving dict of each ingredient (named 'ingredient_<i>')
+    '''
+    if rng is None:
+        rng = np.random.default_rng()
+    ingredients = {}
+    for idx in range(num_ingredients):
+        # carbohydrate, protein, fat and the rest (water/ash), fractions of 1 gram
+        carbohydrate, protein, fat, _ = rng.dirichlet([1, 0.6, 0.6, 1])
+        cvals = {'carbohydrate': carbohydrate, 'protein': protein, 'fat': fat,
+                 'calories': 4 * carbohydrate + 4 * protein + 9 * fat,
+                 'fiber': carbohydrate * rng.uniform(0, 0.3), 'sugar': carbohydrate * rng.uniform(0, 1),
+                 'saturated_fat': fat * rng.uniform(0, 0.6), 'polyunsaturated_fat': fat * rng.uniform(0, 0.3),
+                 'monounsaturated_fat': fat * rng.uniform(0, 0.3), 'trans_fat': fat * rng.uniform(0, 0.02),
+                 'cholesterol': rng.exponential(0.1), 'sodium': rng.exponential(2), 'potassium': rng.exponential(2),
+                 'vitamin_a': rng.exponential(0.01), 'vitamin_c': rng.exponential(0.05),
+                 'calcium': rng.exponential(0.5), 'iron': rng.exponential(0.02)}
+        cserving = {'measurement_description': 'g', 'metric_serving_amount': 1.0, 'metric_serving_unit': 'g'}
+        cserving.update({k: float(v) for k, v in cvals.items() if k in NUTRIENTS})
+        ingredients['ingredient_%d' % idx] = cserving
+    return ingredients
+
+
+def make_recipe(ingredients, num_ingredients, params=PARAMS, total=100.0, decimals=None, rng=None, name='product', rounding=None):
+    '''Create a random recipe and its label values
+
+    Parameters
+    ----------
+    ingredients : dict of {str: dict} or IngredientStore
+        the per gram ingredients to choose from
+    num_ingredients : int
+        number of ingredients in the recipe
+    params : list of str, optional
+        the label parameters
+    total : float, optional
+        the total recipe weight (grams)
+    decimals : int or None, optional
+        number of decimals to round the label values to. None to not round
+    rng : numpy.random.Generator or None, optional
+    name : str, optional
+        the product name
+    rounding : str or None, optional
+        the label rounding rules ('fda' or 'eu') applied to the label values. None to not use rounding rules
+
+    Returns
+    -------
+    dict
+        the product (as in reciper.batch.read_labels()), with the ingredient names in descending amount order, and
+        the true ingredient amounts in the 'amounts' field
+    '''
+    if rng is None:
+        rng = np.random.default_rng()
+    store = ingredients if isinstance(ingredients, IngredientStore) else IngredientStore.from_servings(ingredients)
+    names = list(rng.choice(store.names, size=num_ingredients, replace=False))
+    amounts = np.sort(rng.dirichlet(np.ones(num_ingredients)))[::-1] * total
+    values = store.matrix(params, names) @ amounts
+    if decimals is not None:
+        values = np.round(values, decimals)
+    values = [round_label(cparam, cval, rounding) for cparam, cval in zip(params, values.tolist())]
+    return {'name': name, 'ingredients': names, 'values': dict(zip(params, values)),
+            'amounts': dict(zip(names, amounts.tolist()))}
+
+
+def make_variant(ingredients, product, scale, params=PARAMS, name=None, rounding=None):
+    '''Create a size variant of a recipe (the same ingredients and proportions, with a different serving size)
+
+    Parameters
+    ----------
+    ingredients : dict of {str: dict} or IngredientStore
+        the per gram ingredients of the recipe
+    product : dict
+        the recipe (from make_recipe())
+    scale : float
+        the serving size of the variant, relative to the recipe serving size
+    params : list of str, optional
+        the label parameters
+    name : str or None, optional
+        the variant name. None to use the recipe name
+    rounding : str or None, optional
+        the label rounding rules ('fda' or 'eu') applied to the label values. None to not use rounding rules
+
+    Returns
+    -------
+    dict
+        the variant product (as in make_recipe())
+    '''
+    store = ingredients if isinstance(ingredients, IngredientStore) else IngredientStore.from_servings(ingredients)
+    names = list(product['ingredients'])
+    amounts = np.array([product['amounts'][x] for x in names]) * scale
+    values = store.matrix(params, names) @ amounts
+    values = [round_label(cparam, cval, rounding) for cparam, cval in zip(params, values.tolist())]
+    return {'name': product['name'] if name is None else name, 'ingredients': names, 'values': dict(zip(params, values)),
+            'amounts': dict(zip(names, amounts.tolist()))}
+
+
+def make_products(num_products, ingredients, num_ingredients, params=PARAMS, decimals=None, rng=None, rounding=None):
+    '''Create random recipes
+
+    Parameters
+    ----------
+    num_products : int
+    ingredients : dict of {str: dict} or IngredientStore
+        the per gram ingredients to choose from
+    num_ingredients : int
+        number of ingredients per recipe
+    params : list of str, optional
+        the label parameters
+    decimals : int or None, optional
+        number of decimals to round the label values to. None to not round
+    rng : numpy.random.Generator or None, optional
+    rounding : str or None, optional
+        the label rounding rules ('fda' or 'eu') applied to the label values. None to not use rounding rules
+
+    Returns
+    -------
+    list of dict
+        the products (see make_recipe())
+    '''
+    if rng is None:
+        rng = np.random.default_rng()
+    if not isinstance(ingredients, IngredientStore):
+        ingredients = IngredientStore.from_servings(ingredients)
+    return [make_recipe(ingredients, num_ingredients, params, decimals=decimals, rng=rng, name='product_%d' % idx, rounding=rounding)
+            for idx in range(num_products)]
+
+
+def make_shared_products(num_products, ingredients, base_size=4, filling_size=3, base_fraction=0.7, params=PARAMS, rng=None,
+                         rounding=None, name='base'):
+    '''Create recipes sharing a base sub-recipe (i.e. one dough used for several pitas) with different fillings
+
+    Parameters
+    ----------
+    num_products : int
+    ingredients : dict of {str: dict} or IngredientStore
+        the per gram ingredients to choose from
+    base_size : int, optional
+        number of ingredients in the base
+    filling_size : int, optional
+        number of ingredients in the filling of each product
+    base_fraction : float, optional
+        the fraction of the base in each recipe
+    params : list of str, optional
+        the label parameters
+    rng : numpy.random.Generator or None, optional
+    rounding : str or None, optional
+        the label rounding rules ('fda' or 'eu') applied to the label values. None to not use rounding rules
+    name : str, optional
+        the base sub-recipe name (in the product 'shared' field)
+
+    Returns
+    -------
+    list of dict
+        the products (see make_recipe()), with the base ingredients in the 'shared' field
+    '''
+    if rng is None:
+        rng = np.random.default_rng()
+    store = ingredients if isinstance(ingredients, IngredientStore) else IngredientStore.from_servings(ingredients)
+    base_names = list(rng.choice(store.names, size=base_size, replace=False))
+    base = rng.dirichlet(np.ones(base_size)) * base_fraction * 100
+    others = [x for x in store.names if x not in base_names]
+    products = []
+    for idx in range(num_products):
+        cfilling = list(rng.choice(others, size=filling_size, replace=False))
+        camounts = np.concatenate([base, rng.dirichlet(np.ones(filling_size)) * (1 - base_fraction) * 100])
+        cnames = base_names + cfilling
+        corder = np.argsort(-camounts, kind='stable')
+        cnames = [cnames[x] for x in corder]
+        camounts = camounts[corder]
+        cvalues = store.matrix(params, cnames) @ camounts
+        cvalues = [round_label(cparam, cval, rounding) for cparam, cval in zip(params, cvalues.tolist())]
+        products.append({'name': 'product_%d' % idx, 'ingredients': cnames, 'values': dict(zip(params, cvalues)),
+                         'amounts': dict(zip(cnames, camounts.tolist())), 'shared': {name: base_names}})
+    return products
+
+
+def recovery_error(result, product):
+    '''Get the mean absolute error of the solved amounts
+
+    Parameters
+    ----------
+    result : dict
+        the solve_recipe() result
+    product : dict
+        the product with the true 'amounts'
+
+    Returns
+    -------
+    float
+        the mean absolute difference (grams) between the solved and true amounts. nan if the solve failed
+    '''
+    if not result['amounts']:
+        return np.nan
+    return float(np.mean([abs(result['amounts'][k] - v) for k, v in product['amounts'].items()]))
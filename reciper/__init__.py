@@ -0,0 +1,4 @@
+# reciper - recipe reverse engineering using the nutritional values of ingredients
+#
+# keep this file free of heavy imports, so the headless solver and cli do not
+# pay for the gui stack
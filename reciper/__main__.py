@@ -0,0 +1,33 @@
+# reciper entry point
+#
+# python -m reciper gui [options] - start the gui
+# python -m reciper import-fdc [options] fdc_dir prefix - import a local food database (see reciper.fooddb)
+# python -m reciper serve-fixtures [options] fixtures - serve recorded fatsecret responses over http (see reciper.fixtures)
+# python -m reciper [options] labels - solve the recipes of a label file (see reciper.cli)
+#
+# the gui stack (Qt) is imported only when the gui is started
+
+import sys
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] == 'gui':
+        from .gui import main as gui_main
+        gui_main(argv[1:])
+        return
+    if argv and argv[0] == 'import-fdc':
+        from .fooddb import main as fooddb_main
+        fooddb_main(argv[1:])
+        return
+    if argv and argv[0] == 'serve-fixtures':
+        from .fixtures import main as fixtures_main
+        fixtures_main(argv[1:])
+        return
+    from .cli import main as cli_main
+    cli_main(argv)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+# reciper backend - sparse linear program solving with optional warm start
+
+from logging import getLogger
+
+import numpy as np
+
+from .metrics import metrics
+
+logger = getLogger(__name__)
+
+# the supported linear program methods
+METHODS = ('highs', 'highs-ds', 'highs-ipm')
+
+# the highs solver option for each method
+_HIGHS_SOLVERS = {'highs': 'choose', 'highs-ds': 'simplex', 'highs-ipm': 'ipm'}
+
+
+def _to_sparse(mat, num_cols):
+    '''Convert a constraint matrix (dense, sparse or None) to a scipy.sparse csr matrix'''
+    import scipy.sparse
+
+    if mat is None:
+        return scipy.sparse.csr_matrix((0, num_cols))
+    return scipy.sparse.csr_matrix(mat, dtype=float)
+
+
+def _get_bounds(bounds, num_cols):
+    '''Convert linprog style bounds to lower and upper bound arrays'''
+    if bounds is None:
+        bounds = (0, None)
+    if len(bounds) == 2 and not isinstance(bounds[0], (tuple, list)):
+        bounds = [bounds] * num_cols
+    lower = np.array([-np.inf if x[0] is None else x[0] for x in bounds], dtype=float)
+    upper = np.array([np.inf if x[1] is None else x[1] for x in bounds], dtype=float)
+    return lower, upper
+
+
+def build_highs_lp(c, A_eq, b_eq, A_ub, b_ub, bounds=(0, None), integrality=None):
+    '''Build the highspy model of a linear program (equality rows first, then the inequality rows)
+
+    Parameters
+    ----------
+    c : numpy.ndarray
+        the objective coefficients
+    A_eq, A_ub : scipy.sparse matrix
+        the equality/inequality constraint matrices
+    b_eq, b_ub : numpy.ndarray
+        the equality/inequality constraint values
+    bounds : tuple or list of tuple, optional
+        (min, max) for all variables, or a list with (min, max) per variable. None means unbounded
+    integrality : array like of bool or None, optional
+        True for the integer variables. None for a linear program
+
+    Returns
+    -------
+    highspy.HighsLp
+    '''
+    import highspy
+    import scipy.sparse
+
+    num_cols = len(c)
+    mat = scipy.sparse.vstack([A_eq, A_ub]).tocsc()
+    lp = highspy.HighsLp()
+    lp.num_col_ = num_cols
+    lp.num_row_ = mat.shape[0]
+    lp.col_cost_ = c
+    lp.col_lower_, lp.col_upper_ = _get_bounds(bounds, num_cols)
+    lp.row_lower_ = np.concatenate([b_eq, np.full(len(b_ub), -np.inf)])
+    lp.row_upper_ = np.concatenate([b_eq, b_ub])
+    lp.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+    lp.a_matrix_.start_ = mat.indptr
+    lp.a_matrix_.index_ = mat.indices
+    lp.a_matrix_.value_ = mat.data
+    if integrality is not None:
+        lp.integrality_ = [highspy.HighsVarType.kInteger if x else highspy.HighsVarType.kContinuous for x in integrality]
+    return lp
+
+
+class LPBackend:
+    def __init__(self, method='highs', warm_start=True, options=None):
+        '''Create a linear program solver backend
+
+        The constraint matrices are passed to the solver as scipy.sparse matrices. If the highspy package is installed and
+        warm_start is True, the simplex basis of the previous solve is used to start the next one (mapped by the column and
+        row keys, so adding/removing an ingredient or changing a target value keeps the rest of the basis).
+        Otherwise, scipy.optimize.linprog is used.
+
+        Parameters
+        ----------
+        method : str, optional
+            the linear program method ('highs' to let HiGHS choose, 'highs-ds' for dual simplex, 'highs-ipm' for interior point)
+        warm_start : bool, optional
+            True to start each solve from the previous basis (requires highspy)
+        options : dict or None, optional
+            additional solver options (passed to linprog or set as highs options)
+        '''
+        if method not in METHODS:
+            raise ValueError('unknown method %s. Use one of %s' % (method, METHODS))
+        self.method = method
+        self.options = {} if options is None else dict(options)
+        self.warm_start = warm_start
+        self._highs = None
+        if warm_start:
+            try:
+                import highspy
+                self._highs = highspy.Highs()
+                self._highs.setOptionValue('output_flag', False)
+                for ckey, cval in self.options.items():
+                    self._highs.setOptionValue(ckey, cval)
+            except ImportError:
+                logger.debug('highspy not installed, using linprog without warm start')
+        # the basis of the last solve, as dicts of {key: status}
+        self._col_basis = None
+        self._row_basis = None
+
+    def get_basis(self):
+        '''Get the basis of the last solve (to warm start a later solve with set_basis())
+
+        Returns
+        -------
+        tuple of (dict, dict) or None
+            the column and row basis status by key. None if there is no basis (i.e. without highspy)
+        '''
+        if self._col_basis is None:
+            return None
+        return self._col_basis, self._row_basis
+
+    def set_basis(self, basis):
+        '''Set the basis the next solve starts from
+
+        Parameters
+        ----------
+        basis : tuple of (dict, dict) or None
+            the get_basis() result. None to start cold
+        '''
+        if basis is None or self._highs is None:
+            self.reset()
+            return
+        self._col_basis, self._row_basis = basis
+
+    def reset(self):
+        '''Forget the previous basis (the next solve starts cold)'''
+        self._col_basis = None
+        self._row_basis = None
+
+    def solve(self, c, A_eq=None, b_eq=None, A_ub=None, b_ub=None, bounds=(0, None), col_keys=None, row_keys=None):
+        '''Solve the linear program: minimize c @ x such that A_eq @ x == b_eq, A_ub @ x <= b_ub and x within bounds
+
+        Parameters
+        ----------
+        c : array like
+            the objective coefficients
+        A_eq, A_ub : array like or scipy.sparse matrix or None, optional
+            the equality/inequality constraint matrices
+        b_eq, b_ub : array like or None, optional
+            the equality/inequality constraint values
+        bounds : tuple or list of tuple, optional
+            (min, max) for all variables, or a list with (min, max) per variable. None means unbounded
+        col_keys : list or None, optional
+            a hashable key per variable (i.e. ingredient name), used to map the previous basis for the warm start
+        row_keys : list or None, optional
+            a hashable key per constraint row (equality rows first), used to map the previous basis for the warm start
+
+        Returns
+        -------
+        scipy.optimize.OptimizeResult
+            with the fields 'x', 'fun', 'status', 'success', 'message' and 'nit', as in linprog
+        '''
+        c = np.asarray(c, dtype=float)
+        num_cols = len(c)
+        A_eq = _to_sparse(A_eq, num_cols)
+        A_ub = _to_sparse(A_ub, num_cols)
+        b_eq = np.zeros(0) if b_eq is None else np.asarray(b_eq, dtype=float)
+        b_ub = np.zeros(0) if b_ub is None else np.asarray(b_ub, dtype=float)
+        with metrics.timer('reciper_solve_seconds', method=self.method):
+            if self._highs is None:
+                res = self._solve_linprog(c, A_eq, b_eq, A_ub, b_ub, bounds)
+            else:
+                res = self._solve_highs(c, A_eq, b_eq, A_ub, b_ub, bounds, col_keys, row_keys)
+        metrics.inc('reciper_solves_total', method=self.method, status=res.status)
+        metrics.observe('reciper_solve_iterations', res.get('nit', 0), method=self.method)
+        return res
+
+    def _solve_linprog(self, c, A_eq, b_eq, A_ub, b_ub, bounds):
+        from scipy.optimize import linprog
+
+        if A_eq.shape[0] == 0:
+            A_eq, b_eq = None, None
+        if A_ub.shape[0] == 0:
+            A_ub, b_ub = None, None
+        return linprog(c, A_ub=A_ub, b_ub=b_ub, A_eq=A_eq, b_eq=b_eq, bounds=bounds, method=self.method, options=self.options)
+
+    def _solve_highs(self, c, A_eq, b_eq, A_ub, b_ub, bounds, col_keys, row_keys):
+        import highspy
+        from scipy.optimize import OptimizeResult
+
+        h = self._highs
+        num_cols = len(c)
+        num_rows = A_eq.shape[0] + A_ub.shape[0]
+        h.clearModel()
+        h.setOptionValue('solver', _HIGHS_SOLVERS[self.method])
+        h.passModel(build_highs_lp(c, A_eq, b_eq, A_ub, b_ub, bounds))
+
+        if col_keys is None:
+            col_keys = list(range(num_cols))
+        if row_keys is None:
+            row_keys = list(range(num_rows))
+        if self._col_basis is not None and self.method != 'highs-ipm':
+            self._set_basis(col_keys, row_keys)
+
+        h.run()
+        model_status = h.getModelStatus()
+        info = h.getInfo()
+        solution = h.getSolution()
+        status = {highspy.HighsModelStatus.kOptimal: 0,
+                  highspy.HighsModelStatus.kIterationLimit: 1,
+                  highspy.HighsModelStatus.kTimeLimit: 1,
+                  highspy.HighsModelStatus.kInfeasible: 2,
+                  highspy.HighsModelStatus.kUnbounded: 3}.get(model_status, 4)
+        res = OptimizeResult()
+        res.status = status
+        res.success = status == 0
+        res.message = 'HiGHS Status: %s' % h.modelStatusToString(model_status)
+        res.nit = info.simplex_iteration_count + info.ipm_iteration_count
+        if status == 0:
+            res.x = np.array(solution.col_value)
+            res.fun = info.objective_function_value
+            basis = h.getBasis()
+            if basis.valid:
+                self._col_basis = dict(zip(col_keys, basis.col_status))
+                self._row_basis = dict(zip(row_keys, basis.row_status))
+        else:
+            res.x = None
+            res.fun = None
+            self.reset()
+        return res
+
+    def _set_basis(self, col_keys, row_keys):
+        '''Set the highs basis from the previous solve basis, mapped by the column/row keys'''
+        import highspy
+
+        basis = highspy.HighsBasis()
+        # new columns start at their lower bound, and new rows with a basic slack
+        basis.col_status = [self._col_basis.get(x, highspy.HighsBasisStatus.kLower) for x in col_keys]
+        basis.row_status = [self._row_basis.get(x, highspy.HighsBasisStatus.kBasic) for x in row_keys]
+        basis.valid = True
+        # the number of basic variables can change if basic columns were removed, so let highs repair the basis
+        basis.alien = True
+        if self._highs.setBasis(basis) != highspy.HighsStatus.kOk:
+            logger.debug('could not set the warm start basis, solving cold')
@@ -0,0 +1,393 @@
+# reciper batch - solve many products from a label file in a process pool
+
+from logging import getLogger
+from multiprocessing import Pool
+import csv
+import json
+import os
+
+from .backend import LPBackend
+from .joint import joint_groups, solve_joint
+from .matrix import IngredientStore, harmonize_values
+from .memo import ResultCache
+from .metrics import metrics
+from .solver import get_store, solve_recipe
+from .uncertainty import recipe_intervals
+from .units import normalize_foods
+
+logger = getLogger(__name__)
+
+
+def _parse_bool(text):
+    '''Parse a csv boolean cell (1/true/yes or 0/false/no)'''
+    text = text.strip().lower()
+    if text in ('1', 'true', 'yes'):
+        return True
+    if text in ('0', 'false', 'no'):
+        return False
+    raise ValueError('invalid boolean value %s. Use 1/true/yes or 0/false/no' % text)
+
+
+def iter_labels(filename):
+    '''Read the products to solve from a label file, one at a time
+
+    Parameters
+    ----------
+    filename : str
+        name of the label file. Can be:
+        jsonl (.jsonl/.json) - one product per line, with the fields:
+            'name' : str
+            'values' : dict of {str: float} - the label value per nutritional parameter (in the schema unit, or with a unit
+                       suffix such as 'sodium_g' or 'calcium_dv' for percent of the daily value, see harmonize_values())
+            'ingredients' : list of str (ingredient names) or dict of {str: dict} (ingredient name and serving)
+            'order' : bool (optional) - True to constrain the amounts to the label ingredient order
+            'tail' : int (optional) - index of the first ingredient after "contains less than 2% of"
+            'shared' : dict (optional) - the shared sub-recipes, coupled between products in a joint solve
+                       (see joint.get_shared())
+            'recipe_scale' : float (optional) - the number of label value bases in the whole recipe, for the whole
+                       pieces of the milp mode (see solve_recipe())
+        csv (.csv) - one product per row, with the columns:
+            'name' : the product name
+            'ingredients' : ';' separated list of ingredient names
+            'order' (optional) : 1/true/yes to constrain the amounts to the label ingredient order, 0/false/no to not
+                       constrain them (empty to use the default)
+            'tail' (optional) : index of the first ingredient after "contains less than 2% of"
+            'recipe_scale' (optional) : the number of label value bases in the whole recipe (for the milp mode)
+            and one column per nutritional parameter (empty cells are not used, the column names can have a unit suffix)
+
+    Yields
+    ------
+    dict
+        one dict per product, with the 'name', 'values' and 'ingredients' fields
+    '''
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == '.csv':
+        with open(filename, newline='') as fl:
+            for idx, crow in enumerate(csv.DictReader(fl)):
+                cname = crow.pop('name', None) or 'product_%d' % idx
+                cingredients = [x.strip() for x in crow.pop('ingredients', '').split(';') if x.strip()]
+                corder = crow.pop('order', None)
+                ctail = crow.pop('tail', None)
+                cscale = crow.pop('recipe_scale', None)
+                cvalues = harmonize_values({k: float(v) for k, v in crow.items() if v is not None and v.strip() != ''})
+                cproduct = {'name': cname, 'values': cvalues, 'ingredients': cingredients}
+                if corder is not None and corder.strip() != '':
+                    cproduct['order'] = _parse_bool(corder)
+                if ctail is not None and ctail.strip() != '':
+                    cproduct['tail'] = int(ctail)
+                if cscale is not None and cscale.strip() != '':
+                    cproduct['recipe_scale'] = float(cscale)
+                yield cproduct
+    elif ext in ('.jsonl', '.json'):
+        with open(filename) as fl:
+            for idx, cline in enumerate(fl):
+                cline = cline.strip()
+                if not cline:
+                    continue
+                cproduct = json.loads(cline)
+                cproduct.setdefault('name', 'product_%d' % idx)
+                cproduct['values'] = harmonize_values({k: float(v) for k, v in cproduct.get('values', {}).items()})
+                cproduct.setdefault('ingredients', [])
+                yield cproduct
+    else:
+        raise ValueError('unknown label file format %s. Use .csv or .jsonl' % filename)
+
+
+def read_labels(filename):
+    '''Read all the products to solve from a label file
+
+    Parameters
+    ----------
+    filename : str
+        name of the label file (see iter_labels())
+
+    Returns
+    -------
+    list of dict
+        one dict per product, with the 'name', 'values' and 'ingredients' fields
+    '''
+    products = list(iter_labels(filename))
+    logger.info('read %d products from %s' % (len(products), filename))
+    return products
+
+
+def read_ingredients(filename):
+    '''Read the ingredient nutritional values from a json file
+
+    Parameters
+    ----------
+    filename : str
+        json file with a dict of {ingredient name: serving dict} (i.e. the fatsecret serving dict).
+        The value can also be the fatsecret food (food_get() result), which is normalized to per gram values
+
+    Returns
+    -------
+    dict of {str: dict}
+    '''
+    with open(filename) as fl:
+        ingredients = json.load(fl)
+    foods = [cname for cname, cingredient in ingredients.items() if 'servings' in cingredient]
+    for cname, cserving in zip(foods, normalize_foods([ingredients[x] for x in foods])):
+        if cserving is None:
+            raise ValueError('no metric serving for ingredient %s' % cname)
+        ingredients[cname] = cserving
+    logger.info('read %d ingredients from %s' % (len(ingredients), filename))
+    return ingredients
+
+
+def get_product_ingredients(product, store=None):
+    '''Get the ingredient store and ingredient names of the product
+
+    Parameters
+    ----------
+    product : dict
+        the product (as returned from read_labels())
+    store : IngredientStore or None, optional
+        the known ingredients, used for products with a list of ingredient names
+
+    Returns
+    -------
+    store : IngredientStore
+        the store containing the product ingredients
+    names : list of str
+        the product ingredient names, in the label order
+    '''
+    cingredients = product['ingredients']
+    if isinstance(cingredients, dict):
+        return IngredientStore.from_servings(cingredients), list(cingredients.keys())
+    if store is None:
+        store = IngredientStore()
+    missing = [x for x in cingredients if x not in store]
+    if missing:
+        raise ValueError('ingredients not found for product %s: %s' % (product['name'], ', '.join(missing)))
+    return store, list(cingredients)
+
+
+def solve_product(product, ingredients=None, backend=None, order=False, intervals=0, rules='fda', memo=None, mode='lp',
+                  time_limit=10.0, mip_gap=1e-4):
+    '''Solve the recipe of a single product
+
+    Parameters
+    ----------
+    product : dict
+        the product (as returned from read_labels())
+    ingredients : dict of {str: dict} or IngredientStore or None, optional
+        the known ingredients, used for products with a list of ingredient names
+    backend : LPBackend or None, optional
+        the solver backend (reused between products for the warm start). None to create a new backend
+    order : bool, optional
+        True to constrain the amounts to the label ingredient order (unless the product 'order' field is set)
+    intervals : int, optional
+        number of perturbed problems for the ingredient amount confidence intervals (in the result 'intervals' field).
+        0 to not calculate intervals. Needs the lp mode
+    rules : str or None, optional
+        the label rounding rules ('fda', 'eu' or 'exact')
+    memo : ResultCache or None, optional
+        the cache of solved problems (shared between products). None to solve each product
+    mode : str, optional
+        the solver mode ('lp', 'milp', 'nnls' or 'lsq', see solve_recipe())
+    time_limit, mip_gap : optional
+        the 'milp' mode search time limit (seconds) and relative gap (see solve_recipe())
+
+    Returns
+    -------
+    dict
+        the solve_recipe() result, with the product 'name'. If the product could not be solved, 'success' is False
+        and 'message' contains the reason
+    '''
+    try:
+        with metrics.timer('reciper_product_seconds'):
+            if ingredients is not None:
+                ingredients = get_store(ingredients)
+            cstore, cnames = get_product_ingredients(product, ingredients)
+            corder = product.get('order', order)
+            result = solve_recipe(cstore, product['values'], cnames, backend=backend, order=corder, tail=product.get('tail'),
+                                  rules=rules, memo=memo, mode=mode, time_limit=time_limit, mip_gap=mip_gap,
+                                  recipe_scale=product.get('recipe_scale', 1.0))
+            if intervals and result['success']:
+                cintervals = recipe_intervals(cstore, product['values'], cnames, num_samples=intervals, rules=rules, order=corder,
+                                              tail=product.get('tail'), method=backend.method if backend is not None else 'highs',
+                                              point=result)
+                result['intervals'] = cintervals['intervals']
+    except Exception as err:
+        metrics.inc('reciper_product_errors_total')
+        logger.warning('failed to solve product %s: %s' % (product['name'], err))
+        result = {'success': False, 'status': -1, 'message': str(err), 'amounts': {}, 'units': {}, 'residuals': {}}
+    result['name'] = product['name']
+    return result
+
+
+# the known ingredients store, solver backend, result cache and solve_product() options for the worker processes (set by
+# the pool initializer so the ingredients are parsed once per worker and not pickled with every product)
+_worker_store = None
+_worker_backend = None
+_worker_memo = None
+_worker_options = {}
+
+
+def _init_worker(ingredients, method, memo, options):
+    global _worker_store, _worker_backend, _worker_memo, _worker_options
+    # a forked worker starts with a copy of the main process metrics, which would be merged back once per worker
+    metrics.reset()
+    if ingredients is not None:
+        _worker_store = get_store(ingredients)
+    _worker_backend = LPBackend(method)
+    _worker_memo = ResultCache() if memo else None
+    _worker_options = options
+
+
+def _solve_worker(product):
+    # return the worker metrics recorded for the product, so they are merged into the main process metrics
+    result = solve_product(product, _worker_store, _worker_backend, memo=_worker_memo, **_worker_options)
+    return result, metrics.pop()
+
+
+def _solve_joint_worker(products):
+    results = solve_joint(products, _worker_store, _worker_options['method'], _worker_options['order'], _worker_options['rules'])
+    return results, metrics.pop()
+
+
+def _group_key(product):
+    '''Sort key putting the products with the same ingredients and values next to each other'''
+    cingredients = product['ingredients']
+    if isinstance(cingredients, dict):
+        cingredients = list(cingredients.keys())
+    return (cingredients, sorted(product['values'].items()))
+
+
+def _iter_windows(products, window):
+    '''Split the products to lists of window products (the last one can be shorter)'''
+    cwindow = []
+    for cproduct in products:
+        cwindow.append(cproduct)
+        if len(cwindow) >= window:
+            yield cwindow
+            cwindow = []
+    if cwindow:
+        yield cwindow
+
+
+def iter_solve_products(products, ingredients=None, processes=None, chunksize=16, method='highs', order=False, intervals=0,
+                        rules='fda', memo=True, window=10000, mode='lp', joint=0, time_limit=10.0, mip_gap=1e-4):
+    '''Solve the recipes of the products using a process pool, yielding each result as soon as it is solved
+
+    The products are read (and solved) window products at a time, so memory does not grow with the number of products
+
+    Parameters
+    ----------
+    products : iterable of dict
+        the products (as returned from iter_labels())
+    ingredients, processes, chunksize, method, order, intervals, rules, memo, mode, joint, time_limit, mip_gap :
+        see solve_products(). With memo, the products are grouped by their ingredients within each window. With joint,
+        the products sharing a sub-recipe must be in the same window
+    window : int, optional
+        number of products read at a time
+
+    Yields
+    ------
+    (int, dict)
+        the product index (in products) and its solve_product() result
+    '''
+    if intervals and mode != 'lp':
+        raise ValueError('the confidence intervals need the lp mode (mode is %s)' % mode)
+    if joint:
+        if mode != 'lp' or intervals:
+            raise ValueError('the joint solve needs the lp mode and no intervals')
+        options = {'method': method, 'order': order, 'rules': rules}
+    else:
+        options = {'order': order, 'intervals': intervals, 'rules': rules, 'mode': mode, 'time_limit': time_limit, 'mip_gap': mip_gap}
+    pool = None
+    if processes == 1:
+        if ingredients is not None:
+            ingredients = get_store(ingredients)
+        backend = LPBackend(method)
+        result_cache = ResultCache() if memo else None
+    else:
+        pool = Pool(processes, initializer=_init_worker, initargs=(ingredients, method, memo, options))
+    try:
+        start = 0
+        for cwindow in _iter_windows(products, window):
+            if joint:
+                yield from _iter_joint(cwindow, start, ingredients, pool, joint, options)
+                start += len(cwindow)
+                continue
+            solve_order = list(range(len(cwindow)))
+            if memo:
+                solve_order.sort(key=lambda x: _group_key(cwindow[x]))
+            if pool is None:
+                for idx in solve_order:
+                    yield start + idx, solve_product(cwindow[idx], ingredients, backend, memo=result_cache, **options)
+            else:
+                cresults = pool.imap(_solve_worker, [cwindow[x] for x in solve_order], chunksize=chunksize)
+                for idx, (cresult, cmetrics) in zip(solve_order, cresults):
+                    metrics.merge(cmetrics)
+                    yield start + idx, cresult
+            start += len(cwindow)
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+
+def _iter_joint(products, start, ingredients, pool, size, options):
+    '''Solve a window of products as joint solves of about size products (see iter_solve_products())'''
+    groups = joint_groups(products, size)
+    if pool is None:
+        cresults = (solve_joint([products[x] for x in cgroup], ingredients, **options) for cgroup in groups)
+    else:
+        cresults = pool.imap(_solve_joint_worker, [[products[x] for x in cgroup] for cgroup in groups])
+    for cgroup, cgroup_results in zip(groups, cresults):
+        if pool is not None:
+            cgroup_results, cmetrics = cgroup_results
+            metrics.merge(cmetrics)
+        for idx, cresult in zip(cgroup, cgroup_results):
+            yield start + idx, cresult
+
+
+def solve_products(products, ingredients=None, processes=None, chunksize=16, method='highs', order=False, intervals=0,
+                   rules='fda', memo=True, mode='lp', joint=0, time_limit=10.0, mip_gap=1e-4):
+    '''Solve the recipes of all the products using a process pool
+
+    Parameters
+    ----------
+    products : list of dict
+        the products (as returned from read_labels())
+    ingredients : dict of {str: dict} or IngredientStore or None, optional
+        the known ingredients, used for products with a list of ingredient names
+    processes : int or None, optional
+        number of worker processes. None to use the number of cpus, 1 to solve in the current process
+    chunksize : int, optional
+        number of products sent to a worker at a time
+    method : str, optional
+        the linear program method ('highs', 'highs-ds' or 'highs-ipm')
+    order : bool, optional
+        True to constrain the amounts to the label ingredient order (for products without an 'order' field)
+    intervals : int, optional
+        number of perturbed problems for the ingredient amount confidence intervals. 0 to not calculate intervals.
+        Needs the lp mode
+    rules : str or None, optional
+        the label rounding rules ('fda', 'eu' or 'exact')
+    memo : bool, optional
+        True to reuse the results of identical products, and warm start the solve of products with the same ingredients
+        from each other (the products are solved grouped by their ingredients)
+    mode : str, optional
+        the solver mode ('lp', 'milp', 'nnls' or 'lsq', see solve_recipe())
+    joint : int, optional
+        0 to solve each product separately. Otherwise, the number of products solved together as one block diagonal
+        linear program, with the shared sub-recipes coupled (see joint.solve_joint()). Needs the lp mode and no intervals
+    time_limit : float or None, optional
+        the 'milp' mode search time limit per product (seconds). The best solution found so far is used when it is reached
+    mip_gap : float, optional
+        the 'milp' mode relative gap at which the search stops
+
+    Returns
+    -------
+    list of dict
+        the solve_product() result for each product, in the same order as products
+    '''
+    logger.info('solving %d products' % len(products))
+    results = [None] * len(products)
+    for idx, cresult in iter_solve_products(products, ingredients, processes, chunksize, method, order, intervals, rules, memo,
+                                            window=max(len(products), 1), mode=mode, joint=joint, time_limit=time_limit,
+                                            mip_gap=mip_gap):
+        results[idx] = cresult
+    return results
@@ -0,0 +1,327 @@
+# reciper cache - persistent on-disk cache of the nutrient database responses
+
+from logging import getLogger
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from .metrics import metrics
+
+logger = getLogger(__name__)
+
+# the default location of the cache database
+DEFAULT_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'reciper', 'nutrients.sqlite')
+
+# the entry types stored in the cache (search results, food details, normalized per gram values and
+# the food_id resolved for raw ingredient names)
+KINDS = ('search', 'food', 'per_gram', 'alias')
+
+
+class OfflineError(LookupError):
+    '''Raised when a lookup is not in the cache and the network is not allowed'''
+    pass
+
+
+def is_offline(offline=None):
+    '''Get the offline mode
+
+    Parameters
+    ----------
+    offline : bool or None, optional
+        the requested offline mode. None to use offline mode if the RECIPER_OFFLINE environment variable is set
+
+    Returns
+    -------
+    bool
+    '''
+    if offline is None:
+        return os.environ.get('RECIPER_OFFLINE', '') not in ('', '0')
+    return bool(offline)
+
+
+def normalize_query(query):
+    '''Normalize a search query so equivalent queries share a cache entry
+
+    Parameters
+    ----------
+    query : str
+
+    Returns
+    -------
+    str
+        the query in lower case with single spaces between words
+    '''
+    return ' '.join(str(query).lower().split())
+
+
+class NutrientCache:
+    def __init__(self, filename=None, ttl=30 * 24 * 3600, max_entries=100000, flush_entries=256, flush_interval=10.0):
+        '''Create (or open) the sqlite nutrient cache
+
+        Parameters
+        ----------
+        filename : str or None, optional
+            the sqlite database file. None to use DEFAULT_CACHE_FILE. ':memory:' for a non persistent cache
+        ttl : float or None, optional
+            number of seconds an entry is valid for. None for no expiry
+        max_entries : int or None, optional
+            the maximal number of entries (per kind). When exceeded, the least recently used entries are removed.
+            None for no limit
+        flush_entries : int, optional
+            the access times of the cache hits are buffered (so a hit does not write to the database), and written when
+            this number of hits is buffered
+        flush_interval : float, optional
+            the buffered access times are also written on the first hit after this number of seconds since the last write
+        '''
+        if filename is None:
+            filename = DEFAULT_CACHE_FILE
+        if filename != ':memory:':
+            dirname = os.path.dirname(filename)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+        self.filename = filename
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = {ckind: 0 for ckind in KINDS}
+        self.misses = {ckind: 0 for ckind in KINDS}
+        self.flush_entries = flush_entries
+        self.flush_interval = flush_interval
+        # the buffered access times of the cache hits, by (kind, key)
+        self._accessed = {}
+        self._flushed = time.monotonic()
+        # the connection is shared between threads (i.e. the lookup threads), protected by the lock
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(filename, check_same_thread=False)
+        with self._lock, self._con:
+            self._con.execute('CREATE TABLE IF NOT EXISTS entries (kind TEXT, key TEXT, data TEXT, created REAL, accessed REAL, PRIMARY KEY (kind, key))')
+            self._con.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (kind, accessed)')
+        logger.debug('opened nutrient cache %s' % filename)
+
+    def get(self, kind, key):
+        '''Get a cached entry
+
+        Parameters
+        ----------
+        kind : str
+            the entry type ('search' for foods_search results, 'food' for food_get results)
+        key : str
+            the normalized query or the food_id
+
+        Returns
+        -------
+        the cached data, or None if not in the cache (or expired)
+        '''
+        key = str(key)
+        now = time.time()
+        with self._lock:
+            row = self._con.execute('SELECT data, created FROM entries WHERE kind=? AND key=?', (kind, key)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                logger.debug('cache entry %s:%s expired' % (kind, key))
+                with self._con:
+                    self._con.execute('DELETE FROM entries WHERE kind=? AND key=?', (kind, key))
+                row = None
+            if row is None:
+                self.misses[kind] += 1
+                metrics.inc('reciper_cache_misses_total', kind=kind)
+                return None
+            self.hits[kind] += 1
+            metrics.inc('reciper_cache_hits_total', kind=kind)
+            self._accessed[(kind, key)] = now
+            if len(self._accessed) >= self.flush_entries or time.monotonic() - self._flushed > self.flush_interval:
+                self._flush()
+        return json.loads(row[0])
+
+    def _write_accessed(self):
+        '''Write the buffered access times (called with the lock held, in a transaction)'''
+        self._flushed = time.monotonic()
+        if not self._accessed:
+            return
+        self._con.executemany('UPDATE entries SET accessed=? WHERE kind=? AND key=?',
+                              [(caccessed, ckind, ckey) for (ckind, ckey), caccessed in self._accessed.items()])
+        self._accessed = {}
+
+    def _flush(self):
+        with self._con:
+            self._write_accessed()
+
+    def flush(self):
+        '''Write the buffered access times of the cache hits to the database'''
+        with self._lock:
+            self._flush()
+
+    def set(self, kind, key, data):
+        '''Store an entry in the cache, evicting the least recently used entries if the cache is full
+
+        Parameters
+        ----------
+        kind : str
+            the entry type ('search' for foods_search results, 'food' for food_get results)
+        key : str
+            the normalized query or the food_id
+        data :
+            the json serializable data to store
+        '''
+        now = time.time()
+        with self._lock, self._con:
+            self._accessed.pop((kind, str(key)), None)
+            if self.max_entries is not None:
+                # the eviction uses the access times
+                self._write_accessed()
+            self._con.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)', (kind, str(key), json.dumps(data), now, now))
+            if self.max_entries is not None:
+                num = self._con.execute('SELECT COUNT(*) FROM entries WHERE kind=?', (kind,)).fetchone()[0]
+                if num > self.max_entries:
+                    logger.debug('evicting %d %s entries from the cache' % (num - self.max_entries, kind))
+                    self._con.execute('DELETE FROM entries WHERE rowid IN (SELECT rowid FROM entries WHERE kind=? ORDER BY accessed LIMIT ?)',
+                                      (kind, num - self.max_entries))
+
+    def items(self, kind):
+        '''Get all the (not expired) entries of a given kind
+
+        Does not update the hit/miss counters and the access times
+
+        Parameters
+        ----------
+        kind : str
+
+        Returns
+        -------
+        list of (str, data)
+            the key and data of each entry
+        '''
+        with self._lock:
+            if self.ttl is None:
+                rows = self._con.execute('SELECT key, data FROM entries WHERE kind=?', (kind,)).fetchall()
+            else:
+                rows = self._con.execute('SELECT key, data FROM entries WHERE kind=? AND created>=?', (kind, time.time() - self.ttl)).fetchall()
+        return [(x[0], json.loads(x[1])) for x in rows]
+
+    def keys(self, kind):
+        '''Get the keys of all the (not expired) entries of a given kind
+
+        Parameters
+        ----------
+        kind : str
+
+        Returns
+        -------
+        list of str
+        '''
+        return [x[0] for x in self.items(kind)]
+
+    def stats(self):
+        '''Get the cache statistics
+
+        Returns
+        -------
+        dict of {str: dict}
+            the number of 'hits', 'misses' and 'entries' per entry kind
+        '''
+        with self._lock:
+            entries = dict(self._con.execute('SELECT kind, COUNT(*) FROM entries GROUP BY kind').fetchall())
+        return {ckind: {'hits': self.hits[ckind], 'misses': self.misses[ckind], 'entries': entries.get(ckind, 0)} for ckind in KINDS}
+
+    def clear(self):
+        '''Remove all the entries from the cache'''
+        with self._lock, self._con:
+            self._accessed = {}
+            self._con.execute('DELETE FROM entries')
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._con.close()
+
+
+class CachedFatsecret:
+    def __init__(self, client=None, cache=None, offline=None):
+        '''A fatsecret client wrapper using the nutrient cache for foods_search() and food_get()
+
+        Parameters
+        ----------
+        client : NutrientSource or None, optional
+            the client used for cache misses. Can be None in offline mode
+        cache : NutrientCache or None, optional
+            the cache to use. None to open the default cache file
+        offline : bool or None, optional
+            True to never use the network (cache misses raise OfflineError).
+            None to use offline mode if the RECIPER_OFFLINE environment variable is set
+        '''
+        if cache is None:
+            cache = NutrientCache()
+        self.client = client
+        self.cache = cache
+        self.offline = is_offline(offline) or client is None
+
+    def foods_search(self, query):
+        '''Search for foods matching the query
+
+        Parameters
+        ----------
+        query : str
+
+        Returns
+        -------
+        list of dict
+            the matching foods (with the 'food_name' and 'food_id' fields)
+        '''
+        key = normalize_query(query)
+        foods = self.cache.get('search', key)
+        if foods is not None:
+            logger.debug('cache hit for search %s' % key)
+            return foods
+        if self.offline:
+            raise OfflineError('search %s not in cache (offline mode)' % key)
+        foods = self.client.foods_search(query)
+        self.cache.set('search', key, foods)
+        return foods
+
+    def food_get(self, food_id):
+        '''Get the nutritional values of a food
+
+        Parameters
+        ----------
+        food_id : str
+
+        Returns
+        -------
+        dict
+            the food details (with the 'servings' field)
+        '''
+        food = self.cache.get('food', food_id)
+        if food is not None:
+            logger.debug('cache hit for food %s' % food_id)
+            return food
+        if self.offline:
+            raise OfflineError('food %s not in cache (offline mode)' % food_id)
+        food = self.client.food_get(food_id)
+        self.cache.set('food', food_id, food)
+        return food
+
+    def get_many(self, food_ids):
+        '''Get the nutritional values of many foods, looking up all the cache misses in one bulk call
+
+        Parameters
+        ----------
+        food_ids : list of str
+
+        Returns
+        -------
+        dict of {str: dict}
+            the food details of each food_id (None for the foods not found, or not in the cache in offline mode)
+        '''
+        foods = {x: self.cache.get('food', x) for x in food_ids}
+        missing = [x for x, cfood in foods.items() if cfood is None]
+        logger.debug('%d of %d foods in cache' % (len(foods) - len(missing), len(foods)))
+        if not missing:
+            return foods
+        if self.offline:
+            logger.warning('%d foods not in cache (offline mode)' % len(missing))
+            return foods
+        for cid, cfood in self.client.get_many(missing).items():
+            if cfood is not None:
+                self.cache.set('food', cid, cfood)
+            foods[cid] = cfood
+        return foods
@@ -0,0 +1,109 @@
+# reciper command line - solve the recipes of a label file without the gui
+
+from logging import getLogger, basicConfig
+import argparse
+import importlib.util
+
+from . import batch
+from .backend import METHODS
+from .metrics import metrics
+from .output import FORMATS, get_format, open_writer, written_names
+from .solver import MODES
+from .tolerance import RULES
+
+logger = getLogger(__name__)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Solve the recipes of all products in a label file')
+    parser.add_argument('labels', help='label file (.csv or .jsonl) with the target nutritional values and ingredients of each product')
+    parser.add_argument('-i', '--ingredients', help='json file with the serving nutritional values of each ingredient name')
+    parser.add_argument('-o', '--output', help='output file (.jsonl, .csv, or a .parquet directory; default: jsonl to stdout)')
+    parser.add_argument('-f', '--format', help='output format (default: from the output file name)', choices=FORMATS)
+    parser.add_argument('--resume', help='skip the products already in the output file, and add the others to it', action='store_true')
+    parser.add_argument('-p', '--processes', help='number of worker processes (default: number of cpus)', type=int)
+    parser.add_argument('--mode', help='solver mode (lp - weighted absolute errors, milp - lp with whole servings of the ingredients '
+                        'counted in pieces, nnls - non negative least squares, lsq - least squares regularized toward a typical recipe)',
+                        choices=MODES, default='lp')
+    parser.add_argument('--time-limit', help='maximal milp search time per product (seconds, the best solution found is used)',
+                        type=float, default=10.0)
+    parser.add_argument('--mip-gap', help='relative gap from the lower bound at which the milp search stops', type=float, default=1e-4)
+    parser.add_argument('-m', '--method', help='linear program method', choices=METHODS, default='highs')
+    parser.add_argument('--lookup', help='look up the ingredients not in the ingredients file in the nutrient source (using the nutrient cache)', action='store_true')
+    parser.add_argument('--source', help='nutrient source for --lookup: fatsecret (credentials from the RECIPER_FATSECRET_KEY and '
+                        'RECIPER_FATSECRET_SECRET environment variables), the url of a fatsecret compatible server (see serve-fixtures), '
+                        'or a local food database file prefix (see import-fdc)', default='fatsecret')
+    parser.add_argument('--food-db', help='local food database file prefix (see import-fdc) to use for --lookup (same as --source prefix)')
+    parser.add_argument('--cache-file', help='nutrient cache database file')
+    parser.add_argument('--offline', help='use only the nutrient cache for --lookup (no network lookups)', action='store_true', default=None)
+    parser.add_argument('--order', help='constrain the ingredient amounts to the label order (descending weight)', action='store_true')
+    parser.add_argument('--rules', help='label rounding rules (the recipe values within the rounding range of the label values have no error)',
+                        choices=list(RULES.keys()), default='fda')
+    parser.add_argument('--no-memo', help='solve every product (do not reuse the results of identical products)', action='store_false', dest='memo')
+    parser.add_argument('--joint', help='solve this number of products together as one linear program, coupling the shared '
+                        'sub-recipes (the product \'shared\' field) between them (0 to solve each product separately)', type=int, default=0)
+    parser.add_argument('--intervals', help='number of perturbed problems for the ingredient amount confidence intervals (0 for none)', type=int, default=0)
+    parser.add_argument('--metrics', help='save the timing metrics to this file (prometheus text format if it ends with .prom, json otherwise)')
+    parser.add_argument('--log-level', help='debug log level', default=20, type=int)
+
+    args = parser.parse_args(argv)
+
+    if args.order and args.mode not in ('lp', 'milp'):
+        parser.error('--order needs --mode lp or milp')
+    if args.joint and (args.mode != 'lp' or args.intervals):
+        parser.error('--joint needs --mode lp and no --intervals')
+    if args.resume and args.output is None:
+        parser.error('--resume needs --output')
+    if (args.format or get_format(args.output)) == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+        parser.error('parquet output needs the pyarrow package (pip install pyarrow)')
+    if args.intervals and args.mode != 'lp':
+        parser.error('--intervals needs --mode lp')
+
+    basicConfig(format='%(levelname)s:%(message)s', level=args.log_level)
+
+    ingredients = None
+    if args.ingredients is not None:
+        ingredients = batch.read_ingredients(args.ingredients)
+    if args.lookup:
+        from .cache import NutrientCache
+        from .lookup import LookupService, resolve_ingredients
+        from .resolver import FoodIndex
+        from .sources import get_source_factory
+
+        if ingredients is None:
+            ingredients = {}
+        missing = sorted({x for cproduct in batch.iter_labels(args.labels) if not isinstance(cproduct['ingredients'], dict)
+                          for x in cproduct['ingredients'] if x not in ingredients})
+
+        cache = NutrientCache(args.cache_file)
+        factory, local = get_source_factory(args.food_db if args.food_db is not None else args.source)
+        options = {'client_factory': factory, 'offline': args.offline}
+        if local:
+            # the local database is not a network service, so no rate limit and no offline mode
+            options.update({'offline': False, 'rate': None, 'retries': 0})
+        with LookupService(cache=cache, **options) as service:
+            ingredients.update(resolve_ingredients(missing, service, FoodIndex.from_cache(cache)))
+        cache.close()
+    # the products are read, solved and written in a stream, so the memory does not grow with the number of products
+    products = batch.iter_labels(args.labels)
+    if args.resume:
+        done = written_names(args.output, args.format)
+        logger.info('skipping %d products already in %s' % (len(done), args.output))
+        products = (x for x in products if x['name'] not in done)
+    results = batch.iter_solve_products(products, ingredients=ingredients, processes=args.processes, method=args.method, order=args.order,
+                                        intervals=args.intervals, rules=args.rules, memo=args.memo,
+                                        mode=args.mode, joint=args.joint, time_limit=args.time_limit, mip_gap=args.mip_gap)
+    num_solved = 0
+    num_failed = 0
+    with open_writer(args.output, args.format, resume=args.resume) as writer:
+        for _, cres in results:
+            writer.write(cres)
+            num_solved += 1
+            num_failed += not cres['success']
+    logger.info('solved %d products (%d failed)' % (num_solved, num_failed))
+    if args.metrics is not None:
+        metrics.save(args.metrics)
+
+
+if __name__ == '__main__':
+    main()
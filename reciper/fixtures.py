@@ -0,0 +1,183 @@
+# reciper fixtures - a local stand-in for the fatsecret api, replaying recorded responses in process or over http
+#
+# python -m reciper serve-fixtures fixtures.json --port 8765 (then use --source http://127.0.0.1:8765)
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import getLogger, basicConfig
+import argparse
+import copy
+import json
+import threading
+import time
+import urllib.parse
+
+from .cache import normalize_query
+from .sources import API_PATH, NutrientSource, get_source_factory, standard_food, standard_foods
+
+logger = getLogger(__name__)
+
+
+def load_fixtures(filename):
+    '''Load recorded fatsecret responses
+
+    Parameters
+    ----------
+    filename : str
+        json file with the 'searches' (dict of {query: list of foods}) and 'foods' (dict of {food_id: food}) fields
+
+    Returns
+    -------
+    dict
+    '''
+    with open(filename) as fl:
+        fixtures = json.load(fl)
+    fixtures['searches'] = {normalize_query(k): standard_foods(v) for k, v in fixtures.get('searches', {}).items()}
+    fixtures['foods'] = {str(k): standard_food(v) for k, v in fixtures.get('foods', {}).items()}
+    return fixtures
+
+
+class FixtureSource(NutrientSource):
+    bulk = True
+
+    def __init__(self, filename=None, latency=0.0, fixtures=None):
+        '''A nutrient source replaying recorded foods_search() and food_get() responses
+
+        Parameters
+        ----------
+        filename : str or None, optional
+            the recorded responses json file (see load_fixtures())
+        latency : float, optional
+            the simulated network latency (seconds) of each call (a get_many() call counts as one call)
+        fixtures : dict or None, optional
+            the already loaded recorded responses (to not read the file again)
+        '''
+        if fixtures is None:
+            fixtures = load_fixtures(filename)
+        self.fixtures = fixtures
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _call(self):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def foods_search(self, query):
+        self._call()
+        return copy.deepcopy(self.fixtures['searches'].get(normalize_query(query), []))
+
+    def food_get(self, food_id):
+        self._call()
+        food_id = str(food_id)
+        if food_id not in self.fixtures['foods']:
+            raise ValueError('food_id %s not in the recorded responses' % food_id)
+        return copy.deepcopy(self.fixtures['foods'][food_id])
+
+    def get_many(self, food_ids):
+        self._call()
+        return {x: copy.deepcopy(self.fixtures['foods'].get(str(x))) for x in food_ids}
+
+
+class _FixtureHandler(BaseHTTPRequestHandler):
+    # keep the connection open between requests
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != API_PATH:
+            self._send(404, {'error': {'code': 404, 'message': 'unknown path %s' % url.path}})
+            return
+        params = dict(urllib.parse.parse_qsl(url.query))
+        method = params.get('method')
+        source = self.server.source
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        try:
+            if method == 'foods.search':
+                foods = source.foods_search(params.get('search_expression', ''))
+                data = {'foods': {'food': foods, 'max_results': len(foods), 'total_results': len(foods), 'page_number': 0}}
+            elif method in ('food.get', 'food.get.v2'):
+                data = {'food': source.food_get(params.get('food_id', ''))}
+            elif method == 'foods.get_many':
+                food_ids = [x for x in params.get('food_ids', '').split(',') if x]
+                data = {'foods': {'food': [x for x in source.get_many(food_ids).values() if x is not None]}}
+            else:
+                # the fatsecret error code for an unknown method
+                data = {'error': {'code': 3, 'message': 'unknown method %s' % method}}
+        except (LookupError, ValueError) as err:
+            # the fatsecret error code for an invalid id
+            data = {'error': {'code': 106, 'message': str(err)}}
+        self._send(200, data)
+
+    def _send(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug('%s - %s' % (self.address_string(), format % args))
+
+
+def make_server(source, host='127.0.0.1', port=0, latency=0.0):
+    '''Create a fatsecret compatible http server for a nutrient source
+
+    The server answers the fatsecret REST api foods.search and food.get.v2 methods (json format), and the foods.get_many
+    method (food_ids as a ',' separated list) for bulk lookups.
+
+    Parameters
+    ----------
+    source : NutrientSource
+        the source of the responses (i.e. a FixtureSource or a local food database)
+    host : str, optional
+    port : int, optional
+        0 to use a free port
+    latency : float, optional
+        the simulated network latency (seconds) of each request
+
+    Returns
+    -------
+    http.server.ThreadingHTTPServer
+        call serve_forever() to start (i.e. in a thread). The url is in the 'url' attribute
+    '''
+    server = ThreadingHTTPServer((host, port), _FixtureHandler)
+    server.daemon_threads = True
+    server.source = source
+    server.latency = latency
+    server.url = 'http://%s:%d' % server.server_address[:2]
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve recorded fatsecret responses (or a local food database) as a fatsecret '
+                                     'compatible http server, for offline load testing')
+    parser.add_argument('fixtures', help='recorded responses json file (with the searches and foods fields), or a local food '
+                        'database file prefix (see import-fdc)')
+    parser.add_argument('--host', help='host name to listen on', default='127.0.0.1')
+    parser.add_argument('--port', help='port to listen on', type=int, default=8765)
+    parser.add_argument('--latency', help='simulated network latency of each request (seconds)', type=float, default=0.0)
+    parser.add_argument('--log-level', help='debug log level', default=20, type=int)
+
+    args = parser.parse_args(argv)
+
+    basicConfig(format='%(levelname)s:%(message)s', level=args.log_level)
+    if args.fixtures.endswith('.json'):
+        source = FixtureSource(args.fixtures)
+    else:
+        source = get_source_factory(args.fixtures)[0]()
+    server = make_server(source, args.host, args.port, args.latency)
+    logger.info('serving %s at %s' % (args.fixtures, server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
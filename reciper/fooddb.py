@@ -0,0 +1,269 @@
+# reciper fooddb - local nutrient database imported from the USDA FoodData Central csv files
+#
+# the nutrient values are stored as a memory mapped float32 array (one row per food, one column per nutrient,
+# per 100 g), and the food names, ids, portions and a word index in a json file next to it
+
+from collections import defaultdict
+from logging import getLogger, basicConfig
+import argparse
+import csv
+import json
+import os
+
+import numpy as np
+
+from .matrix import NUTRIENT_SCHEMA, NUTRIENTS
+from .resolver import get_tokens, normalize_name
+from .sources import NutrientSource
+
+logger = getLogger(__name__)
+
+# the FoodData Central nutrient ids of each nutrient, by preference (i.e. energy is not reported as 1008 for
+# foundation foods, only as the atwater energy)
+FDC_NUTRIENTS = {'calories': (1008, 2047, 2048), 'carbohydrate': (1005, 1050), 'protein': (1003,), 'fat': (1004, 1085),
+                 'saturated_fat': (1258,), 'polyunsaturated_fat': (1293,), 'monounsaturated_fat': (1292,),
+                 'trans_fat': (1257,), 'cholesterol': (1253,), 'sodium': (1093,), 'potassium': (1092,),
+                 'fiber': (1079,), 'sugar': (2000, 1063), 'vitamin_a': (1106,), 'vitamin_c': (1162,),
+                 'calcium': (1087,), 'iron': (1089,)}
+
+# the nutrients fatsecret reports as percent of the daily value, and the daily value in the FoodData Central unit
+# (the schema unit - vitamin a in ug RAE, the others in mg)
+DAILY_VALUES = {k: v['dv'] for k, v in NUTRIENT_SCHEMA.items() if v['serving_unit'] == '%dv'}
+
+# the food_id prefix of the local foods (so they do not clash with the fatsecret food_ids in the cache and index)
+ID_PREFIX = 'fdc-'
+
+
+def _read_csv(filename):
+    with open(filename, newline='', encoding='utf-8') as fl:
+        yield from csv.DictReader(fl)
+
+
+def _portion_description(row):
+    description = (row.get('portion_description') or '').strip()
+    if description and description != 'Quantity not specified':
+        return description
+    modifier = (row.get('modifier') or '').strip()
+    amount = (row.get('amount') or '').strip()
+    return ' '.join(x for x in (amount, modifier) if x) or 'portion'
+
+
+def import_fdc(fdc_dir, prefix, data_types=None):
+    '''Import the FoodData Central csv files into a local food database
+
+    Parameters
+    ----------
+    fdc_dir : str
+        the directory of the extracted FoodData Central csv download (with food.csv, food_nutrient.csv and optionally
+        food_portion.csv)
+    prefix : str
+        the output file name prefix (prefix.npy for the nutrient values and prefix.json for the names and index)
+    data_types : list of str or None, optional
+        the food data types to import (i.e. 'foundation_food', 'sr_legacy_food', 'survey_fndds_food', 'branded_food').
+        None to import all foods
+
+    Returns
+    -------
+    int
+        the number of imported foods
+    '''
+    fdc_ids = []
+    names = []
+    rows = {}
+    for crow in _read_csv(os.path.join(fdc_dir, 'food.csv')):
+        if data_types is not None and crow.get('data_type') not in data_types:
+            continue
+        rows[crow['fdc_id']] = len(fdc_ids)
+        fdc_ids.append(crow['fdc_id'])
+        names.append(crow['description'])
+    logger.info('importing %d foods' % len(fdc_ids))
+
+    # read all candidate nutrient ids, and keep the preferred one present for each food
+    candidates = {}
+    for cnutrient, cids in FDC_NUTRIENTS.items():
+        for cid in cids:
+            candidates[str(cid)] = len(candidates)
+    values = np.full([len(fdc_ids), len(candidates)], np.nan, dtype=np.float32)
+    for crow in _read_csv(os.path.join(fdc_dir, 'food_nutrient.csv')):
+        crow_idx = rows.get(crow['fdc_id'])
+        ccol = candidates.get(crow['nutrient_id'])
+        if crow_idx is None or ccol is None:
+            continue
+        try:
+            values[crow_idx, ccol] = float(crow['amount'])
+        except (TypeError, ValueError):
+            logger.debug('bad amount %r for food %s nutrient %s' % (crow['amount'], crow['fdc_id'], crow['nutrient_id']))
+
+    data = np.lib.format.open_memmap(prefix + '.npy', mode='w+', dtype=np.float32, shape=(len(fdc_ids), len(NUTRIENTS)))
+    data[:] = np.nan
+    for idx, cnutrient in enumerate(NUTRIENTS):
+        for cid in reversed(FDC_NUTRIENTS.get(cnutrient, ())):
+            cvals = values[:, candidates[str(cid)]]
+            present = ~np.isnan(cvals)
+            data[present, idx] = cvals[present]
+        if cnutrient in DAILY_VALUES:
+            data[:, idx] *= 100 / DAILY_VALUES[cnutrient]
+    data.flush()
+    del data
+
+    portions = defaultdict(list)
+    portion_file = os.path.join(fdc_dir, 'food_portion.csv')
+    if os.path.exists(portion_file):
+        for crow in _read_csv(portion_file):
+            crow_idx = rows.get(crow['fdc_id'])
+            if crow_idx is None:
+                continue
+            try:
+                cgrams = float(crow['gram_weight'])
+            except (TypeError, ValueError):
+                continue
+            if cgrams > 0:
+                portions[crow_idx].append((_portion_description(crow), cgrams))
+
+    tokens = defaultdict(list)
+    for idx, cname in enumerate(names):
+        for ctoken in get_tokens(normalize_name(cname)):
+            tokens[ctoken].append(idx)
+
+    index = {'nutrients': list(NUTRIENTS), 'fdc_ids': fdc_ids, 'names': names, 'portions': portions, 'tokens': tokens}
+    with open(prefix + '.json', 'w') as fl:
+        json.dump(index, fl)
+    logger.info('imported %d foods into %s' % (len(fdc_ids), prefix))
+    return len(fdc_ids)
+
+
+class LocalFoodDatabase(NutrientSource):
+    # no network calls, so no rate limit or offline mode
+    local = True
+    bulk = True
+
+    def __init__(self, prefix):
+        '''Open a local food database created by import_fdc()
+
+        The database is a nutrient source (returning fatsecret style foods), so it can be used instead of fatsecret
+        (i.e. as the LookupService client).
+
+        Parameters
+        ----------
+        prefix : str
+            the database file name prefix (prefix.npy and prefix.json)
+        '''
+        self.prefix = prefix
+        self.data = np.load(prefix + '.npy', mmap_mode='r')
+        with open(prefix + '.json') as fl:
+            index = json.load(fl)
+        self.nutrients = index['nutrients']
+        self.fdc_ids = index['fdc_ids']
+        self.names = index['names']
+        self.portions = {int(k): v for k, v in index['portions'].items()}
+        self._tokens = {k: np.array(v, dtype=np.int32) for k, v in index['tokens'].items()}
+        self._rows = {x: idx for idx, x in enumerate(self.fdc_ids)}
+        self._name_lengths = np.fromiter((len(x) for x in self.names), dtype=np.int32, count=len(self.names))
+        logger.debug('opened local food database %s with %d foods' % (prefix, len(self.fdc_ids)))
+
+    def __len__(self):
+        return len(self.fdc_ids)
+
+    def foods_search(self, query, max_results=20):
+        '''Search for foods matching the query
+
+        Foods sharing more words with the query come first (and shorter names first for the same number of words)
+
+        Parameters
+        ----------
+        query : str
+        max_results : int, optional
+
+        Returns
+        -------
+        list of dict
+            the matching foods (with the 'food_name' and 'food_id' fields)
+        '''
+        postings = [self._tokens[x] for x in get_tokens(normalize_name(query)) if x in self._tokens]
+        if not postings:
+            return []
+        rows, counts = np.unique(np.concatenate(postings), return_counts=True)
+        best = rows[np.lexsort((rows, self._name_lengths[rows], -counts))[:max_results]]
+        return [{'food_id': ID_PREFIX + self.fdc_ids[x], 'food_name': self.names[x], 'food_type': 'Generic'} for x in best]
+
+    def food_get(self, food_id):
+        '''Get the nutritional values of a food
+
+        Parameters
+        ----------
+        food_id : str
+            the local food_id (from foods_search())
+
+        Returns
+        -------
+        dict
+            the food details in the fatsecret format. The servings are 100 g and the food portions
+        '''
+        row = self._get_row(food_id)
+        if row is None:
+            raise ValueError('food_id %s not in the local food database' % food_id)
+        return self._food(row, self.data[row].tolist())
+
+    def get_many(self, food_ids):
+        '''Get the nutritional values of many foods
+
+        The nutrient rows of all the foods are read from the memory mapped array at once.
+
+        Parameters
+        ----------
+        food_ids : list of str
+            the local food_ids (from foods_search())
+
+        Returns
+        -------
+        dict of {str: dict}
+            the food details of each food_id (None for the foods not in the database)
+        '''
+        foods = {x: None for x in food_ids}
+        found = [(x, self._get_row(x)) for x in foods]
+        found = [x for x in found if x[1] is not None]
+        if not found:
+            return foods
+        values = self.data[np.array([x[1] for x in found])].tolist()
+        for (cid, crow), cvalues in zip(found, values):
+            foods[cid] = self._food(crow, cvalues)
+        return foods
+
+    def _get_row(self, food_id):
+        food_id = str(food_id)
+        if not food_id.startswith(ID_PREFIX):
+            return None
+        return self._rows.get(food_id[len(ID_PREFIX):])
+
+    def _food(self, row, values):
+        servings = [self._serving('100 g', 'g', 100.0, values)]
+        for cdescription, cgrams in self.portions.get(row, ()):
+            servings.append(self._serving(cdescription, cdescription, cgrams, values))
+        return {'food_id': ID_PREFIX + self.fdc_ids[row], 'food_name': self.names[row], 'food_type': 'Generic',
+                'servings': {'serving': servings}}
+
+    def _serving(self, description, measurement, grams, values):
+        serving = {'serving_description': description, 'measurement_description': measurement,
+                   'metric_serving_amount': grams, 'metric_serving_unit': 'g', 'number_of_units': 1.0}
+        for cnutrient, cval in zip(self.nutrients, values):
+            # nan for the nutrients missing in the food
+            if cval == cval:
+                serving[cnutrient] = cval * grams / 100
+        return serving
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import the USDA FoodData Central csv files into a local food database')
+    parser.add_argument('fdc_dir', help='directory of the extracted FoodData Central csv files')
+    parser.add_argument('prefix', help='output file name prefix (creates prefix.npy and prefix.json)')
+    parser.add_argument('--data-type', help='food data type to import (can be repeated, default: all)', action='append', dest='data_types')
+    parser.add_argument('--log-level', help='debug log level', default=20, type=int)
+
+    args = parser.parse_args(argv)
+
+    basicConfig(format='%(levelname)s:%(message)s', level=args.log_level)
+    import_fdc(args.fdc_dir, args.prefix, args.data_types)
+
+
+if __name__ == '__main__':
+    main()
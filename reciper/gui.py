@@ -20,34 +20,62 @@ from PyQt5.QtWidgets import (QHBoxLayout, QVBoxLayout,
                              QWidget, QPushButton, QLabel,
                              QComboBox, QLineEdit, QCheckBox, QSpinBox, QDoubleSpinBox,
                              QDialog, QDialogButtonBox, QApplication, QListWidget)
-import matplotlib
 import numpy as np
-from scipy.optimize import linprog
-from fatsecret import Fatsecret
 
-
-# we need this because of the skbio import that probably imports pyplot?
-# must have it before importing calour (Since it imports skbio)
-matplotlib.use("Qt5Agg")
+from reciper.cache import NutrientCache
+from reciper.jobs import JobManager
+from reciper.lookup import LookupService
+from reciper.matrix import NUTRIENT_SCHEMA, NUTRIENTS
+from reciper.resolver import FoodIndex
+from reciper.session import SolveSession
+from reciper.sources import get_source_factory
+from reciper.units import get_servings, normalize_food
 
 __version__ = 0.1
 
+# the label parameters used when no values were entered yet
+DEFAULT_PARAMS = ('calories', 'carbohydrate', 'fat', 'fiber', 'sodium', 'protein', 'sugar', 'saturated_fat')
+
 logger = getLogger(__name__)
 # set the logger output according to log.cfg
 basicConfig(format='%(levelname)s:%(message)s', level=logging.DEBUG)
 
 
 class AppWindow(QtWidgets.QMainWindow):
-    def __init__(self):
+    def __init__(self, cache_file=None, offline=None, food_db=None, source=None):
         '''Start the gui
+
+        Parameters
+        ----------
+        cache_file : str or None, optional
+            the nutrient cache database file. None to use the default cache file
+        offline : bool or None, optional
+            True to use only the nutrient cache (no network lookups). None to use the RECIPER_OFFLINE environment variable
+        food_db : str or None, optional
+            the local food database file prefix (see reciper.fooddb) to search instead of fatsecret. None to use the source
+        source : str or None, optional
+            the nutrient source (see reciper.sources.get_source_factory()). None to use fatsecret
         '''
         super().__init__()
-        self.ingredients = []
-        self.values = {}
-        ck = 'b06a262d0e0b4321981d8c15d2cb866b'
-        cs = 'bf6c1708b7ec4fedb7c3d0381ea7a2db'
-        fs = Fatsecret(ck, cs)
-        self.fs = fs
+        factory, local = get_source_factory(food_db if food_db is not None else source)
+        if local:
+            self.lookup = LookupService(factory, cache=NutrientCache(cache_file), offline=False, rate=None, retries=0)
+        else:
+            self.lookup = LookupService(factory, cache=NutrientCache(cache_file), offline=offline)
+        # previously seen foods, to resolve ingredients without asking
+        self.index = FoodIndex.from_cache(self.lookup.cache)
+        # the lookups and solves run as jobs in a thread pool, and the results are delivered to the gui thread. A new
+        # job with the same key (i.e. searching the same ingredient again, or re-solving after an edit) cancels the old one
+        self.jobs = JobManager()
+        self.jobs.progress.connect(self.show_progress)
+        # the lookup results waiting for a user selection (shown one at a time)
+        self._lookup_queue = []
+        self._lookup_dialog = None
+        # the open label values dialog
+        self._values_dialog = None
+        # the session keeps the ingredients, label values and solver state between edits
+        self.session = SolveSession()
+        self.auto_solve = False
 
         self.setAttribute(QtCore.Qt.WA_DeleteOnClose)
         main_widget = QWidget(self)
@@ -64,6 +92,22 @@ class AppWindow(QtWidgets.QMainWindow):
         button.clicked.connect(self.get_recipe)
         layout.addWidget(button)
 
+        button = QPushButton('cancel')
+        button.clicked.connect(self.jobs.cancel_all)
+        layout.addWidget(button)
+
+        self.w_order = QCheckBox('ingredients in label order')
+        self.w_order.stateChanged.connect(self.set_order)
+        layout.addWidget(self.w_order)
+
+        self.w_whole = QCheckBox('whole servings of pieces (slices, eggs)')
+        self.w_whole.stateChanged.connect(self.set_whole)
+        layout.addWidget(self.w_whole)
+
+        self.w_auto_solve = QCheckBox('re-solve on each change')
+        self.w_auto_solve.stateChanged.connect(self.set_auto_solve)
+        layout.addWidget(self.w_auto_solve)
+
         button = QPushButton('remove')
         button.clicked.connect(self.remove)
         layout.addWidget(button)
@@ -74,154 +118,233 @@ class AppWindow(QtWidgets.QMainWindow):
         self.w_ingredient_list = QListWidget()
         layout.addWidget(self.w_ingredient_list)
 
-        self.ingredients = {}
-
         self.setWindowTitle('Reciper version %s' % __version__)
         main_widget.setFocus()
         self.setCentralWidget(main_widget)
         self.show()
 
+    def closeEvent(self, event):
+        self.jobs.cancel_all()
+        self.jobs.wait()
+        self.lookup.close()
+        self.lookup.cache.close()
+        super().closeEvent(event)
+
+    def show_progress(self, key, percent, message):
+        self.statusBar().showMessage('%s: %s' % (key, message))
+
     def remove(self):
         sitem = self.w_ingredient_list.selectedItems()
         sitemtxt = sitem[0].text()
-        del self.ingredients[sitemtxt]
+        self.session.remove(sitemtxt)
         self.w_ingredient_list.takeItem(self.w_ingredient_list.row(sitem[0]))
+        self.edited()
 
     def search(self):
+        '''Search for the ingredients in the search box (',' separated) concurrently
+        '''
         logger.debug('search')
-        ingredient = self.w_search_ingredient.text()
-        logger.debug('searching for term %s' % ingredient)
-        if ingredient in self.ingredients:
-            pass
-        foods = self.fs.foods_search(ingredient)
+        for ingredient in self.w_search_ingredient.text().split(','):
+            ingredient = ingredient.strip()
+            if not ingredient:
+                continue
+            match = self.index.resolve(ingredient)
+            if match is not None:
+                logger.info('ingredient %s resolved to %s (score %f)' % (ingredient, match[1], match[2]))
+                self.jobs.submit('food %s' % match[1], self._get_food, match[0],
+                                 done=lambda res, name=match[1]: self.lookup_done('resolved', name, res), failed=self.lookup_failed)
+                continue
+            logger.debug('searching for term %s' % ingredient)
+            self.jobs.submit('search %s' % ingredient, self._search_food, ingredient,
+                             done=lambda res, ingredient=ingredient: self.lookup_done('search', ingredient, res),
+                             failed=self.lookup_failed)
+
+    def _search_food(self, job, ingredient):
+        job.progress(0, 'searching')
+        return self.lookup.foods_search(ingredient)
+
+    def _get_food(self, job, food_id):
+        job.progress(0, 'getting the food details')
+        return self.lookup.food_get(food_id)
+
+    def lookup_done(self, kind, key, result):
+        '''Called (in the gui thread) when a lookup job submitted by search() is done
+
+        The results are queued and shown one at a time, since each needs a user selection. The selection dialogs are
+        not modal, so the jobs and the main window keep running while they are open
+        '''
+        self._lookup_queue.append((kind, key, result))
+        self._next_lookup()
+
+    def _next_lookup(self):
+        while self._lookup_queue and self._lookup_dialog is None:
+            ckind, ckey, cresult = self._lookup_queue.pop(0)
+            if ckind == 'search':
+                self.select_food(ckey, cresult)
+            else:
+                self.add_food(ckey, cresult, confirm=ckind != 'resolved')
+
+    def _open_dialog(self, window, finished):
+        '''Open a non blocking dialog, calling finished(result) when it is closed and then showing the next lookup'''
+        def _finished(result):
+            self._lookup_dialog = None
+            finished(result)
+            self._next_lookup()
+
+        self._lookup_dialog = window
+        window.finished.connect(_finished)
+        window.open()
+
+    def lookup_failed(self, key, message):
+        logger.warning('%s failed: %s' % (key, message))
+
+    def select_food(self, ingredient, foods):
+        '''Let the user select the food matching the search, and get its details
+        '''
         fooddata = {}
         for cfood in foods:
             if 'food_name' in cfood:
                 if 'food_id' in cfood:
                     fooddata[cfood['food_name']] = cfood['food_id']
-                # print(cfood['food_name'])
-                # print(cfood['food_id'])
-        slist = SListWindow(listdata=list(fooddata.keys()))
-        res = slist.exec_()
-        if res == 0:
-            return
-        res = slist.w_list.selectedItems()
-        selected_food = res[0].text()
-        selected_id = fooddata[selected_food]
-        res = self.fs.food_get(selected_id)
+                    self.index.add(cfood['food_id'], cfood['food_name'])
+        slist = SListWindow(listdata=list(fooddata.keys()), listname=ingredient)
+
+        def _selected(res):
+            if res == 0:
+                return
+            res = slist.w_list.selectedItems()
+            if not res:
+                return
+            selected_food = res[0].text()
+            selected_id = fooddata[selected_food]
+            # remember the selection, so next time this ingredient is resolved without asking
+            self.index.add_alias(ingredient, selected_id, self.lookup.cache)
+            self.jobs.submit('food %s' % selected_food, self._get_food, selected_id,
+                             done=lambda res: self.lookup_done('food', selected_food, res), failed=self.lookup_failed)
+
+        self._open_dialog(slist, _selected)
+
+    def add_food(self, selected_food, res, confirm=True):
+        '''Show the selected food details and add it to the ingredients
+
+        Parameters
+        ----------
+        selected_food : str
+            the food name
+        res : dict
+            the food details
+        confirm : bool, optional
+            True to show the food details and ask the user to confirm
+        '''
         logger.debug(res)
         if 'servings' not in res:
             logger.warning('servings not in res')
             return
-        serving = res['servings']
-        serving = serving['serving']
-        if isinstance(serving, list):
-            # serving = self.select_serving(serving)
-            serving = serving[0]
+        # solve in grams, using the per gram values of the food
+        serving = normalize_food(res, self.lookup.cache)
+        if serving is None:
+            logger.warning('no metric serving for %s, using the first serving' % selected_food)
+            serving = get_servings(res)[0]
+
+        def _add(res=1):
+            if res == 0:
+                return
+            if selected_food not in self.session:
+                self.w_ingredient_list.addItem(selected_food)
+            self.session.add(selected_food, serving)
+            self.edited()
 
         # show the info about the ingredient
-        info = []
-        info.append(selected_food)
-        info.append('measurement unit: %s' % serving.get('measurement_description'))
-        for ck, cv in serving.items():
-            info.append('%s: %s' % (ck, cv))
-        info_list = SListWindow(info)
-        res = info_list.exec_()
-        print(res)
-        if res == 0:
+        if confirm:
+            info = []
+            info.append(selected_food)
+            info.append('measurement unit: %s' % serving.get('measurement_description'))
+            for ck, cv in serving.items():
+                info.append('%s: %s' % (ck, cv))
+            self._open_dialog(SListWindow(info), _add)
             return
-        self.ingredients[selected_food] = serving
-        self.w_ingredient_list.addItem(selected_food)
-
-    def select_serving(self, servings):
-        for cserving in servings:
-            if 'metric_serving_unit' not in cserving:
-                logger.info('metric_serving_unit not found in %s. skipping' % cserving)
-                continue
-            if cserving['metric_serving_unit'] != 'g':
-                logger.info('found serving unit %s. skipping' % cserving['metric_serving_unit'])
-                continue
-            if 'metric_serving_amount' not in cserving:
-                print('metric_serving_amount not in cserving')
-                print(cserving)
-                return
-            # print(cserving['metric_serving_amount'])
-            print(float(cserving['calories']) / float(cserving['metric_serving_amount']))
+        _add()
 
     def get_values(self, widget):
         logger.debug('values')
+        if self._values_dialog is not None:
+            self._values_dialog.raise_()
+            return
         keys = []
-        params = ['calories', 'carbohydrate', 'fat', 'fiber', 'sodium', 'protein', 'sugar', 'saturated_fat']
-        for ckey in params:
-            cdict = {'type': 'string', 'label': ckey, 'default': str(self.values.get(ckey, 0))}
+        # the full nutrient panel, using the parameters of the previous values (or the common label parameters)
+        used = self.session.values if self.session.values else DEFAULT_PARAMS
+        for ckey in NUTRIENTS:
+            clabel = '%s (%s)' % (ckey, NUTRIENT_SCHEMA[ckey]['unit'])
+            cdict = {'type': 'string', 'label': clabel, 'default': str(self.session.values.get(ckey, 0))}
             keys.append(cdict)
-            cdict = {'type': 'bool', 'label': 'use_%s' % ckey, 'default': True}
+            cdict = {'type': 'bool', 'label': 'use_%s' % ckey, 'default': ckey in used}
             keys.append(cdict)
-        # for ckey in ['calcium', 'cholesterol', 'iron', 'monounsaturated_fat', 'polyunsaturated_fat', 'saturated_fat', 'potassium', 'trans_fat', 'vitamin_a', 'vitamin_c']:
-        #     cdict = {'type': 'string', 'label': ckey}
-        #     keys.append(cdict)
-        #     cdict = {'type': 'bool', 'label': 'use_%s' % ckey, 'default': False}
-        #     keys.append(cdict)
 
-        res = dialog(keys, expdat=None)
+        # non blocking, so the running jobs keep delivering their results while the values are edited
+        self._values_dialog = dialog(keys, expdat=None, finished=self._set_values)
+
+    def _set_values(self, res):
+        '''Set the label values from the values dialog output (None if cancelled)'''
+        self._values_dialog = None
         if res is None:
             return
-        self.values = {}
-        for ckey in params:
+        values = {}
+        for ckey in NUTRIENTS:
             if res['use_%s' % ckey]:
-                self.values[ckey] = float(res[ckey])
-        logger.info('obtained %d new values' % len(self.values))
-        logger.debug(self.values)
+                values[ckey] = float(res['%s (%s)' % (ckey, NUTRIENT_SCHEMA[ckey]['unit'])])
+        logger.info('obtained %d new values' % len(values))
+        logger.debug(values)
+        self.session.set_values(values)
+        self.edited()
+
+    def set_order(self):
+        self.session.set_options(order=self.w_order.isChecked())
+        self.edited()
+
+    def set_whole(self):
+        # the milp search is time limited, so a hard recipe does not keep the solve job running
+        self.session.set_options(mode='milp' if self.w_whole.isChecked() else 'lp')
+        self.edited()
+
+    def set_auto_solve(self):
+        self.auto_solve = self.w_auto_solve.isChecked()
+        self.edited()
+
+    def edited(self):
+        '''Called after each edit of the session - re-solve in the background if automatic re-solve is on'''
+        if self.auto_solve:
+            self.solve()
+
+    def solve(self):
+        '''Solve the recipe in the background (cancelling a running solve), and show it when done'''
+        if len(self.session) == 0 or len(self.session.values) == 0:
+            logger.warning('no ingredients or values to solve')
+            return
+        self.jobs.submit('recipe', self._solve, done=self.show_recipe)
+
+    def _solve(self, job):
+        job.progress(0, 'solving %d ingredients' % len(self.session))
+        return self.session.solve()
 
     def get_recipe(self):
-        logger.debug('recipe for %d values using %d ingredients' % (len(self.values), len(self.ingredients)))
-
-        # we have the variables:
-        # one per ingredient
-        # one per remainder parameter (normalized to 1)
-        # and we minimize the remaineder parameters
-
-        eq_coeff = []
-        eq_const = []
-        # ineq_coeff = []
-        # ineq_const = []
-        # # create the positivity inequalities (all ingredients >= 0)
-        # for idx, cingredient in enumerate(self.ingredients.values()):
-        #     cc = np.zeros(len(self.ingredients) + len(self.parameters))
-        #     cc[idx] = 1
-        #     ineq_coeff.append(cc)
-        #     ineq_const.append(0)
-
-        # main equations (per calories/protein/etc.)
-        for idx2, (cparam, cval) in enumerate(self.values.items()):
-            cc = np.zeros(len(self.ingredients) + len(self.values))
-            for idx, (cname, cingredient) in enumerate(self.ingredients.items()):
-                if cparam not in cingredient:
-                    logger.warning('parameter %s not in ingredient %s' % (cparam, cname))
-                    continue
-                cc[idx] = cingredient[cparam]
-            # the free parameter for each parameters, to get the error
-            cc[len(self.ingredients) + idx2] = 1
-            eq_coeff.append(cc)
-            eq_const.append(cval)
-        # order limits (ingredient1 >= ingredient2 >= ...)
-        # need units of igredients to be correct
-
-        # and the minimize function - sum of the per parameter errors
-        err_eq = np.zeros(len(self.ingredients) + len(self.values))
-        for idx, cval in enumerate(self.values.values()):
-            err_eq[len(self.ingredients) + idx] = 1 / (cval + 0.0000001)
-
-        # and solve
-        res = linprog(err_eq, A_eq=eq_coeff, b_eq=eq_const)
-        logger.debug(res)
-        for idx, cingredient in enumerate(self.ingredients.keys()):
-            print('ingredient %s (%s) - amount %f' % (cingredient, self.ingredients[cingredient].get('measurement_description', 'NA'), res.x[idx]))
-        for idx, cparam in enumerate(self.values.keys()):
-            print('parameter %s error %f' % (cparam, res.x[idx + len(self.ingredients)]))
+        res = self.session.result
+        if res is None:
+            self.solve()
+            return
+        self.show_recipe(res)
+
+    def show_recipe(self, res):
+        if res is None:
+            return
+        if not res['success']:
+            logger.warning('recipe solve failed: %s' % res['message'])
+        for cingredient, camount in res['amounts'].items():
+            print('ingredient %s (%s) - amount %f' % (cingredient, res['units'][cingredient], camount))
+        for cparam, cerr in res['residuals'].items():
+            print('parameter %s error %f' % (cparam, cerr))
 
 
-def dialog(items, expdat=None, title=None):
+def dialog(items, expdat=None, title=None, finished=None):
     '''Create a dialog with the given items for then experiment
 
     Parameters
@@ -241,12 +364,16 @@ def dialog(items, expdat=None, title=None):
         the experiment to use to get the field/values items (needed if item is 'field'/'value')
     title : str (optional)
         title of the dialog
+    finished : callable or None (optional)
+        None to show the dialog modally and return the output. Otherwise, the dialog is opened without blocking and
+        finished(output) is called when it is closed
 
     Returns
     -------
     output : dict or None
         if cancel was selected, return None
-        otherwise, a dict with label as key, value as val
+        otherwise, a dict with label as key, value as val.
+        If finished is not None, the open dialog window (the output is passed to finished)
     '''
     class DialogWindow(QDialog):
         def __init__(self, items, title=None, expdat=None):
@@ -429,6 +556,14 @@ def dialog(items, expdat=None, title=None):
             return output
 
     aw = DialogWindow(items, expdat=expdat)
+    if finished is not None:
+        def _finished(res):
+            finished(aw.get_output(items) if res else None)
+
+        aw.finished.connect(_finished)
+        aw.open()
+        aw.adjustSize()
+        return aw
     aw.show()
     # if app_created:
     #     app.references.add(self.aw)
@@ -560,18 +695,24 @@ def _value_to_dtype(val, exp, field):
     return svalue
 
 
-def main():
-    parser = argparse.ArgumentParser(description='GUI for Calour microbiome analysis')
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Reciper GUI')
     parser.add_argument('--log-level', help='debug log level', default=20, type=int)
+    parser.add_argument('--cache-file', help='nutrient cache database file')
+    parser.add_argument('--offline', help='use only the nutrient cache (no network lookups)', action='store_true', default=None)
+    parser.add_argument('--source', help='nutrient source: fatsecret (credentials from the RECIPER_FATSECRET_KEY and RECIPER_FATSECRET_SECRET '
+                        'environment variables), the url of a fatsecret compatible server, or a local food database file prefix',
+                        default='fatsecret')
+    parser.add_argument('--food-db', help='local food database file prefix (see import-fdc) to search instead of fatsecret')
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     logger.setLevel(args.log_level)
 
     logger.info('starting reciper version %s' % __version__)
     # app = QtWidgets.QApplication(sys.argv)
     app, app_created = init_qt5()
-    window = AppWindow()
+    window = AppWindow(cache_file=args.cache_file, offline=args.offline, food_db=args.food_db, source=args.source)
     window.show()
     sys.exit(app.exec_())
 
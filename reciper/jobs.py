@@ -0,0 +1,196 @@
+# reciper jobs - cancellable background jobs for the GUI (QThreadPool), so solves and lookups never block the event loop
+
+from logging import getLogger
+import threading
+
+from PyQt5 import QtCore
+
+logger = getLogger(__name__)
+
+
+class JobSignals(QtCore.QObject):
+    '''Deliver the job progress and result from the pool thread to the gui thread'''
+    # job, percent, message
+    progress = QtCore.pyqtSignal(object, int, str)
+    # job (with the result or error set)
+    finished = QtCore.pyqtSignal(object)
+
+
+class Job(QtCore.QRunnable):
+    def __init__(self, key, func, *args):
+        '''A cancellable job run in a QThreadPool thread
+
+        Cancelling is cooperative: a job cancelled before it starts is not run, and the result of a job cancelled while
+        running is discarded. The job function can check job.cancelled to stop early.
+
+        Parameters
+        ----------
+        key : str
+            the job key. A newer job with the same key (i.e. a new solve of the same recipe) cancels this one
+        func : callable
+            called (in the pool thread) as func(job, *args). Can call job.progress() to report progress
+        args :
+            the additional func arguments
+        '''
+        super().__init__()
+        self.key = key
+        self.func = func
+        self.args = args
+        self.result = None
+        self.error = None
+        # created in the gui thread, so the signals are delivered there
+        self.signals = JobSignals()
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def progress(self, percent, message=''):
+        '''Report the job progress (called by the job function)
+
+        Parameters
+        ----------
+        percent : int
+            the completed percent (0-100)
+        message : str, optional
+        '''
+        if not self.cancelled:
+            self.signals.progress.emit(self, percent, message)
+
+    def run(self):
+        if not self.cancelled:
+            try:
+                self.result = self.func(self, *self.args)
+            except Exception as err:
+                self.error = str(err)
+        self.signals.finished.emit(self)
+
+
+class JobManager(QtCore.QObject):
+    # key, percent, message
+    progress = QtCore.pyqtSignal(str, int, str)
+
+    def __init__(self, max_threads=None, parent=None):
+        '''Run jobs in a thread pool, keeping only the newest job of each key
+
+        The done/failed callbacks are called in the gui thread, and only for the newest job of the key that was not
+        cancelled, so stale results are never shown.
+
+        Parameters
+        ----------
+        max_threads : int or None, optional
+            the maximal number of concurrent jobs. None for the QThreadPool default (the number of cores)
+        parent : QObject or None, optional
+        '''
+        super().__init__(parent)
+        self.pool = QtCore.QThreadPool()
+        if max_threads is not None:
+            self.pool.setMaxThreadCount(max_threads)
+        self._jobs = {}
+        self._callbacks = {}
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def __contains__(self, key):
+        return key in self._jobs
+
+    def submit(self, key, func, *args, done=None, failed=None):
+        '''Run a job, cancelling the running job with the same key
+
+        Parameters
+        ----------
+        key : str
+            the job key
+        func : callable
+            called (in a pool thread) as func(job, *args)
+        args :
+            the additional func arguments
+        done : callable or None, optional
+            called (in the gui thread) with the func result
+        failed : callable or None, optional
+            called (in the gui thread) with the key and the error message. None to log a warning
+
+        Returns
+        -------
+        Job
+        '''
+        # the replaced job is cancelled without the 'cancelled' progress (the new job is reported instead)
+        self._cancel(key)
+        job = Job(key, func, *args)
+        job.signals.progress.connect(self._progress)
+        job.signals.finished.connect(self._finished)
+        self._jobs[key] = job
+        self._callbacks[key] = (done, failed)
+        self.pool.start(job)
+        return job
+
+    def cancel(self, key):
+        '''Cancel the job with the key (if running)
+
+        Parameters
+        ----------
+        key : str
+
+        Returns
+        -------
+        bool
+            True if a job was cancelled
+        '''
+        if not self._cancel(key):
+            return False
+        self.progress.emit(key, 100, 'cancelled')
+        return True
+
+    def _cancel(self, key):
+        job = self._jobs.pop(key, None)
+        self._callbacks.pop(key, None)
+        if job is None:
+            return False
+        job.cancel()
+        logger.debug('cancelled job %s' % key)
+        return True
+
+    def cancel_all(self):
+        for ckey in list(self._jobs):
+            self.cancel(ckey)
+
+    def wait(self, msecs=-1):
+        '''Wait for the running jobs to finish
+
+        Parameters
+        ----------
+        msecs : int, optional
+            the maximal wait (milliseconds). -1 for no limit
+
+        Returns
+        -------
+        bool
+            True if all jobs finished
+        '''
+        return self.pool.waitForDone(msecs)
+
+    def _progress(self, job, percent, message):
+        if self._jobs.get(job.key) is job:
+            self.progress.emit(job.key, percent, message)
+
+    def _finished(self, job):
+        if self._jobs.get(job.key) is not job or job.cancelled:
+            # a stale job (replaced by a newer job or cancelled)
+            return
+        del self._jobs[job.key]
+        done, failed = self._callbacks.pop(job.key)
+        if job.error is not None:
+            self.progress.emit(job.key, 100, 'failed')
+            if failed is None:
+                logger.warning('job %s failed: %s' % (job.key, job.error))
+            else:
+                failed(job.key, job.error)
+            return
+        self.progress.emit(job.key, 100, 'done')
+        if done is not None:
+            done(job.result)
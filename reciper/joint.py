@@ -0,0 +1,310 @@
+# reciper joint - solve many products as one block diagonal linear program, optionally coupling shared sub-recipes
+
+from logging import getLogger
+
+import numpy as np
+
+from .backend import LPBackend
+from .metrics import metrics
+from .solver import _get_result, build_interval_problem, get_store
+from .tolerance import error_scales, label_intervals
+
+logger = getLogger(__name__)
+
+
+def get_shared(product):
+    '''Get the shared sub-recipes of a product
+
+    Parameters
+    ----------
+    product : dict
+        the product. The optional 'shared' field is a dict of {sub-recipe name: ingredient names}, or of
+        {sub-recipe name: {'ingredients': ingredient names, 'scale': float}}, where scale is the amount of the sub-recipe
+        in the product relative to the other products using it (default 1, i.e. the same amount per label basis)
+
+    Returns
+    -------
+    dict of {str: (list of str, float)}
+        the ingredient names and scale of each shared sub-recipe
+    '''
+    shared = {}
+    for cname, cval in product.get('shared', {}).items():
+        if isinstance(cval, dict):
+            shared[cname] = (list(cval.get('ingredients', [])), float(cval.get('scale', 1)))
+        else:
+            shared[cname] = (list(cval), 1.0)
+        if shared[cname][1] <= 0:
+            raise ValueError('the scale of the shared sub-recipe %s of product %s is not positive' % (cname, product['name']))
+    return shared
+
+
+def build_coupling(blocks, shared, num_cols):
+    '''Build the coupling equalities of the shared sub-recipes
+
+    For each sub-recipe, the scaled amount of each of its ingredients in each product using it equals the scaled amount
+    in the first product using it (x[p, i] / scale[p] - x[first, i] / scale[first] == 0)
+
+    Parameters
+    ----------
+    blocks : list of (int, list of str)
+        the first variable index and the ingredient names of each product block
+    shared : list of dict
+        the get_shared() result of each product
+    num_cols : int
+        total number of variables
+
+    Returns
+    -------
+    A_eq : scipy.sparse.csr_matrix
+        the coupling equalities matrix
+    b_eq : numpy.ndarray
+        the coupling equalities values (all 0)
+    '''
+    import scipy.sparse
+
+    # the column and scale of each sub-recipe ingredient in the first product using it
+    first = {}
+    rows, cols, vals = [], [], []
+    for (coffset, cnames), cshared in zip(blocks, shared):
+        cpositions = {x: pos for pos, x in enumerate(cnames)}
+        for csub, (cingredients, cscale) in cshared.items():
+            for cingredient in cingredients:
+                if cingredient not in cpositions:
+                    logger.warning('shared ingredient %s of %s not in product ingredients' % (cingredient, csub))
+                    continue
+                ccol = coffset + cpositions[cingredient]
+                if (csub, cingredient) not in first:
+                    first[(csub, cingredient)] = (ccol, cscale)
+                    continue
+                fcol, fscale = first[(csub, cingredient)]
+                crow = len(rows) // 2
+                rows += [crow, crow]
+                cols += [ccol, fcol]
+                vals += [1 / cscale, -1 / fscale]
+    num_rows = len(rows) // 2
+    A_eq = scipy.sparse.csr_matrix((vals, (rows, cols)), shape=(num_rows, num_cols))
+    return A_eq, np.zeros(num_rows)
+
+
+def _offsets(sizes):
+    '''Get the start index of each of consecutive blocks of the sizes'''
+    return np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(int)
+
+
+def _repeat_index(sizes):
+    '''Get the block number and the index within the block of each element of consecutive blocks of the sizes'''
+    block = np.repeat(np.arange(len(sizes)), sizes)
+    return block, np.arange(len(block)) - _offsets(sizes)[block]
+
+
+def build_block_coeff(coeffs):
+    '''Build the block diagonal coefficient matrix of many products in one pass
+
+    Parameters
+    ----------
+    coeffs : list of numpy.ndarray
+        the parameter x ingredient coefficient matrix of each product
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        the block diagonal matrix (the parameters and ingredients of product i start at the sums of the previous sizes)
+    '''
+    import scipy.sparse
+
+    num_values = np.array([x.shape[0] for x in coeffs], dtype=int)
+    num_ingredients = np.array([x.shape[1] for x in coeffs], dtype=int)
+    block, idx = _repeat_index(num_values * num_ingredients)
+    rows = _offsets(num_values)[block] + idx // np.maximum(num_ingredients[block], 1)
+    cols = _offsets(num_ingredients)[block] + idx % np.maximum(num_ingredients[block], 1)
+    vals = np.concatenate([x.ravel() for x in coeffs]) if coeffs else np.zeros(0)
+    return scipy.sparse.csr_matrix((vals, (rows, cols)), shape=(num_values.sum(), num_ingredients.sum()))
+
+
+def build_block_order_constraints(num_ingredients, heads, ordered, num_cols, tail_fraction=0.02):
+    '''Build the ingredient order and tail inequalities of many products in one pass
+
+    The rows are the same as solver.build_order_constraints() of each product, with the columns offset to the product
+    ingredient variables (the first variables, product after product).
+
+    Parameters
+    ----------
+    num_ingredients : numpy.ndarray
+        number of ingredients of each product
+    heads : numpy.ndarray
+        number of ordered ingredients of each product (the index of the first ingredient after "contains less than 2% of",
+        or the number of ingredients)
+    ordered : numpy.ndarray of bool
+        False for the products without the order rows (only the tail rows)
+    num_cols : int
+        total number of variables
+    tail_fraction : float, optional
+        the maximal fraction of the product total weight for each tail ingredient
+
+    Returns
+    -------
+    A_ub : scipy.sparse.csr_matrix
+        the order rows (x[i+1] - x[i] <= 0) of all the products, followed by the tail rows (x[i] - tail_fraction * sum(x) <= 0)
+    b_ub : numpy.ndarray
+        the inequality constraints values (all 0)
+    '''
+    import scipy.sparse
+
+    offsets = _offsets(num_ingredients)
+    num_order = np.where(ordered, np.maximum(heads - 1, 0), 0)
+    block, idx = _repeat_index(num_order)
+    order_rows = np.arange(len(block))
+    rows = [order_rows, order_rows]
+    cols = [offsets[block] + idx, offsets[block] + idx + 1]
+    vals = [-np.ones(len(block)), np.ones(len(block))]
+    # each tail row has -tail_fraction for all the product ingredients, and 1 - tail_fraction for its own ingredient
+    tail_block, tail_idx = _repeat_index(num_ingredients - heads)
+    tail_row, ingredient = _repeat_index(num_ingredients[tail_block])
+    tail_block = tail_block[tail_row]
+    rows.append(len(order_rows) + tail_row)
+    cols.append(offsets[tail_block] + ingredient)
+    vals.append(np.where(ingredient == heads[tail_block] + tail_idx[tail_row], 1 - tail_fraction, -tail_fraction))
+    num_rows = len(order_rows) + len(tail_idx)
+    A_ub = scipy.sparse.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))), shape=(num_rows, num_cols))
+    return A_ub, np.zeros(num_rows)
+
+
+def solve_joint(products, ingredients=None, method='highs', order=False, rules='fda', tail_fraction=0.02, couple=True):
+    '''Solve the recipes of many products as a single block diagonal linear program
+
+    Each product has its own ingredient and error variables (as in solve_recipe()), so without coupling the result is
+    the same as solving each product separately, but with a single solver call. With couple, products sharing
+    a sub-recipe (the product 'shared' field, see get_shared()) have coupled amounts of the sub-recipe ingredients,
+    so the label values of all these products are used to find the sub-recipe.
+
+    The coefficient matrices of all the products are stacked into one block diagonal matrix, and the linear program
+    is built once for it (as in uncertainty.solve_batch()), so the problem size does not add python work per product.
+
+    Parameters
+    ----------
+    products : list of dict
+        the products (as returned from batch.read_labels())
+    ingredients : dict of {str: dict} or IngredientStore or None, optional
+        the known ingredients, used for products with a list of ingredient names
+    method : str, optional
+        the linear program method ('highs', 'highs-ds' or 'highs-ipm')
+    order : bool, optional
+        True to constrain the amounts to the label ingredient order (for products without an 'order' field)
+    rules : str or None, optional
+        the label rounding rules ('fda', 'eu' or 'exact')
+    tail_fraction : float, optional
+        the maximal fraction of the total weight for each tail ingredient
+    couple : bool, optional
+        True to add the shared sub-recipe coupling equalities. False to solve the products independently
+
+    Returns
+    -------
+    list of dict
+        the solve_recipe() style result of each product, with the product 'name'. The 'iterations' are of the joint solve
+    '''
+    import scipy.sparse
+    from scipy.optimize import OptimizeResult
+
+    from .batch import get_product_ingredients
+
+    if ingredients is not None:
+        ingredients = get_store(ingredients)
+    results = [None] * len(products)
+    # the index, store, ingredient names, coefficients, label value intervals, ordered ingredients and order flag
+    # of each product to solve
+    problems = []
+    shared = []
+    with metrics.timer('reciper_matrix_seconds'):
+        for idx, cproduct in enumerate(products):
+            try:
+                cstore, cnames = get_product_ingredients(cproduct, ingredients)
+                ccoeff = cstore.matrix(cproduct['values'].keys(), cnames)
+                clow, chigh = label_intervals(cproduct['values'], rules)
+                ctail = cproduct.get('tail')
+                chead = len(cnames) if ctail is None else min(max(ctail, 0), len(cnames))
+                cshared = get_shared(cproduct) if couple else {}
+            except Exception as err:
+                metrics.inc('reciper_product_errors_total')
+                logger.warning('failed to solve product %s: %s' % (cproduct['name'], err))
+                results[idx] = {'success': False, 'status': -1, 'message': str(err), 'amounts': {}, 'units': {}, 'residuals': {},
+                                'name': cproduct['name']}
+                continue
+            problems.append((idx, cstore, cnames, ccoeff, clow, chigh, chead, bool(cproduct.get('order', order))))
+            shared.append(cshared)
+        if not problems:
+            return results
+        num_ingredients = np.array([len(x[2]) for x in problems], dtype=int)
+        targets = np.concatenate([np.fromiter(products[x[0]]['values'].values(), dtype=float, count=x[3].shape[0]) for x in problems])
+        low = np.concatenate([x[4] for x in problems])
+        high = np.concatenate([x[5] for x in problems])
+        c, A_ub, b_ub, A_eq, b_eq = build_interval_problem(build_block_coeff([x[3] for x in problems]), targets, low, high,
+                                                           1 / error_scales(targets, low, high))
+        A_order, b_order = build_block_order_constraints(num_ingredients, np.array([x[6] for x in problems], dtype=int),
+                                                         np.array([x[7] for x in problems], dtype=bool), len(c), tail_fraction)
+        if A_order.shape[0] > 0:
+            A_ub = scipy.sparse.vstack([A_ub, A_order], format='csr')
+            b_ub = np.concatenate([b_ub, b_order])
+        # the ingredient variables of each product are the first variables, product after product
+        blocks = list(zip(_offsets(num_ingredients).tolist(), [x[2] for x in problems]))
+        A_couple, b_couple = build_coupling(blocks, shared, len(c))
+        if A_couple.shape[0] > 0:
+            logger.debug('%d coupling equalities' % A_couple.shape[0])
+            A_eq = scipy.sparse.vstack([A_eq, A_couple], format='csr')
+            b_eq = np.concatenate([b_eq, b_couple])
+    logger.debug('joint solve of %d products (%d variables)' % (len(problems), len(c)))
+    res = LPBackend(method, warm_start=False).solve(c, A_eq=A_eq, b_eq=b_eq, A_ub=A_ub, b_ub=b_ub)
+    metrics.inc('reciper_joint_solves_total')
+
+    for (coffset, cnames), (idx, cstore, _, ccoeff, _, _, _, _) in zip(blocks, problems):
+        cres = OptimizeResult(success=res.success, status=res.status, message=res.message, nit=res.get('nit', 0), x=None)
+        if res.x is not None:
+            cres.x = res.x[coffset:coffset + len(cnames)]
+        results[idx] = _get_result(cres, cstore, products[idx]['values'], cnames, cstore.rows(cnames), ccoeff)
+        results[idx]['name'] = products[idx]['name']
+    return results
+
+
+def joint_groups(products, size):
+    '''Split the products to groups of about size products, keeping the products sharing a sub-recipe in the same group
+
+    Parameters
+    ----------
+    products : list of dict
+        the products
+    size : int
+        the group size (a group can be larger if more products share a sub-recipe)
+
+    Returns
+    -------
+    list of list of int
+        the product indices of each group
+    '''
+    # connect the products sharing a sub-recipe (union find on the sub-recipe names)
+    parent = list(range(len(products)))
+
+    def _find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    owner = {}
+    for idx, cproduct in enumerate(products):
+        for csub in cproduct.get('shared', {}):
+            if csub in owner:
+                parent[_find(idx)] = _find(owner[csub])
+            else:
+                owner[csub] = idx
+    components = {}
+    for idx in range(len(products)):
+        components.setdefault(_find(idx), []).append(idx)
+    groups = []
+    cgroup = []
+    for ccomponent in components.values():
+        if cgroup and len(cgroup) + len(ccomponent) > size:
+            groups.append(cgroup)
+            cgroup = []
+        cgroup = cgroup + ccomponent
+    if cgroup:
+        groups.append(cgroup)
+    return groups
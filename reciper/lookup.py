@@ -0,0 +1,323 @@
+# reciper lookup - concurrent, rate limited nutrient database lookups
+
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+import threading
+import time
+
+from .cache import CachedFatsecret, NutrientCache, is_offline
+from .metrics import metrics
+from .sources import FatsecretSource
+from .units import normalize_foods
+
+logger = getLogger(__name__)
+
+# the number of foods in each bulk lookup call
+BATCH_SIZE = 50
+
+
+class RateLimiter:
+    def __init__(self, rate=5.0, burst=None):
+        '''A thread safe token bucket rate limiter
+
+        Parameters
+        ----------
+        rate : float or None, optional
+            the maximal number of calls per second. None for no limit
+        burst : int or None, optional
+            the maximal number of calls without waiting. None to use the rate (rounded up)
+        '''
+        self.rate = rate
+        if burst is None:
+            burst = max(int(rate or 1), 1)
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        '''Wait until a call is allowed'''
+        if self.rate is None:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class RateLimitedClient:
+    def __init__(self, client, limiter=None, retries=3, backoff=0.5):
+        '''A nutrient database client wrapper with rate limiting and retries with exponential backoff
+
+        Parameters
+        ----------
+        client : NutrientSource
+            the client (with the foods_search() and food_get() methods, and optionally get_many())
+        limiter : RateLimiter or None, optional
+            the rate limiter (shared between the clients of all threads). None for no limit
+        retries : int, optional
+            the number of retries of a failed call
+        backoff : float, optional
+            the wait (seconds) before the first retry. Doubled for each additional retry
+        '''
+        self.client = client
+        self.limiter = limiter
+        self.retries = retries
+        self.backoff = backoff
+
+    def _call(self, func, *args):
+        call = func.__name__
+        for cattempt in range(self.retries + 1):
+            if self.limiter is not None:
+                with metrics.timer('reciper_rate_limit_wait_seconds'):
+                    self.limiter.acquire()
+            try:
+                with metrics.timer('reciper_lookup_seconds', call=call):
+                    return func(*args)
+            except Exception as err:
+                metrics.inc('reciper_lookup_errors_total', call=call)
+                if cattempt == self.retries:
+                    raise
+                wait = self.backoff * 2 ** cattempt
+                logger.info('lookup failed (%s), retrying in %.1f seconds' % (err, wait))
+                time.sleep(wait)
+
+    def foods_search(self, query):
+        return self._call(self.client.foods_search, query)
+
+    def food_get(self, food_id):
+        return self._call(self.client.food_get, food_id)
+
+    def get_many(self, food_ids):
+        '''Get the details of many foods
+
+        A source with a native bulk lookup (the bulk attribute) is called once (one rate limit token and retried as a whole).
+        Otherwise each food is a separate rate limited and retried food_get() call.
+
+        Parameters
+        ----------
+        food_ids : list of str
+
+        Returns
+        -------
+        dict of {str: dict}
+            the food details of each food_id (None for the foods not found)
+        '''
+        if getattr(self.client, 'bulk', False):
+            return self._call(self.client.get_many, food_ids)
+        foods = {}
+        for cid in food_ids:
+            try:
+                foods[cid] = self._call(self.client.food_get, cid)
+            except Exception as err:
+                logger.warning('lookup of food %s failed: %s' % (cid, err))
+                foods[cid] = None
+        return foods
+
+
+class LookupService:
+    def __init__(self, client_factory=FatsecretSource, cache=None, offline=None, max_workers=8, rate=5.0, retries=3, backoff=0.5,
+                 batch_size=BATCH_SIZE):
+        '''Concurrent nutrient database lookups using a thread pool
+
+        Each worker thread has its own client (so its http connection is reused between calls), and all threads share
+        the nutrient cache and the rate limiter.
+
+        Parameters
+        ----------
+        client_factory : callable, optional
+            called (once per thread) to create the nutrient source (see reciper.sources.get_source_factory())
+        cache : NutrientCache or None, optional
+            the nutrient cache. None to open the default cache file
+        offline : bool or None, optional
+            True to use only the cache (lookups not in the cache raise OfflineError).
+            None to use the RECIPER_OFFLINE environment variable
+        max_workers : int, optional
+            number of concurrent lookups
+        rate : float or None, optional
+            the maximal number of network calls per second (over all threads). None for no limit
+        retries : int, optional
+            number of retries for a failed network call
+        backoff : float, optional
+            the wait (seconds) before the first retry. Doubled for each additional retry
+        batch_size : int, optional
+            the number of foods in each bulk lookup call of get_many()
+        '''
+        if cache is None:
+            cache = NutrientCache()
+        self.cache = cache
+        self.offline = is_offline(offline)
+        self.client_factory = client_factory
+        self.limiter = RateLimiter(rate)
+        self.retries = retries
+        self.backoff = backoff
+        self.batch_size = batch_size
+        # set when the first client is created: True if the source has a native bulk lookup
+        self._bulk = False
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='reciper-lookup')
+
+    def _get_client(self):
+        '''Get the cached client of the current thread'''
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            raw = None
+            if not self.offline:
+                source = self.client_factory()
+                self._bulk = getattr(source, 'bulk', False)
+                raw = RateLimitedClient(source, self.limiter, self.retries, self.backoff)
+            client = CachedFatsecret(raw, self.cache, offline=self.offline)
+            self._local.client = client
+        return client
+
+    def foods_search(self, query):
+        '''Search for foods matching the query (in the calling thread)'''
+        return self._get_client().foods_search(query)
+
+    def food_get(self, food_id):
+        '''Get the food details (in the calling thread)'''
+        return self._get_client().food_get(food_id)
+
+    def submit_search(self, query):
+        '''Search for foods matching the query in a worker thread
+
+        Parameters
+        ----------
+        query : str
+
+        Returns
+        -------
+        concurrent.futures.Future
+            with the list of matching foods as result
+        '''
+        return self._executor.submit(self.foods_search, query)
+
+    def submit_get(self, food_id):
+        '''Get the food details in a worker thread
+
+        Parameters
+        ----------
+        food_id : str
+
+        Returns
+        -------
+        concurrent.futures.Future
+            with the food details as result
+        '''
+        return self._executor.submit(self.food_get, food_id)
+
+    def _gather(self, futures):
+        results = {}
+        for ckey, cfuture in futures.items():
+            try:
+                results[ckey] = cfuture.result()
+            except Exception as err:
+                logger.warning('lookup of %s failed: %s' % (ckey, err))
+                results[ckey] = None
+        return results
+
+    def search_many(self, queries):
+        '''Search for all the queries concurrently
+
+        Parameters
+        ----------
+        queries : list of str
+
+        Returns
+        -------
+        dict of {str: list of dict}
+            the matching foods for each query (None if the lookup failed)
+        '''
+        return self._gather({x: self.submit_search(x) for x in queries})
+
+    def _get_batch(self, food_ids):
+        return self._get_client().get_many(food_ids)
+
+    def get_many(self, food_ids):
+        '''Get the details of all the foods concurrently
+
+        For sources with a native bulk lookup (and in offline mode), each worker gets batch_size foods in one call.
+        Otherwise each food is a separate (rate limited) call in a worker.
+
+        Parameters
+        ----------
+        food_ids : list of str
+
+        Returns
+        -------
+        dict of {str: dict}
+            the food details for each food_id (None if the lookup failed)
+        '''
+        food_ids = list(food_ids)
+        # create the client of the calling thread, to know if the source has a bulk lookup
+        self._get_client()
+        size = self.batch_size if self._bulk or self.offline else 1
+        batches = {}
+        for cstart in range(0, len(food_ids), size):
+            cbatch = food_ids[cstart:cstart + size]
+            batches[tuple(cbatch)] = self._executor.submit(self._get_batch, cbatch)
+        results = {}
+        for cbatch, cfoods in self._gather(batches).items():
+            if cfoods is None:
+                cfoods = {}
+            results.update({x: cfoods.get(x) for x in cbatch})
+        return results
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def resolve_ingredients(names, service, index=None):
+    '''Get the per gram nutritional values of ingredients, using the first search result for each name
+
+    Parameters
+    ----------
+    names : list of str
+        the ingredient names
+    service : LookupService
+    index : FoodIndex or None, optional
+        the local index of known foods. Names with a confident match in the index are not searched, and the
+        search results are added to the index. None to search all names
+
+    Returns
+    -------
+    dict of {str: dict}
+        the per gram serving dict of each ingredient that was found
+    '''
+    food_ids = {}
+    if index is not None:
+        for cname in names:
+            cmatch = index.resolve(cname)
+            if cmatch is not None:
+                food_ids[cname] = cmatch[0]
+        logger.debug('%d ingredients resolved by the local index' % len(food_ids))
+    foods = service.search_many([x for x in names if x not in food_ids])
+    for cname, cfoods in foods.items():
+        cfoods = [x for x in cfoods or [] if 'food_id' in x]
+        if not cfoods:
+            logger.warning('no food found for ingredient %s' % cname)
+            continue
+        food_ids[cname] = cfoods[0]['food_id']
+        if index is not None:
+            for cfood in cfoods:
+                index.add(cfood['food_id'], cfood.get('food_name', ''))
+    details = service.get_many(set(food_ids.values()))
+    found = [x for x in food_ids if details.get(food_ids[x]) is not None]
+    ingredients = {}
+    for cname, cserving in zip(found, normalize_foods([details[food_ids[x]] for x in found], service.cache)):
+        if cserving is not None:
+            ingredients[cname] = cserving
+    logger.info('resolved %d of %d ingredients' % (len(ingredients), len(names)))
+    return ingredients
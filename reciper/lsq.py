@@ -0,0 +1,96 @@
+# reciper lsq - least squares solver modes (alternatives to the linear program)
+
+from logging import getLogger
+
+import numpy as np
+
+from .metrics import metrics
+
+logger = getLogger(__name__)
+
+# the least squares modes ('nnls' - non negative least squares, 'lsq' - bounded least squares regularized toward a prior)
+LSQ_MODES = ('nnls', 'lsq')
+
+
+def default_prior(num_ingredients, total):
+    '''Get the typical recipe prior amounts - decreasing in the label order (proportional to 1 / rank)
+
+    Parameters
+    ----------
+    num_ingredients : int
+    total : float
+        the total amount of the prior
+
+    Returns
+    -------
+    numpy.ndarray
+    '''
+    prior = 1 / np.arange(1, num_ingredients + 1)
+    return prior * total / prior.sum()
+
+
+def solve_least_squares(coeff, targets, weights, mode='nnls', prior=None, alpha=0.1):
+    '''Find the non negative ingredient amounts minimizing the weighted squared error from the label values
+
+    Parameters
+    ----------
+    coeff : numpy.ndarray
+        the parameter x ingredient coefficient matrix
+    targets : numpy.ndarray
+        the label value of each parameter
+    weights : numpy.ndarray
+        the weight of each parameter error
+    mode : str, optional
+        'nnls' for non negative least squares (scipy.optimize.nnls).
+        'lsq' for bounded least squares (scipy.optimize.lsq_linear) with a Tikhonov term alpha * (x - prior) / total,
+        which selects a solution near the prior when the label values do not determine the amounts
+    prior : numpy.ndarray or None, optional
+        the prior amounts for 'lsq'. None to use default_prior() scaled to the total of the nnls solution
+    alpha : float, optional
+        the regularization weight for 'lsq' (relative to the weighted relative errors)
+
+    Returns
+    -------
+    scipy.optimize.OptimizeResult
+        with the fields 'x', 'fun' (the squared weighted error), 'status', 'success', 'message' and 'nit', as in linprog
+    '''
+    from scipy.optimize import OptimizeResult, lsq_linear, nnls
+
+    if mode not in LSQ_MODES:
+        raise ValueError('unknown least squares mode %s. Use one of %s' % (mode, LSQ_MODES))
+    coeff = np.asarray(coeff, dtype=float)
+    A = coeff * weights[:, np.newaxis]
+    b = targets * weights
+    res = OptimizeResult()
+    res.nit = 0
+    res.status = 0
+    res.success = True
+    res.message = '%s: solved' % mode
+    with metrics.timer('reciper_solve_seconds', method=mode):
+        try:
+            x, _ = nnls(A, b)
+        except RuntimeError as err:
+            # the iteration limit
+            x = None
+            res.status = 1
+            res.success = False
+            res.message = 'nnls: %s' % err
+        if mode == 'lsq':
+            if prior is None:
+                if x is None:
+                    # scale the prior to the bounded least squares solution instead
+                    x = lsq_linear(A, b, bounds=(0, np.inf)).x
+                prior = default_prior(coeff.shape[1], x.sum())
+            total = max(prior.sum(), 1e-9)
+            eye = np.identity(coeff.shape[1]) * alpha / total
+            lsq = lsq_linear(np.vstack([A, eye]), np.concatenate([b, eye @ prior]), bounds=(0, np.inf))
+            x = np.maximum(lsq.x, 0)
+            res.nit = int(lsq.nit)
+            # lsq_linear status 0 is the iteration limit and -1 a failure (positive values are the convergence criteria)
+            res.status = 0 if lsq.status > 0 else (1 if lsq.status == 0 else 4)
+            res.success = bool(lsq.success)
+            res.message = 'lsq: %s' % lsq.message
+    res.x = x
+    res.fun = float(np.sum((A @ x - b) ** 2)) if x is not None else None
+    metrics.inc('reciper_solves_total', method=mode, status=res.status)
+    return res
@@ -0,0 +1,361 @@
+# reciper matrix - dense ingredient x nutrient storage of the parsed serving values
+
+from logging import getLogger
+
+import numpy as np
+
+logger = getLogger(__name__)
+
+# the nutrient schema (the fatsecret serving nutrient fields). Each ingredient is stored as one float row with a column
+# per nutrient. For each nutrient:
+#   'unit' : the unit of the stored values and of the label values
+#   'serving_unit' : the unit of the fatsecret serving field ('%dv' for percent of the daily value)
+#   'dv' : the FDA daily value (in 'unit'), to convert percent of the daily value. None if there is no daily value
+NUTRIENT_SCHEMA = {
+    'calories': {'unit': 'kcal', 'serving_unit': 'kcal', 'dv': 2000.0},
+    'carbohydrate': {'unit': 'g', 'serving_unit': 'g', 'dv': 275.0},
+    'protein': {'unit': 'g', 'serving_unit': 'g', 'dv': 50.0},
+    'fat': {'unit': 'g', 'serving_unit': 'g', 'dv': 78.0},
+    'saturated_fat': {'unit': 'g', 'serving_unit': 'g', 'dv': 20.0},
+    'polyunsaturated_fat': {'unit': 'g', 'serving_unit': 'g', 'dv': None},
+    'monounsaturated_fat': {'unit': 'g', 'serving_unit': 'g', 'dv': None},
+    'trans_fat': {'unit': 'g', 'serving_unit': 'g', 'dv': None},
+    'cholesterol': {'unit': 'mg', 'serving_unit': 'mg', 'dv': 300.0},
+    'sodium': {'unit': 'mg', 'serving_unit': 'mg', 'dv': 2300.0},
+    'potassium': {'unit': 'mg', 'serving_unit': 'mg', 'dv': 4700.0},
+    'fiber': {'unit': 'g', 'serving_unit': 'g', 'dv': 28.0},
+    'sugar': {'unit': 'g', 'serving_unit': 'g', 'dv': None},
+    'vitamin_a': {'unit': 'ug', 'serving_unit': '%dv', 'dv': 900.0},
+    'vitamin_c': {'unit': 'mg', 'serving_unit': '%dv', 'dv': 90.0},
+    'calcium': {'unit': 'mg', 'serving_unit': '%dv', 'dv': 1300.0},
+    'iron': {'unit': 'mg', 'serving_unit': '%dv', 'dv': 18.0},
+}
+
+NUTRIENTS = tuple(NUTRIENT_SCHEMA.keys())
+
+# the units (relative to the first unit of each group)
+_MASS_UNITS = {'g': 1.0, 'mg': 0.001, 'ug': 1e-6, 'mcg': 1e-6}
+_ENERGY_UNITS = {'kcal': 1.0, 'kj': 1 / 4.184}
+
+
+def unit_factor(nutrient, from_unit, to_unit=None):
+    '''Get the factor converting a nutrient value between units
+
+    Parameters
+    ----------
+    nutrient : str
+        the nutrient name (for the daily value of '%dv' units)
+    from_unit : str
+        the unit of the value ('g', 'mg', 'ug', 'kcal', 'kj' or '%dv')
+    to_unit : str or None, optional
+        the required unit. None to use the schema unit of the nutrient
+
+    Returns
+    -------
+    float
+        multiply the value by it to get the value in to_unit
+    '''
+    schema = NUTRIENT_SCHEMA.get(nutrient, {})
+    if to_unit is None:
+        to_unit = schema.get('unit')
+    from_unit = from_unit.lower()
+    to_unit = None if to_unit is None else to_unit.lower()
+    if from_unit == to_unit or to_unit is None:
+        return 1.0
+    factor = 1.0
+    if from_unit == '%dv' or to_unit == '%dv':
+        dv = schema.get('dv')
+        if dv is None:
+            raise ValueError('nutrient %s has no daily value, cannot convert %s to %s' % (nutrient, from_unit, to_unit))
+        if from_unit == '%dv':
+            factor, from_unit = dv / 100, schema['unit']
+        else:
+            return 1 / unit_factor(nutrient, to_unit, from_unit)
+    for cunits in (_MASS_UNITS, _ENERGY_UNITS):
+        if from_unit in cunits and to_unit in cunits:
+            return factor * cunits[from_unit] / cunits[to_unit]
+    raise ValueError('cannot convert nutrient %s from %s to %s' % (nutrient, from_unit, to_unit))
+
+
+def serving_factors(nutrients=NUTRIENTS):
+    '''Get the factors converting the fatsecret serving values to the schema units
+
+    Parameters
+    ----------
+    nutrients : list of str, optional
+        the nutrients. Nutrients not in NUTRIENT_SCHEMA are not converted
+
+    Returns
+    -------
+    numpy.ndarray of float
+    '''
+    return np.array([unit_factor(x, NUTRIENT_SCHEMA[x]['serving_unit']) if x in NUTRIENT_SCHEMA else 1.0 for x in nutrients])
+
+
+def harmonize_values(values):
+    '''Convert label values to the schema units
+
+    A label value key can end with a unit (i.e. 'sodium_g' or 'calcium_dv' for percent of the daily value), and the
+    value is converted to the schema unit of the nutrient
+
+    Parameters
+    ----------
+    values : dict of {str: float}
+        the label values
+
+    Returns
+    -------
+    dict of {str: float}
+        the values by nutrient name, in the schema units
+    '''
+    harmonized = {}
+    for ckey, cval in values.items():
+        cname, _, cunit = ckey.rpartition('_')
+        if cname in NUTRIENT_SCHEMA and cunit in ('g', 'mg', 'ug', 'mcg', 'kcal', 'kj', 'dv'):
+            cval = cval * unit_factor(cname, '%dv' if cunit == 'dv' else cunit)
+            ckey = cname
+        harmonized[ckey] = cval
+    return harmonized
+
+
+def _parse_raw(servings, nutrients):
+    '''Parse the nutrient values of servings into a float array (in the serving units)'''
+    raw = [[cserving.get(x) for x in nutrients] for cserving in servings]
+    try:
+        return np.array(raw, dtype=float).reshape(len(servings), len(nutrients))
+    except (TypeError, ValueError):
+        pass
+    # some values are missing or not numbers - parse them one by one
+    data = np.full([len(servings), len(nutrients)], np.nan)
+    for idx, crow in enumerate(raw):
+        for cidx, cval in enumerate(crow):
+            if cval is None:
+                continue
+            try:
+                data[idx, cidx] = float(cval)
+            except (TypeError, ValueError):
+                logger.warning('bad value %r for nutrient %s' % (cval, nutrients[cidx]))
+    return data
+
+
+def parse_servings(servings, nutrients=NUTRIENTS, convert=True):
+    '''Parse the nutrient values of servings into a float array
+
+    Parameters
+    ----------
+    servings : list of dict
+        the servings (i.e. the fatsecret serving dicts, values can be str)
+    nutrients : list of str, optional
+        the nutrients to parse (the columns of the output)
+    convert : bool, optional
+        True to convert the values to the schema units. False to keep the serving units
+
+    Returns
+    -------
+    numpy.ndarray of float
+        serving x nutrient values, nan for missing/unparsable values
+    '''
+    data = _parse_raw(servings, list(nutrients))
+    if convert:
+        data *= serving_factors(nutrients)
+    return data
+
+
+def parse_serving(serving, nutrients=NUTRIENTS):
+    '''Parse the nutrient values of a serving into a float vector
+
+    Parameters
+    ----------
+    serving : dict
+        the serving (i.e. the fatsecret serving dict, values can be str)
+    nutrients : list of str, optional
+        the nutrients to parse (the columns of the output)
+
+    Returns
+    -------
+    numpy.ndarray of float
+        the value of each nutrient in the schema units, nan for missing/unparsable values
+    '''
+    return parse_servings([serving], nutrients)[0]
+
+
+class IngredientStore:
+    def __init__(self, nutrients=NUTRIENTS, capacity=16):
+        '''Create an empty ingredient store
+
+        Each added ingredient serving is parsed once into a float64 row of the nutrient schema (nan for missing values),
+        and the solver matrices are obtained by selecting rows/columns of the shared array.
+
+        Parameters
+        ----------
+        nutrients : list of str, optional
+            the nutrient schema (the columns of the matrix)
+        capacity : int, optional
+            the initial number of ingredient rows allocated (grows as needed)
+        '''
+        self.nutrients = tuple(nutrients)
+        self._columns = {cnutrient: idx for idx, cnutrient in enumerate(self.nutrients)}
+        self.names = []
+        self.units = []
+        # the weight (in the ingredient unit) of one piece of the ingredients counted in pieces, None for the others
+        self.pieces = []
+        self._index = {}
+        self._data = np.full([capacity, len(self.nutrients)], np.nan)
+
+    @classmethod
+    def from_servings(cls, ingredients, nutrients=NUTRIENTS):
+        '''Create an ingredient store from serving dicts
+
+        Parameters
+        ----------
+        ingredients : dict of {str: dict}
+            the ingredient name and the serving dict (i.e. the fatsecret serving)
+        nutrients : list of str, optional
+            the nutrient schema
+
+        Returns
+        -------
+        IngredientStore
+        '''
+        store = cls(nutrients, capacity=max(len(ingredients), 1))
+        for cname, cserving in ingredients.items():
+            store.add(cname, cserving)
+        return store
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def copy(self):
+        '''Get a copy of the store (i.e. to solve while the store is edited)
+
+        Returns
+        -------
+        IngredientStore
+        '''
+        store = IngredientStore(self.nutrients, capacity=max(len(self.names), 1))
+        store._data[:len(self.names)] = self.data
+        store.names = list(self.names)
+        store.units = list(self.units)
+        store.pieces = list(self.pieces)
+        store._index = dict(self._index)
+        return store
+
+    @property
+    def data(self):
+        '''The ingredient x nutrient values (a view, nan for missing values)'''
+        return self._data[:len(self.names)]
+
+    @property
+    def mask(self):
+        '''True for the missing ingredient x nutrient values'''
+        return np.isnan(self.data)
+
+    def add(self, name, serving):
+        '''Add (or replace) an ingredient
+
+        Parameters
+        ----------
+        name : str
+            the ingredient name
+        serving : dict
+            the serving nutritional values (i.e. the fatsecret serving dict). The optional 'piece_grams' field is the
+            weight of one piece of the ingredient (see units.normalize_foods())
+        '''
+        row = parse_serving(serving, self.nutrients)
+        unit = serving.get('measurement_description', 'NA')
+        piece = serving.get('piece_grams')
+        if name in self._index:
+            idx = self._index[name]
+            self._data[idx] = row
+            self.units[idx] = unit
+            self.pieces[idx] = piece
+            return
+        idx = len(self.names)
+        if idx >= self._data.shape[0]:
+            data = np.full([max(2 * self._data.shape[0], 1), len(self.nutrients)], np.nan)
+            data[:idx] = self._data[:idx]
+            self._data = data
+        self._data[idx] = row
+        self.names.append(name)
+        self.units.append(unit)
+        self.pieces.append(piece)
+        self._index[name] = idx
+
+    def remove(self, name):
+        '''Remove an ingredient
+
+        Parameters
+        ----------
+        name : str
+        '''
+        idx = self._index.pop(name)
+        num = len(self.names)
+        self._data[idx:num - 1] = self._data[idx + 1:num]
+        self._data[num - 1] = np.nan
+        del self.names[idx]
+        del self.units[idx]
+        del self.pieces[idx]
+        for cname in self.names[idx:]:
+            self._index[cname] -= 1
+
+    def rows(self, names=None):
+        '''Get the row indices of ingredients
+
+        Parameters
+        ----------
+        names : list of str or None, optional
+            the ingredient names. None to get all ingredients
+
+        Returns
+        -------
+        numpy.ndarray of int
+        '''
+        if names is None:
+            return np.arange(len(self.names))
+        return np.array([self._index[x] for x in names], dtype=int)
+
+    def columns(self, params):
+        '''Get the column indices of nutrients
+
+        Parameters
+        ----------
+        params : list of str
+            the nutrient names
+
+        Returns
+        -------
+        numpy.ndarray of int
+        '''
+        unknown = [x for x in params if x not in self._columns]
+        if unknown:
+            raise ValueError('unknown nutritional parameters %s. Known parameters are %s' % (unknown, self.nutrients))
+        return np.array([self._columns[x] for x in params], dtype=int)
+
+    def matrix(self, params, names=None):
+        '''Get the nutrient x ingredient coefficient matrix
+
+        Parameters
+        ----------
+        params : list of str
+            the nutrients (rows of the output)
+        names : list of str or None, optional
+            the ingredients (columns of the output). None to use all ingredients
+
+        Returns
+        -------
+        numpy.ndarray of float
+            the value of each nutrient (row) in each ingredient (column). Missing values are 0
+        '''
+        params = list(params)
+        rows = self.rows(names)
+        cols = self.columns(params)
+        mat = self._data[np.ix_(rows, cols)].T
+        missing = np.isnan(mat)
+        if missing.any():
+            for cparam_idx, cingredient_idx in zip(*np.nonzero(missing)):
+                logger.warning('parameter %s not in ingredient %s' % (params[cparam_idx], self.names[rows[cingredient_idx]]))
+            mat[missing] = 0
+        return mat
@@ -0,0 +1,140 @@
+# reciper memo - reuse the results of identical recipe problems and warm start similar ones
+
+from collections import OrderedDict
+from logging import getLogger
+import copy
+import hashlib
+import json
+import threading
+
+import numpy as np
+
+from .metrics import metrics
+
+logger = getLogger(__name__)
+
+
+class ResultCache:
+    def __init__(self, max_entries=10000, decimals=3):
+        '''An in memory cache of solved recipe problems
+
+        Problems with the same ingredients, coefficient matrix, parameters and solve options have the same structure key.
+        If the quantized label values are also the same (an exact hit) the stored result is returned without solving.
+        Otherwise the last solver basis of the same structure (a near hit, i.e. a size variant of a product) is used to
+        warm start the solve.
+
+        Parameters
+        ----------
+        max_entries : int or None, optional
+            the maximal number of results (and of structure bases) kept. The least recently used are removed. None for no limit
+        decimals : int, optional
+            the label values are rounded to this number of decimals for the key
+        '''
+        self.max_entries = max_entries
+        self.decimals = decimals
+        self._results = OrderedDict()
+        self._bases = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._results)
+
+    def keys(self, names, coeff, values, options=None):
+        '''Get the canonical structure and value keys of a recipe problem
+
+        Parameters
+        ----------
+        names : list of str
+            the ingredient names (food ids), in the label order
+        coeff : numpy.ndarray
+            the parameter x ingredient coefficient matrix
+        values : dict of {str: float}
+            the label value for each nutritional parameter
+        options : dict or None, optional
+            the solve options affecting the result (i.e. order, tail, rules, mode, method and the milp search options)
+
+        Returns
+        -------
+        structure : str
+            the hash of the names, parameters, options and the rounded matrix
+        value : str
+            the hash of the structure and the rounded label values
+        '''
+        structure = hashlib.sha1()
+        structure.update(json.dumps([list(names), list(values.keys()), options], sort_keys=True, default=str).encode())
+        # the per gram coefficients are small, so they are rounded to more decimals than the label values
+        structure.update(np.ascontiguousarray(np.round(coeff, 9) + 0.0, dtype=float).tobytes())
+        structure = structure.hexdigest()
+        targets = np.fromiter(values.values(), dtype=float, count=len(values))
+        value = hashlib.sha1(structure.encode())
+        # + 0.0 so -0.0 and 0.0 have the same key
+        value.update((np.round(targets, self.decimals) + 0.0).tobytes())
+        return structure, value.hexdigest()
+
+    def get(self, value_key):
+        '''Get a stored result
+
+        Parameters
+        ----------
+        value_key : str
+
+        Returns
+        -------
+        dict or None
+            a copy of the stored result. None if not found
+        '''
+        with self._lock:
+            result = self._results.get(value_key)
+            if result is None:
+                return None
+            self._results.move_to_end(value_key)
+        metrics.inc('reciper_memo_hits_total', kind='exact')
+        return copy.deepcopy(result)
+
+    def get_basis(self, structure_key):
+        '''Get the solver basis of the last solved problem with the same structure
+
+        Parameters
+        ----------
+        structure_key : str
+
+        Returns
+        -------
+        tuple or None
+            the LPBackend.get_basis() result. None if not found
+        '''
+        with self._lock:
+            basis = self._bases.get(structure_key)
+            if basis is None:
+                return None
+            self._bases.move_to_end(structure_key)
+        metrics.inc('reciper_memo_hits_total', kind='near')
+        return basis
+
+    def set(self, structure_key, value_key, result, basis=None):
+        '''Store a solved problem
+
+        Parameters
+        ----------
+        structure_key, value_key : str
+            the keys() of the problem
+        result : dict
+            the solve result
+        basis : tuple or None, optional
+            the solver basis of the solution (LPBackend.get_basis()). None to not store
+        '''
+        with self._lock:
+            self._results[value_key] = copy.deepcopy(result)
+            self._results.move_to_end(value_key)
+            if basis is not None:
+                self._bases[structure_key] = basis
+                self._bases.move_to_end(structure_key)
+            if self.max_entries is not None:
+                for centries in (self._results, self._bases):
+                    while len(centries) > self.max_entries:
+                        centries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self._bases.clear()
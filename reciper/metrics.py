@@ -0,0 +1,214 @@
+# reciper metrics - timing and counters of the lookup, matrix and solver steps
+
+from contextlib import contextmanager
+from logging import getLogger
+import bisect
+import json
+import threading
+import time
+
+logger = getLogger(__name__)
+
+# the default histogram bucket upper bounds (seconds for timers)
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+# the bucket upper bounds for specific histograms
+BUCKETS = {'reciper_solve_iterations': (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000),
+           'reciper_residual_relative': (0.001, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)}
+
+
+def _labels_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    items = list(key) + list(extra)
+    if not items:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in items)
+
+
+class Metrics:
+    def __init__(self):
+        '''Create an empty metrics registry
+
+        Holds counters and histograms, each identified by a name and a set of labels (i.e. the cache entry kind)
+        '''
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        '''Remove all the recorded values'''
+        with self._lock:
+            # {name: {labels key: value}}
+            self._counters = {}
+            # {name: {labels key: [bucket counts list, sum, count]}}
+            self._histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        '''Increase a counter
+
+        Parameters
+        ----------
+        name : str
+            the counter name
+        value : float, optional
+            the increment
+        labels :
+            the counter labels
+        '''
+        key = _labels_key(labels)
+        with self._lock:
+            cnames = self._counters.setdefault(name, {})
+            cnames[key] = cnames.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        '''Record a value in a histogram
+
+        Parameters
+        ----------
+        name : str
+            the histogram name
+        value : float
+        labels :
+            the histogram labels
+        '''
+        key = _labels_key(labels)
+        buckets = BUCKETS.get(name, DEFAULT_BUCKETS)
+        with self._lock:
+            cnames = self._histograms.setdefault(name, {})
+            if key not in cnames:
+                cnames[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            chist = cnames[key]
+            chist[0][bisect.bisect_left(buckets, value)] += 1
+            chist[1] += value
+            chist[2] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        '''Record the run time (seconds) of the with block in a histogram
+
+        Parameters
+        ----------
+        name : str
+            the histogram name
+        labels :
+            the histogram labels
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def to_dict(self):
+        '''Get all the recorded values
+
+        Returns
+        -------
+        dict with the keys:
+            'counters' : dict of {str: list of dict}
+                for each counter name, a dict per label set with the 'labels' and 'value'
+            'histograms' : dict of {str: list of dict}
+                for each histogram name, a dict per label set with the 'labels', 'buckets' (upper bounds),
+                'counts' (per bucket, the last one for values above all bounds), 'sum' and 'count'
+        '''
+        with self._lock:
+            return self._values(self._counters, self._histograms)
+
+    def pop(self):
+        '''Get all the recorded values (as in to_dict()) and reset the registry
+
+        Returns
+        -------
+        dict
+        '''
+        with self._lock:
+            counters, histograms = self._counters, self._histograms
+            self._counters, self._histograms = {}, {}
+        return self._values(counters, histograms)
+
+    @staticmethod
+    def _values(counters, histograms):
+        counters = {cname: [{'labels': dict(ckey), 'value': cval} for ckey, cval in cvals.items()]
+                    for cname, cvals in counters.items()}
+        histograms = {cname: [{'labels': dict(ckey), 'buckets': list(BUCKETS.get(cname, DEFAULT_BUCKETS)),
+                               'counts': list(chist[0]), 'sum': chist[1], 'count': chist[2]} for ckey, chist in cvals.items()]
+                      for cname, cvals in histograms.items()}
+        return {'counters': counters, 'histograms': histograms}
+
+    def merge(self, values):
+        '''Add recorded values (i.e. from a worker process) to the registry
+
+        Parameters
+        ----------
+        values : dict
+            the values, as returned from to_dict()
+        '''
+        for cname, citems in values['counters'].items():
+            for citem in citems:
+                self.inc(cname, citem['value'], **citem['labels'])
+        with self._lock:
+            for cname, citems in values['histograms'].items():
+                cnames = self._histograms.setdefault(cname, {})
+                for citem in citems:
+                    key = _labels_key(citem['labels'])
+                    if key not in cnames:
+                        cnames[key] = [[0] * len(citem['counts']), 0.0, 0]
+                    chist = cnames[key]
+                    chist[0] = [x + y for x, y in zip(chist[0], citem['counts'])]
+                    chist[1] += citem['sum']
+                    chist[2] += citem['count']
+
+    def to_json(self):
+        '''Get all the recorded values as a json string
+
+        Returns
+        -------
+        str
+        '''
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self):
+        '''Get all the recorded values in the prometheus text exposition format
+
+        Returns
+        -------
+        str
+        '''
+        values = self.to_dict()
+        lines = []
+        for cname, citems in sorted(values['counters'].items()):
+            lines.append('# TYPE %s counter' % cname)
+            for citem in citems:
+                lines.append('%s%s %s' % (cname, _format_labels(_labels_key(citem['labels'])), repr(citem['value'])))
+        for cname, citems in sorted(values['histograms'].items()):
+            lines.append('# TYPE %s histogram' % cname)
+            for citem in citems:
+                key = _labels_key(citem['labels'])
+                total = 0
+                for cbound, ccount in zip(list(citem['buckets']) + ['+Inf'], citem['counts']):
+                    total += ccount
+                    lines.append('%s_bucket%s %d' % (cname, _format_labels(key, [('le', cbound)]), total))
+                lines.append('%s_sum%s %s' % (cname, _format_labels(key), repr(citem['sum'])))
+                lines.append('%s_count%s %d' % (cname, _format_labels(key), citem['count']))
+        return '\n'.join(lines) + '\n'
+
+    def save(self, filename):
+        '''Save the recorded values to a file
+
+        Parameters
+        ----------
+        filename : str
+            the output file. Prometheus text format if the name ends with '.prom', json otherwise
+        '''
+        with open(filename, 'w') as fl:
+            if filename.endswith('.prom'):
+                fl.write(self.to_prometheus())
+            else:
+                fl.write(self.to_json())
+        logger.info('saved metrics to %s' % filename)
+
+
+# the metrics registry used by the reciper modules
+metrics = Metrics()
@@ -0,0 +1,160 @@
+# reciper mip - mixed integer recipe solve (a whole number of servings for the ingredients counted in pieces)
+
+from logging import getLogger
+
+import numpy as np
+
+from .backend import _get_bounds, _to_sparse, build_highs_lp
+from .metrics import metrics
+
+logger = getLogger(__name__)
+
+
+def round_seed(x, integrality, c, A_eq, b_eq, A_ub, b_ub, bounds=(0, None)):
+    '''Get a feasible starting solution from the linear program relaxation solution
+
+    The integer variables are rounded, and the other variables are solved for with the integer variables fixed.
+
+    Parameters
+    ----------
+    x : numpy.ndarray
+        the relaxation solution
+    integrality : numpy.ndarray of bool
+        True for the integer variables
+    c, A_eq, b_eq, A_ub, b_ub, bounds :
+        the problem (see solve_mixed_integer())
+
+    Returns
+    -------
+    numpy.ndarray or None
+        the feasible solution. None if the rounded solution is not feasible (i.e. it breaks the ingredient order)
+    '''
+    from scipy.optimize import linprog
+
+    lower, upper = _get_bounds(bounds, len(c))
+    fixed = np.round(x[integrality])
+    lower[integrality] = fixed
+    upper[integrality] = fixed
+    res = linprog(c, A_ub=A_ub if A_ub.shape[0] else None, b_ub=b_ub if A_ub.shape[0] else None,
+                  A_eq=A_eq if A_eq.shape[0] else None, b_eq=b_eq if A_eq.shape[0] else None,
+                  bounds=list(zip(lower, np.where(np.isinf(upper), None, upper))), method='highs')
+    if res.status != 0:
+        return None
+    return res.x
+
+
+def solve_mixed_integer(c, integrality, A_eq=None, b_eq=None, A_ub=None, b_ub=None, bounds=(0, None), time_limit=10.0,
+                        mip_gap=1e-4, x0=None):
+    '''Solve the mixed integer linear program: minimize c @ x such that A_eq @ x == b_eq, A_ub @ x <= b_ub, x within bounds
+    and the integer variables are integers
+
+    The search stops at the time limit, returning the best solution found so far. If the highspy package is installed, the
+    search starts from x0 (i.e. the rounded relaxation solution). Otherwise, scipy.optimize.milp is used (without x0).
+
+    Parameters
+    ----------
+    c : array like
+        the objective coefficients
+    integrality : array like of bool
+        True for the integer variables
+    A_eq, A_ub : array like or scipy.sparse matrix or None, optional
+        the equality/inequality constraint matrices
+    b_eq, b_ub : array like or None, optional
+        the equality/inequality constraint values
+    bounds : tuple or list of tuple, optional
+        (min, max) for all variables, or a list with (min, max) per variable. None means unbounded
+    time_limit : float or None, optional
+        the maximal search time (seconds). None for no limit
+    mip_gap : float, optional
+        the search stops when the relative gap between the best solution and the lower bound is below it
+    x0 : numpy.ndarray or None, optional
+        a feasible solution to start from. None to start without a solution
+
+    Returns
+    -------
+    scipy.optimize.OptimizeResult
+        with the fields 'x', 'fun', 'status' (0 optimal, 1 the time limit was reached, 2 infeasible), 'success' (True if a
+        solution was found, even if not proven optimal), 'message', 'nit' (the number of branch and bound nodes) and
+        'mip_gap', as in linprog
+    '''
+    c = np.asarray(c, dtype=float)
+    num_cols = len(c)
+    integrality = np.asarray(integrality, dtype=bool)
+    A_eq = _to_sparse(A_eq, num_cols)
+    A_ub = _to_sparse(A_ub, num_cols)
+    b_eq = np.zeros(0) if b_eq is None else np.asarray(b_eq, dtype=float)
+    b_ub = np.zeros(0) if b_ub is None else np.asarray(b_ub, dtype=float)
+    with metrics.timer('reciper_solve_seconds', method='milp'):
+        try:
+            res = _solve_highs(c, integrality, A_eq, b_eq, A_ub, b_ub, bounds, time_limit, mip_gap, x0)
+        except ImportError:
+            logger.debug('highspy not installed, using milp without the starting solution')
+            res = _solve_milp(c, integrality, A_eq, b_eq, A_ub, b_ub, bounds, time_limit, mip_gap)
+    metrics.inc('reciper_solves_total', method='milp', status=res.status)
+    metrics.observe('reciper_solve_iterations', res.nit, method='milp')
+    return res
+
+
+def _solve_milp(c, integrality, A_eq, b_eq, A_ub, b_ub, bounds, time_limit, mip_gap):
+    from scipy.optimize import Bounds, LinearConstraint, OptimizeResult, milp
+
+    constraints = []
+    if A_eq.shape[0]:
+        constraints.append(LinearConstraint(A_eq, b_eq, b_eq))
+    if A_ub.shape[0]:
+        constraints.append(LinearConstraint(A_ub, -np.inf, b_ub))
+    options = {'mip_rel_gap': mip_gap}
+    if time_limit is not None:
+        options['time_limit'] = time_limit
+    mres = milp(c, integrality=integrality.astype(int), bounds=Bounds(*_get_bounds(bounds, len(c))), constraints=constraints,
+                options=options)
+    res = OptimizeResult()
+    res.x = mres.x
+    res.fun = mres.fun
+    # milp status 1 is the iteration or time limit (with the best solution found, if any)
+    res.status = mres.status if mres.status in (0, 1, 2) else 4
+    res.success = mres.x is not None
+    res.message = mres.message
+    res.nit = int(mres.get('mip_node_count', 0) or 0)
+    res.mip_gap = mres.get('mip_gap')
+    return res
+
+
+def _solve_highs(c, integrality, A_eq, b_eq, A_ub, b_ub, bounds, time_limit, mip_gap, x0):
+    import highspy
+    from scipy.optimize import OptimizeResult
+
+    h = highspy.Highs()
+    h.setOptionValue('output_flag', False)
+    h.setOptionValue('mip_rel_gap', mip_gap)
+    if time_limit is not None:
+        h.setOptionValue('time_limit', float(time_limit))
+    h.passModel(build_highs_lp(c, A_eq, b_eq, A_ub, b_ub, bounds, integrality))
+    if x0 is not None:
+        solution = highspy.HighsSolution()
+        solution.col_value = list(x0)
+        solution.value_valid = True
+        if h.setSolution(solution) != highspy.HighsStatus.kOk:
+            logger.debug('could not set the mip starting solution')
+    h.run()
+    model_status = h.getModelStatus()
+    info = h.getInfo()
+    status = {highspy.HighsModelStatus.kOptimal: 0,
+              highspy.HighsModelStatus.kTimeLimit: 1,
+              highspy.HighsModelStatus.kIterationLimit: 1,
+              highspy.HighsModelStatus.kSolutionLimit: 1,
+              highspy.HighsModelStatus.kInfeasible: 2}.get(model_status, 4)
+    res = OptimizeResult()
+    res.status = status
+    # primal_solution_status 2 is a feasible solution
+    res.success = status in (0, 1) and info.primal_solution_status == 2
+    res.message = 'HiGHS Status: %s' % h.modelStatusToString(model_status)
+    res.nit = int(info.mip_node_count)
+    res.mip_gap = float(info.mip_gap)
+    if res.success:
+        res.x = np.array(h.getSolution().col_value)
+        res.fun = info.objective_function_value
+    else:
+        res.x = None
+        res.fun = None
+    return res
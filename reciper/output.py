@@ -0,0 +1,266 @@
+# reciper output - write the solved products as they finish (jsonl, csv or parquet), with resume support
+
+from logging import getLogger
+import csv
+import glob
+import json
+import os
+import sys
+
+logger = getLogger(__name__)
+
+# the supported output formats
+FORMATS = ('jsonl', 'csv', 'parquet')
+
+# the record fields (in the csv/parquet column order). The dict fields are stored as json strings in csv/parquet
+FIELDS = ('name', 'success', 'status', 'message', 'iterations', 'mip_gap', 'amounts', 'units', 'residuals', 'intervals', 'pieces')
+_DICT_FIELDS = ('amounts', 'units', 'residuals', 'intervals', 'pieces')
+
+
+def get_format(filename):
+    '''Get the output format from the file name extension
+
+    Parameters
+    ----------
+    filename : str or None
+        the output file name (None for stdout)
+
+    Returns
+    -------
+    str
+        'csv' for .csv, 'parquet' for .parquet, 'jsonl' otherwise
+    '''
+    if filename is None:
+        return 'jsonl'
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == '.csv':
+        return 'csv'
+    if ext == '.parquet':
+        return 'parquet'
+    return 'jsonl'
+
+
+def _flat_record(result):
+    '''Get the csv/parquet row of a result (the dict fields as json strings)'''
+    row = {}
+    for cfield in FIELDS:
+        cval = result.get(cfield)
+        if cfield in _DICT_FIELDS:
+            cval = None if cval is None else json.dumps(cval)
+        row[cfield] = cval
+    return row
+
+
+def _truncate_partial_line(filename):
+    '''Remove an incomplete last line (i.e. from a crash while writing) so appended records start on a new line'''
+    with open(filename, 'rb+') as fl:
+        fl.seek(0, os.SEEK_END)
+        size = fl.tell()
+        if size == 0:
+            return
+        fl.seek(size - 1)
+        if fl.read(1) == b'\n':
+            return
+        # find the last complete line
+        pos = size
+        while pos > 0:
+            step = min(pos, 65536)
+            pos -= step
+            fl.seek(pos)
+            chunk = fl.read(step)
+            idx = chunk.rfind(b'\n')
+            if idx >= 0:
+                pos += idx + 1
+                break
+        logger.warning('removing the incomplete last record of %s' % filename)
+        fl.truncate(pos)
+
+
+def _parquet_parts(dirname):
+    return sorted(glob.glob(os.path.join(dirname, 'part-*.parquet')))
+
+
+def written_names(filename, format=None):
+    '''Get the names of the products already written to an output file
+
+    Parameters
+    ----------
+    filename : str
+        the output file name (a directory for parquet)
+    format : str or None, optional
+        the output format ('jsonl', 'csv' or 'parquet'). None to use the file name extension
+
+    Returns
+    -------
+    set of str
+        the written product names (empty if the file does not exist)
+    '''
+    if format is None:
+        format = get_format(filename)
+    names = set()
+    if not os.path.exists(filename):
+        return names
+    if format == 'parquet':
+        import pyarrow.parquet as pq
+
+        for cpart in _parquet_parts(filename):
+            names.update(pq.read_table(cpart, columns=['name']).column('name').to_pylist())
+        return names
+    with open(filename, newline='') as fl:
+        if format == 'csv':
+            for crow in csv.DictReader(fl):
+                names.add(crow['name'])
+            return names
+        for cline in fl:
+            try:
+                names.add(json.loads(cline)['name'])
+            except (ValueError, KeyError, TypeError):
+                # an incomplete last line, removed when the writer is opened
+                continue
+    return names
+
+
+class JsonlWriter:
+    def __init__(self, filename=None, resume=False):
+        '''Write the results as json lines (one record per line, flushed after each record)
+
+        Parameters
+        ----------
+        filename : str or None, optional
+            the output file name. None for stdout
+        resume : bool, optional
+            True to append to an existing file
+        '''
+        self.filename = filename
+        if filename is None:
+            self._fl = sys.stdout
+            return
+        if resume and os.path.exists(filename):
+            _truncate_partial_line(filename)
+        self._fl = open(filename, 'a' if resume else 'w')
+
+    def write(self, result):
+        self._fl.write(json.dumps(result) + '\n')
+        self._fl.flush()
+
+    def close(self):
+        if self._fl is not sys.stdout:
+            self._fl.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class CsvWriter(JsonlWriter):
+    def __init__(self, filename=None, resume=False):
+        '''Write the results as csv (one row per product, the amounts/units/residuals/intervals as json strings)
+
+        Parameters
+        ----------
+        filename : str or None, optional
+            the output file name. None for stdout
+        resume : bool, optional
+            True to append to an existing file
+        '''
+        header = not (resume and filename is not None and os.path.exists(filename) and os.path.getsize(filename) > 0)
+        super().__init__(filename, resume)
+        self._writer = csv.DictWriter(self._fl, FIELDS)
+        if header:
+            self._writer.writeheader()
+
+    def write(self, result):
+        self._writer.writerow(_flat_record(result))
+        self._fl.flush()
+
+
+class ParquetWriter:
+    def __init__(self, dirname, resume=False, batch_size=1000):
+        '''Write the results as a parquet dataset (a directory of part files, requires pyarrow)
+
+        Every batch_size records are written as a new part file (to a temporary name, then renamed), so a crash loses
+        only the records of the current batch.
+
+        Parameters
+        ----------
+        dirname : str
+            the output directory
+        resume : bool, optional
+            True to add parts to the existing parts. False to remove the existing parts
+        batch_size : int, optional
+            number of records per part file
+        '''
+        import pyarrow as pa
+
+        self.dirname = dirname
+        self.batch_size = batch_size
+        os.makedirs(dirname, exist_ok=True)
+        if not resume:
+            for cpart in _parquet_parts(dirname):
+                os.remove(cpart)
+        self._num_parts = len(_parquet_parts(dirname))
+        self._schema = pa.schema([('name', pa.string()), ('success', pa.bool_()), ('status', pa.int64()), ('message', pa.string()),
+                                  ('iterations', pa.int64()), ('mip_gap', pa.float64()), ('amounts', pa.string()),
+                                  ('units', pa.string()), ('residuals', pa.string()), ('intervals', pa.string()),
+                                  ('pieces', pa.string())])
+        self._rows = []
+
+    def write(self, result):
+        self._rows.append(_flat_record(result))
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        '''Write the buffered records as a new part file'''
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if not self._rows:
+            return
+        table = pa.Table.from_pylist(self._rows, schema=self._schema)
+        filename = os.path.join(self.dirname, 'part-%06d.parquet' % self._num_parts)
+        pq.write_table(table, filename + '.tmp')
+        os.replace(filename + '.tmp', filename)
+        self._num_parts += 1
+        self._rows = []
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_writer(filename=None, format=None, resume=False):
+    '''Open a streaming result writer
+
+    Parameters
+    ----------
+    filename : str or None, optional
+        the output file name (a directory for parquet). None for stdout (jsonl or csv)
+    format : str or None, optional
+        the output format ('jsonl', 'csv' or 'parquet'). None to use the file name extension
+    resume : bool, optional
+        True to add to the existing output (see written_names() for the products to skip)
+
+    Returns
+    -------
+    JsonlWriter or CsvWriter or ParquetWriter
+        with the write(result) and close() methods
+    '''
+    if format is None:
+        format = get_format(filename)
+    if format == 'jsonl':
+        return JsonlWriter(filename, resume)
+    if format == 'csv':
+        return CsvWriter(filename, resume)
+    if format == 'parquet':
+        if filename is None:
+            raise ValueError('parquet output needs an output file name')
+        return ParquetWriter(filename, resume)
+    raise ValueError('unknown output format %s. Use one of %s' % (format, FORMATS))
@@ -0,0 +1,233 @@
+# reciper resolver - match raw label ingredient names to known foods
+
+from collections import defaultdict
+from logging import getLogger
+import re
+
+logger = getLogger(__name__)
+
+# words ignored when matching ingredient names
+STOPWORDS = {'a', 'and', 'or', 'of', 'the', 'with', 'contains', 'less', 'than', 'enriched', 'organic', 'natural',
+             'added', 'for', 'color', 'flavor', 'to', 'preserve', 'freshness'}
+
+
+def normalize_name(raw):
+    '''Normalize a raw label ingredient name
+
+    Parentheses/brackets content (i.e. "(niacin, iron)"), percentages and punctuation are removed
+
+    Parameters
+    ----------
+    raw : str
+
+    Returns
+    -------
+    str
+        the normalized name (lower case words separated by a single space)
+    '''
+    name = raw.lower()
+    # remove the (possibly nested) parentheses content
+    prev = None
+    while prev != name:
+        prev = name
+        name = re.sub(r'\([^()]*\)|\[[^\[\]]*\]', ' ', name)
+    name = re.sub(r'\d+(\.\d+)?\s*%', ' ', name)
+    name = re.sub(r'[^a-z0-9 ]+', ' ', name)
+    return ' '.join(name.split())
+
+
+def get_tokens(name):
+    '''Get the match tokens of a normalized name
+
+    Parameters
+    ----------
+    name : str
+        the normalized name
+
+    Returns
+    -------
+    set of str
+    '''
+    return {x for x in name.split() if x not in STOPWORDS}
+
+
+def get_trigrams(name):
+    '''Get the character trigrams of a normalized name
+
+    Parameters
+    ----------
+    name : str
+        the normalized name
+
+    Returns
+    -------
+    set of str
+    '''
+    padded = '  %s ' % name
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class FoodIndex:
+    def __init__(self):
+        '''Create an empty local index of known foods
+
+        Foods are indexed by their name tokens (inverted index) and character trigrams. In addition, raw names
+        previously resolved (i.e. by the user) are stored as aliases, which match with full confidence.
+        '''
+        self.names = {}
+        self.aliases = {}
+        self._token_index = defaultdict(set)
+        self._trigram_index = defaultdict(set)
+        self._trigrams = {}
+        self._tokens = {}
+
+    @classmethod
+    def from_cache(cls, cache):
+        '''Create the index from the foods and aliases stored in the nutrient cache
+
+        Parameters
+        ----------
+        cache : NutrientCache
+
+        Returns
+        -------
+        FoodIndex
+        '''
+        index = cls()
+        for cfood_id, cfood in cache.items('food'):
+            if cfood is not None and 'food_name' in cfood:
+                index.add(cfood_id, cfood['food_name'])
+        for craw, cfood_id in cache.items('alias'):
+            if cfood_id in index.names:
+                index.aliases[craw] = cfood_id
+        logger.debug('food index created with %d foods and %d aliases' % (len(index.names), len(index.aliases)))
+        return index
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, food_id, name):
+        '''Add a food to the index
+
+        Parameters
+        ----------
+        food_id : str
+        name : str
+            the food name
+        '''
+        food_id = str(food_id)
+        if food_id in self.names:
+            return
+        self.names[food_id] = name
+        normalized = normalize_name(name)
+        self._tokens[food_id] = get_tokens(normalized)
+        self._trigrams[food_id] = get_trigrams(normalized)
+        for ctoken in self._tokens[food_id]:
+            self._token_index[ctoken].add(food_id)
+        for ctrigram in self._trigrams[food_id]:
+            self._trigram_index[ctrigram].add(food_id)
+
+    def add_alias(self, raw, food_id, cache=None):
+        '''Resolve a raw name to a food (i.e. after the user selected it)
+
+        Parameters
+        ----------
+        raw : str
+            the raw label ingredient name
+        food_id : str
+            the food (must be in the index)
+        cache : NutrientCache or None, optional
+            the cache to store the alias in (so it persists). None to not store
+        '''
+        food_id = str(food_id)
+        key = normalize_name(raw)
+        self.aliases[key] = food_id
+        if cache is not None:
+            cache.set('alias', key, food_id)
+
+    def score(self, raw, food_id):
+        '''Get the similarity (0-1) between a raw name and an indexed food
+
+        The mean of the token and trigram jaccard similarities
+
+        Parameters
+        ----------
+        raw : str
+        food_id : str
+
+        Returns
+        -------
+        float
+        '''
+        normalized = normalize_name(raw)
+        return self._score(get_tokens(normalized), get_trigrams(normalized), food_id)
+
+    def _score(self, tokens, trigrams, food_id):
+        return (_jaccard(tokens, self._tokens[food_id]) + _jaccard(trigrams, self._trigrams[food_id])) / 2
+
+    def search(self, raw, limit=5):
+        '''Find the indexed foods most similar to a raw name
+
+        Parameters
+        ----------
+        raw : str
+            the raw label ingredient name
+        limit : int, optional
+            maximal number of results
+
+        Returns
+        -------
+        list of (str, str, float)
+            the food_id, food name and similarity score of the best matches, sorted by descending score
+        '''
+        normalized = normalize_name(raw)
+        if normalized in self.aliases:
+            food_id = self.aliases[normalized]
+            return [(food_id, self.names[food_id], 1.0)]
+        tokens = get_tokens(normalized)
+        trigrams = get_trigrams(normalized)
+        candidates = set()
+        for ctoken in tokens:
+            candidates.update(self._token_index.get(ctoken, ()))
+        if not candidates:
+            # no shared word - use the foods sharing trigrams (i.e. misspellings)
+            for ctrigram in trigrams:
+                candidates.update(self._trigram_index.get(ctrigram, ()))
+        scores = [(cfood_id, self.names[cfood_id], self._score(tokens, trigrams, cfood_id)) for cfood_id in candidates]
+        scores.sort(key=lambda x: (-x[2], x[1]))
+        return scores[:limit]
+
+    def resolve(self, raw, threshold=0.6, margin=0.1):
+        '''Get the food matching a raw name, if the match is confident
+
+        Parameters
+        ----------
+        raw : str
+            the raw label ingredient name
+        threshold : float, optional
+            the minimal similarity score for a confident match
+        margin : float, optional
+            the minimal score difference between the best and the second best match for a confident match
+
+        Returns
+        -------
+        (str, str, float) or None
+            the food_id, food name and score of the match. None if no confident match was found
+        '''
+        matches = self.search(raw, limit=2)
+        if not matches:
+            return None
+        best = matches[0]
+        if best[2] < threshold:
+            logger.debug('low confidence match for %s: %s (%f)' % (raw, best[1], best[2]))
+            return None
+        if len(matches) > 1 and best[2] - matches[1][2] < margin:
+            logger.debug('ambiguous match for %s: %s / %s' % (raw, best[1], matches[1][1]))
+            return None
+        return best
@@ -0,0 +1,147 @@
+# reciper session - incremental re-solve of a recipe while the ingredients and label values are edited
+
+from logging import getLogger
+import threading
+
+import numpy as np
+
+from .backend import LPBackend
+from .matrix import NUTRIENTS, IngredientStore
+from .solver import solve_recipe
+
+logger = getLogger(__name__)
+
+
+class SolveSession:
+    def __init__(self, values=None, nutrients=NUTRIENTS, method='highs', order=False, tail=None, tail_fraction=0.02,
+                 rules='fda', mode='lp', time_limit=10.0):
+        '''A recipe solve session keeping the ingredients, the coefficient matrix and the last solution between edits
+
+        Adding/removing an ingredient only adds/removes its matrix column, and changing the label values only rebuilds
+        the matrix if the parameters changed. The solver backend is kept, so each re-solve starts from the previous basis.
+        Solves run on a snapshot of the session, so edits (i.e. from the gui thread) do not wait for a running solve
+        (the gui runs the solves as background jobs, see reciper.jobs).
+
+        Parameters
+        ----------
+        values : dict of {str: float} or None, optional
+            the label value for each nutritional parameter to fit
+        nutrients : list of str, optional
+            the nutrient schema of the ingredient store
+        method : str, optional
+            the linear program method ('highs', 'highs-ds' or 'highs-ipm')
+        order, tail, tail_fraction, rules, mode, time_limit :
+            the solve_recipe() options
+        '''
+        self.store = IngredientStore(nutrients)
+        self.backend = LPBackend(method)
+        self.values = {}
+        self.options = {'order': order, 'tail': tail, 'tail_fraction': tail_fraction, 'rules': rules, 'mode': mode,
+                        'time_limit': time_limit}
+        self.result = None
+        # the parameter x ingredient matrix of the current values and ingredients (in the store order)
+        self._coeff = np.zeros([0, 0])
+        # incremented on each edit, so the result of a solve started before an edit is not kept
+        self._version = 0
+        self._lock = threading.RLock()
+        # the backend is used by one solve at a time
+        self._solve_lock = threading.Lock()
+        if values:
+            self.set_values(values)
+
+    def __len__(self):
+        return len(self.store)
+
+    def __contains__(self, name):
+        return name in self.store
+
+    @property
+    def names(self):
+        '''The ingredient names (in the order they were added)'''
+        return list(self.store.names)
+
+    def add(self, name, serving):
+        '''Add (or replace) an ingredient
+
+        Parameters
+        ----------
+        name : str
+            the ingredient name
+        serving : dict
+            the serving nutritional values (i.e. the fatsecret serving dict)
+        '''
+        with self._lock:
+            replace = name in self.store
+            self.store.add(name, serving)
+            column = self.store.matrix(self.values.keys(), [name])
+            if replace:
+                self._coeff[:, self.store.rows([name])[0]] = column[:, 0]
+            else:
+                self._coeff = np.hstack([self._coeff, column])
+            self._changed()
+
+    def remove(self, name):
+        '''Remove an ingredient
+
+        Parameters
+        ----------
+        name : str
+        '''
+        with self._lock:
+            idx = self.store.rows([name])[0]
+            self.store.remove(name)
+            self._coeff = np.delete(self._coeff, idx, axis=1)
+            self._changed()
+
+    def set_values(self, values):
+        '''Set the label values to fit
+
+        Parameters
+        ----------
+        values : dict of {str: float}
+            the label value for each nutritional parameter
+        '''
+        with self._lock:
+            params = list(self.values.keys())
+            self.values = dict(values)
+            if list(self.values.keys()) != params:
+                self._coeff = self.store.matrix(self.values.keys())
+            self._changed()
+
+    def set_options(self, **kwargs):
+        '''Set the solve_recipe() options (order, tail, tail_fraction, rules, mode, time_limit)
+        '''
+        unknown = set(kwargs) - set(self.options)
+        if unknown:
+            raise ValueError('unknown solve options %s. Known options are %s' % (sorted(unknown), sorted(self.options)))
+        with self._lock:
+            self.options.update(kwargs)
+            self._changed()
+
+    def solve(self):
+        '''Solve the recipe for the current ingredients and label values
+
+        Returns
+        -------
+        dict
+            the solve_recipe() result (also kept in self.result, unless the session was edited during the solve).
+            None if there are no ingredients or values
+        '''
+        with self._lock:
+            if len(self.store) == 0 or len(self.values) == 0:
+                return None
+            store = self.store.copy()
+            values = dict(self.values)
+            coeff = self._coeff.copy()
+            options = dict(self.options)
+            version = self._version
+        with self._solve_lock:
+            result = solve_recipe(store, values, backend=self.backend, coeff=coeff, **options)
+        with self._lock:
+            if version == self._version:
+                self.result = result
+        return result
+
+    def _changed(self):
+        self._version += 1
+        self.result = None
@@ -0,0 +1,388 @@
+# reciper solver - find the ingredient amounts giving the label nutritional values
+#
+# this module does not depend on the gui, so it can be used from the cli and
+# from batch worker processes
+
+from logging import getLogger
+import importlib.util
+
+import numpy as np
+
+from .backend import LPBackend
+from .lsq import LSQ_MODES, solve_least_squares
+from .matrix import IngredientStore
+from .metrics import metrics
+from .mip import round_seed, solve_mixed_integer
+from .tolerance import error_scales, label_intervals
+from .units import is_discrete_unit
+
+logger = getLogger(__name__)
+
+# the solver modes ('lp' - the weighted absolute error linear program, 'milp' - the same with a whole number of servings
+# for the ingredients counted in pieces, or one of the least squares modes)
+MODES = ('lp', 'milp') + LSQ_MODES
+
+
+def get_store(ingredients):
+    '''Get the ingredient store for the ingredients
+
+    Parameters
+    ----------
+    ingredients : dict of {str: dict} or IngredientStore
+        the ingredient name and the nutritional values of a serving of it (i.e. the fatsecret serving dict)
+
+    Returns
+    -------
+    IngredientStore
+    '''
+    if isinstance(ingredients, IngredientStore):
+        return ingredients
+    return IngredientStore.from_servings(ingredients)
+
+
+def build_interval_problem(coeff, targets, low, high, weights, center_weight=0.1):
+    '''Build the linear program fitting the recipe values into the label value intervals
+
+    we have the variables:
+    one per ingredient
+    two per parameter - the error above the high value and the error below the low value
+    two per parameter - the positive and negative difference from the label value
+    and we minimize the weighted sum of the errors. Within the interval, only the difference from the label value is
+    minimized, with a smaller weight (so the label value is still preferred over the interval edges).
+
+    Parameters
+    ----------
+    coeff : numpy.ndarray or scipy.sparse matrix
+        the parameter x ingredient coefficient matrix
+    targets : numpy.ndarray
+        the label value of each parameter
+    low, high : numpy.ndarray
+        the range of true values for each parameter
+    weights : numpy.ndarray
+        the objective weight of each parameter error
+    center_weight : float, optional
+        the weight of the difference from the label value, relative to the error weight
+
+    Returns
+    -------
+    c : numpy.ndarray
+        the minimization function - weighted sum of the per parameter errors
+    A_ub : scipy.sparse.csr_matrix
+        the inequality constraints matrix (coeff @ x - over <= high, then -coeff @ x - under <= -low)
+    b_ub : numpy.ndarray
+        the inequality constraints values
+    A_eq : scipy.sparse.csr_matrix
+        the equality constraints matrix (coeff @ x - above + below == targets)
+    b_eq : numpy.ndarray
+        the equality constraints values (the label values)
+    '''
+    import scipy.sparse
+
+    num_values, num_ingredients = coeff.shape
+    coeff = scipy.sparse.csr_matrix(coeff)
+    eye = scipy.sparse.identity(num_values, format='csr')
+    zeros = scipy.sparse.csr_matrix((num_values, num_values))
+    A_ub = scipy.sparse.bmat([[coeff, -eye, zeros, zeros, zeros], [-coeff, zeros, -eye, zeros, zeros]], format='csr')
+    b_ub = np.concatenate([high, -low])
+    A_eq = scipy.sparse.bmat([[coeff, zeros, zeros, -eye, eye]], format='csr')
+    b_eq = np.asarray(targets, dtype=float)
+    c = np.concatenate([np.zeros(num_ingredients), weights, weights, center_weight * weights, center_weight * weights])
+    return c, A_ub, b_ub, A_eq, b_eq
+
+
+def build_problem(ingredients, values, names=None, rules='fda', coeff=None):
+    '''Build the linear program for the recipe
+
+    Parameters
+    ----------
+    ingredients : dict of {str: dict} or IngredientStore
+        the ingredient name and the nutritional values of a serving of it (i.e. the fatsecret serving dict)
+    values : dict of {str: float}
+        the label value for each nutritional parameter to fit
+    names : list of str or None, optional
+        the ingredients to use (from the store). None to use all ingredients
+    rules : str or None, optional
+        the label rounding rules ('fda', 'eu' or 'exact') defining the range of true values of each label value
+    coeff : numpy.ndarray or None, optional
+        the parameter x ingredient coefficient matrix of the values and names, if already known. None to get it from the store
+
+    Returns
+    -------
+    c, A_ub, b_ub, A_eq, b_eq
+        the linear program (see build_interval_problem())
+    '''
+    with metrics.timer('reciper_matrix_seconds'):
+        if coeff is None:
+            coeff = get_store(ingredients).matrix(values.keys(), names)
+        targets = np.fromiter(values.values(), dtype=float, count=len(values))
+        low, high = label_intervals(values, rules)
+        problem = build_interval_problem(coeff, targets, low, high, 1 / error_scales(targets, low, high))
+    return problem
+
+
+def build_order_constraints(num_ingredients, num_cols, tail=None, tail_fraction=0.02, order=True):
+    '''Build the ingredient order inequalities (ingredient1 >= ingredient2 >= ...)
+
+    The label lists the ingredients by descending weight, except for the ingredients after "contains less than 2% of",
+    which can be listed in any order, and are each limited to tail_fraction of the total weight.
+    The amounts must be in the same unit (i.e. per gram normalized ingredients).
+
+    Parameters
+    ----------
+    num_ingredients : int
+        number of ingredients (the first variables), in the label order
+    num_cols : int
+        total number of variables
+    tail : int or None, optional
+        index of the first ingredient after "contains less than 2% of". None if the label has no such ingredients
+    tail_fraction : float, optional
+        the maximal fraction of the total weight for each of the tail ingredients
+    order : bool, optional
+        False to skip the order rows (only add the tail ingredient rows)
+
+    Returns
+    -------
+    A_ub : scipy.sparse.csr_matrix
+        the inequality constraints matrix. The order rows are a band of adjacent column differences
+        (x[i+1] - x[i] <= 0), followed by a row per tail ingredient (x[i] - tail_fraction * sum(x) <= 0)
+    b_ub : numpy.ndarray
+        the inequality constraints values (all 0)
+    '''
+    import scipy.sparse
+
+    if tail is None:
+        tail = num_ingredients
+    tail = min(max(tail, 0), num_ingredients)
+    num_order = max(tail - 1, 0) if order else 0
+    order = scipy.sparse.diags([-np.ones(num_order), np.ones(num_order)], [0, 1], shape=(num_order, num_cols))
+    num_tail = num_ingredients - tail
+    tail_rows = np.zeros([num_tail, num_cols])
+    tail_rows[:, :num_ingredients] = -tail_fraction
+    tail_rows[np.arange(num_tail), np.arange(tail, num_ingredients)] += 1
+    A_ub = scipy.sparse.vstack([order, scipy.sparse.csr_matrix(tail_rows)], format='csr')
+    b_ub = np.zeros(A_ub.shape[0])
+    return A_ub, b_ub
+
+
+def solve_recipe(ingredients, values, names=None, backend=None, method='highs', order=False, tail=None, tail_fraction=0.02,
+                 rules='fda', coeff=None, memo=None, mode='lp', integrality=None, time_limit=10.0, mip_gap=1e-4, recipe_scale=1.0):
+    '''Find the amount of each ingredient best fitting the label values
+
+    Parameters
+    ----------
+    ingredients : dict of {str: dict} or IngredientStore
+        the ingredient name and the nutritional values of a serving of it (i.e. the fatsecret serving dict)
+    values : dict of {str: float}
+        the label value for each nutritional parameter to fit
+    names : list of str or None, optional
+        the ingredients to use (from the store). None to use all ingredients
+    backend : LPBackend or None, optional
+        the solver backend to use. Reusing the same backend between solves starts each solve from the previous basis.
+        None to create a new backend
+    method : str, optional
+        the linear program method for a new backend ('highs', 'highs-ds' or 'highs-ipm')
+    order : bool, optional
+        True to constrain the ingredient amounts to the label order (descending weight)
+    tail : int or None, optional
+        index of the first ingredient after "contains less than 2% of" on the label. If not None, these ingredients are
+        not ordered, and each is limited to tail_fraction of the total weight
+    tail_fraction : float, optional
+        the maximal fraction of the total weight for each tail ingredient
+    rules : str or None, optional
+        the label rounding rules ('fda', 'eu' or 'exact'). Recipe values within the rounding range of the label value
+        have no error
+    coeff : numpy.ndarray or None, optional
+        the parameter x ingredient coefficient matrix of the values and names (i.e. kept up to date by a SolveSession).
+        None to get it from the store
+    memo : ResultCache or None, optional
+        the cache of solved problems. An identical problem returns the cached result without solving, and a problem
+        with the same ingredients and parameters (but different values) starts from its basis. None to always solve
+    mode : str, optional
+        'lp' to minimize the weighted absolute errors outside the label value intervals (linear program).
+        'milp' to solve the linear program with a whole number of pieces of the ingredients counted in pieces (see
+        get_pieces()), starting from the rounded linear program solution.
+        'nnls' or 'lsq' to minimize the weighted squared errors from the interval centers (see solve_least_squares()).
+        The least squares modes do not support the order and tail constraints
+    integrality : list of bool or None, optional
+        for the 'milp' mode, True for each ingredient (in the names order) counted in whole pieces. None to use the
+        ingredients with a piece weight or a discrete serving unit (see get_pieces())
+    time_limit : float or None, optional
+        for the 'milp' mode, the maximal search time (seconds). The best solution found so far is returned when it is
+        reached (with status 1). None for no limit
+    mip_gap : float, optional
+        for the 'milp' mode, the relative gap from the lower bound at which the search stops
+    recipe_scale : float, optional
+        for the 'milp' mode, the number of label value bases (i.e. label servings) in the whole recipe. The whole pieces
+        are of the whole recipe, so an ingredient amount is the number of pieces * the piece weight / recipe_scale
+
+    Returns
+    -------
+    dict with the following keys:
+        'success' : bool
+            True if the solver found an optimal solution
+        'status' : int
+            the solver status code (0 for success)
+        'message' : str
+            the solver status message
+        'iterations' : int
+            the number of solver iterations
+        'amounts' : dict of {str: float}
+            the amount of each ingredient (in the ingredient serving unit, i.e. grams for per gram normalized ingredients)
+        'units' : dict of {str: str}
+            the serving unit of each ingredient
+        'residuals' : dict of {str: float}
+            the label value minus the value obtained from the recipe, per parameter
+        'mip_gap' : float
+            for the 'milp' mode, the relative gap of the solution from the lower bound (0 if proven optimal)
+        'pieces' : dict of {str: float}
+            for the 'milp' mode, the whole number of pieces in the recipe of each ingredient counted in pieces
+    '''
+    if mode not in MODES:
+        raise ValueError('unknown solver mode %s. Use one of %s' % (mode, MODES))
+    if mode in LSQ_MODES and (order or tail is not None):
+        raise ValueError('the order and tail constraints need the lp mode (mode is %s)' % mode)
+    if backend is None:
+        backend = LPBackend(method)
+    store = get_store(ingredients)
+    rows = store.rows(names)
+    names = [store.names[x] for x in rows]
+    logger.debug('recipe for %d values using %d ingredients' % (len(values), len(names)))
+    pieces = get_pieces(store, rows, integrality) if mode == 'milp' else None
+    if memo is not None:
+        if coeff is None:
+            coeff = store.matrix(values.keys(), names)
+        options = {'order': order, 'tail': tail, 'tail_fraction': tail_fraction, 'rules': rules, 'mode': mode, 'method': backend.method}
+        if mode == 'milp':
+            # the piece weights are not in the coefficients, and the search limits change the result
+            options.update({'pieces': pieces, 'recipe_scale': recipe_scale, 'time_limit': time_limit, 'mip_gap': mip_gap})
+        structure_key, value_key = memo.keys(names, coeff, values, options)
+        result = memo.get(value_key)
+        if result is not None:
+            return result
+        basis = memo.get_basis(structure_key) if mode in ('lp', 'milp') else None
+        if basis is not None:
+            backend.set_basis(basis)
+        metrics.inc('reciper_memo_misses_total')
+    if mode == 'lp':
+        res, fit_coeff = _solve_lp(store, values, names, rules, coeff, backend, order, tail, tail_fraction)
+    elif mode == 'milp':
+        res, fit_coeff = _solve_lp(store, values, names, rules, coeff, backend, order, tail, tail_fraction, pieces, recipe_scale,
+                                   time_limit, mip_gap)
+    else:
+        res, fit_coeff = _solve_lsq(store, values, names, rules, coeff, mode)
+    logger.debug(res)
+    result = _get_result(res, store, values, names, rows, fit_coeff)
+    if 'mip_gap' in res:
+        result['mip_gap'] = res.mip_gap
+    if res.get('pieces') is not None:
+        result['pieces'] = res.pieces
+    # a milp solution stopped by the time limit is not stored (a longer search can find a better one)
+    if memo is not None and result['success'] and result['status'] == 0:
+        memo.set(structure_key, value_key, result, backend.get_basis() if mode in ('lp', 'milp') else None)
+    return result
+
+
+def get_pieces(store, rows, integrality=None):
+    '''Get the weight of one piece of each ingredient counted in whole pieces (the integer variables of the milp mode)
+
+    Parameters
+    ----------
+    store : IngredientStore
+    rows : list of int
+        the store rows of the ingredients
+    integrality : list of bool or None, optional
+        True for each ingredient counted in pieces. None for the ingredients with a piece weight (i.e. foods with a serving
+        such as '1 large egg', see units.normalize_foods()) or a discrete serving unit (i.e. per slice values)
+
+    Returns
+    -------
+    list of (float or None)
+        the piece weight of each ingredient, in the ingredient unit (1 for the ingredients with values per piece). None
+        for the ingredients not counted in pieces
+    '''
+    pieces = []
+    for idx, crow in enumerate(rows):
+        cpiece = store.pieces[crow]
+        if integrality is not None and not integrality[idx]:
+            cpiece = None
+        elif cpiece is None and (integrality is not None or is_discrete_unit(store.units[crow])):
+            # the amount is in the unit of the values (i.e. slices), so a piece is one unit
+            cpiece = 1.0
+        pieces.append(cpiece)
+    return pieces
+
+
+def _solve_lp(store, values, names, rules, coeff, backend, order, tail, tail_fraction, pieces=None, recipe_scale=1.0, time_limit=None,
+              mip_gap=1e-4):
+    '''Solve the recipe linear program (with the order and tail constraints), or the mixed integer program if any of the
+    ingredients is counted in pieces'''
+    import scipy.sparse
+
+    c, A_ub, b_ub, A_eq, b_eq = build_problem(store, values, names, rules, coeff)
+    params = list(values.keys())
+    col_keys = names + [(ckind, x) for ckind in ('over', 'under', 'above', 'below') for x in params]
+    row_keys = [('value', x) for x in params] + [('high', x) for x in params] + [('low', x) for x in params]
+    if order or tail is not None:
+        A_order, b_order = build_order_constraints(len(names), len(c), tail, tail_fraction, order=order)
+        A_ub = scipy.sparse.vstack([A_ub, A_order], format='csr')
+        b_ub = np.concatenate([b_ub, b_order])
+        head = len(names) if tail is None else min(max(tail, 0), len(names))
+        if order:
+            row_keys += [('order', names[idx], names[idx + 1]) for idx in range(head - 1)]
+        row_keys += [('tail', x) for x in names[head:]]
+    fit_coeff = A_eq[:, :len(names)]
+    res = backend.solve(c, A_eq=A_eq, b_eq=b_eq, A_ub=A_ub, b_ub=b_ub, bounds=(0, None), col_keys=col_keys, row_keys=row_keys)
+    counted = [] if pieces is None else [idx for idx, x in enumerate(pieces) if x is not None]
+    if counted and res.x is not None:
+        # an integer piece count variable k per counted ingredient, with amount == k * piece / recipe_scale
+        num_cols = len(c)
+        sizes = np.array([pieces[x] for x in counted], dtype=float) / recipe_scale
+        link_rows = np.arange(len(counted))
+        A_link = scipy.sparse.csr_matrix((np.concatenate([np.ones(len(counted)), -sizes]),
+                                          (np.concatenate([link_rows, link_rows]), np.concatenate([counted, num_cols + link_rows]))),
+                                         shape=(len(counted), num_cols + len(counted)))
+        c = np.concatenate([c, np.zeros(len(counted))])
+        A_eq = scipy.sparse.vstack([scipy.sparse.hstack([A_eq, scipy.sparse.csr_matrix((A_eq.shape[0], len(counted)))]), A_link], format='csr')
+        b_eq = np.concatenate([b_eq, np.zeros(len(counted))])
+        A_ub = scipy.sparse.hstack([A_ub, scipy.sparse.csr_matrix((A_ub.shape[0], len(counted)))], format='csr')
+        integer = np.zeros(len(c), dtype=bool)
+        integer[num_cols:] = True
+        # the relaxation is the starting point of the integer search (only used by highspy, scipy milp takes no start)
+        x0 = None
+        if importlib.util.find_spec('highspy') is not None:
+            x0 = round_seed(np.concatenate([res.x, res.x[counted] / sizes]), integer, c, A_eq, b_eq, A_ub, b_ub)
+        logger.debug('mixed integer solve of %d ingredients counted in pieces (seed %s)' % (len(counted), 'feasible' if x0 is not None else 'none'))
+        res = solve_mixed_integer(c, integer, A_eq, b_eq, A_ub, b_ub, time_limit=time_limit, mip_gap=mip_gap, x0=x0)
+        if res.x is not None:
+            res.pieces = {names[x]: float(round(ccount)) for x, ccount in zip(counted, res.x[num_cols:].tolist())}
+    # the equality constraints rows are the recipe parameter values
+    return res, fit_coeff
+
+
+def _solve_lsq(store, values, names, rules, coeff, mode):
+    '''Solve the recipe with a least squares mode, fitting the centers of the label value intervals'''
+    if coeff is None:
+        with metrics.timer('reciper_matrix_seconds'):
+            coeff = store.matrix(values.keys(), names)
+    targets = np.fromiter(values.values(), dtype=float, count=len(values))
+    low, high = label_intervals(values, rules)
+    return solve_least_squares(coeff, (low + high) / 2, 1 / error_scales(targets, low, high), mode), coeff
+
+
+def _get_result(res, store, values, names, rows, coeff):
+    '''Get the solve_recipe() result dict of a solver result'''
+    params = list(values.keys())
+
+    result = {'success': bool(res.success), 'status': int(res.status), 'message': str(res.message), 'iterations': int(res.get('nit', 0))}
+    result['units'] = {cname: store.units[x] for cname, x in zip(names, rows)}
+    if res.x is None:
+        result['amounts'] = {}
+        result['residuals'] = {}
+        return result
+    amounts = res.x[:len(names)]
+    result['amounts'] = {cname: float(amounts[idx]) for idx, cname in enumerate(names)}
+    recipe_values = coeff @ amounts
+    result['residuals'] = {cparam: float(values[cparam] - recipe_values[idx]) for idx, cparam in enumerate(params)}
+    for cparam, cval in values.items():
+        metrics.observe('reciper_residual_relative', abs(result['residuals'][cparam]) / max(abs(cval), 1), param=cparam)
+    return result
@@ -0,0 +1,259 @@
+# reciper sources - the nutrient database sources (fatsecret, a local food database or a fixture http server)
+#
+# all sources return the foods in the same (fatsecret) format: foods_search() returns a list of dicts with the
+# 'food_id' and 'food_name' fields, and food_get() returns a dict with the 'food_id', 'food_name' and
+# 'servings': {'serving': list of serving dicts} fields
+
+from logging import getLogger
+import http.client
+import json
+import os
+import urllib.parse
+
+logger = getLogger(__name__)
+
+# the environment variables with the fatsecret api credentials
+FATSECRET_KEY_ENV = 'RECIPER_FATSECRET_KEY'
+FATSECRET_SECRET_ENV = 'RECIPER_FATSECRET_SECRET'
+
+# the fatsecret REST api path (also served by the fixture server)
+API_PATH = '/rest/server.api'
+
+
+def standard_food(food):
+    '''Get a food in the standard format (a string food_id, and a list of servings even if there is only one)
+
+    Parameters
+    ----------
+    food : dict
+        the food details
+
+    Returns
+    -------
+    dict
+    '''
+    food = dict(food)
+    if 'food_id' in food:
+        food['food_id'] = str(food['food_id'])
+    servings = food.get('servings') or {}
+    serving = servings.get('serving', [])
+    if isinstance(serving, dict):
+        serving = [serving]
+    food['servings'] = dict(servings, serving=serving)
+    return food
+
+
+def standard_foods(foods):
+    '''Get search results in the standard format (a list, with string food_ids)
+
+    Parameters
+    ----------
+    foods : list of dict or dict or None
+        the search results (a single result can be a dict, and no results None)
+
+    Returns
+    -------
+    list of dict
+    '''
+    if foods is None:
+        return []
+    if isinstance(foods, dict):
+        foods = [foods]
+    return [dict(x, food_id=str(x['food_id'])) if 'food_id' in x else x for x in foods]
+
+
+class NutrientSource:
+    '''A nutrient database source
+
+    The subclasses implement foods_search() and food_get(). Sources with a native bulk lookup (one request for many
+    foods) implement get_many() and set bulk; for the others, get_many() is one food_get() call per food.
+    '''
+    # True for sources not using the network (no rate limit, no offline mode)
+    local = False
+    # True for sources where get_many() is a single call (so it is rate limited and retried as one call)
+    bulk = False
+
+    def foods_search(self, query):
+        '''Search for foods matching the query
+
+        Parameters
+        ----------
+        query : str
+
+        Returns
+        -------
+        list of dict
+            the matching foods (with the 'food_name' and 'food_id' fields)
+        '''
+        raise NotImplementedError
+
+    def food_get(self, food_id):
+        '''Get the nutritional values of a food
+
+        Parameters
+        ----------
+        food_id : str
+
+        Returns
+        -------
+        dict
+            the food details (with the 'servings' field)
+        '''
+        raise NotImplementedError
+
+    def get_many(self, food_ids):
+        '''Get the nutritional values of many foods
+
+        Parameters
+        ----------
+        food_ids : list of str
+
+        Returns
+        -------
+        dict of {str: dict}
+            the food details of each food_id (None for the foods not found)
+        '''
+        foods = {}
+        for cid in food_ids:
+            try:
+                foods[cid] = self.food_get(cid)
+            except (LookupError, ValueError) as err:
+                logger.warning('food %s not found: %s' % (cid, err))
+                foods[cid] = None
+        return foods
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class FatsecretSource(NutrientSource):
+    def __init__(self, key=None, secret=None):
+        '''The fatsecret api (requires the fatsecret package)
+
+        Parameters
+        ----------
+        key, secret : str or None, optional
+            the fatsecret api credentials. None to use the RECIPER_FATSECRET_KEY/RECIPER_FATSECRET_SECRET environment variables
+        '''
+        from fatsecret import Fatsecret
+
+        if key is None:
+            key = os.environ.get(FATSECRET_KEY_ENV)
+        if secret is None:
+            secret = os.environ.get(FATSECRET_SECRET_ENV)
+        if not key or not secret:
+            raise ValueError('fatsecret credentials not set. Set the %s and %s environment variables' % (FATSECRET_KEY_ENV, FATSECRET_SECRET_ENV))
+        self.client = Fatsecret(key, secret)
+
+    def foods_search(self, query):
+        return standard_foods(self.client.foods_search(query))
+
+    def food_get(self, food_id):
+        return standard_food(self.client.food_get(food_id))
+
+
+class HttpSource(NutrientSource):
+    bulk = True
+
+    def __init__(self, url, timeout=10.0):
+        '''A fatsecret compatible http server (i.e. the fixture server, see reciper.fixtures)
+
+        The http connection is kept open between calls, so each thread should have its own source.
+
+        Parameters
+        ----------
+        url : str
+            the server url (i.e. http://127.0.0.1:8765)
+        timeout : float, optional
+            the request timeout (seconds)
+        '''
+        parsed = urllib.parse.urlsplit(url)
+        self.url = url
+        self.timeout = timeout
+        self._https = parsed.scheme == 'https'
+        self._netloc = parsed.netloc
+        self._path = parsed.path.rstrip('/') + API_PATH
+        self._con = None
+
+    def _connect(self):
+        if self._https:
+            return http.client.HTTPSConnection(self._netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(self._netloc, timeout=self.timeout)
+
+    def _request(self, params):
+        '''Call the api method and get the json response (retrying once on a closed keep alive connection)'''
+        path = '%s?%s' % (self._path, urllib.parse.urlencode(dict(params, format='json')))
+        for cattempt in range(2):
+            if self._con is None:
+                self._con = self._connect()
+            try:
+                self._con.request('GET', path)
+                response = self._con.getresponse()
+                body = response.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                self.close()
+                if cattempt == 1:
+                    raise
+        if response.status != 200:
+            raise LookupError('%s: http status %d' % (params['method'], response.status))
+        data = json.loads(body)
+        if 'error' in data:
+            raise ValueError('%s: %s' % (params['method'], data['error'].get('message')))
+        return data
+
+    def foods_search(self, query):
+        data = self._request({'method': 'foods.search', 'search_expression': query})
+        return standard_foods((data.get('foods') or {}).get('food'))
+
+    def food_get(self, food_id):
+        return standard_food(self._request({'method': 'food.get.v2', 'food_id': food_id})['food'])
+
+    def get_many(self, food_ids):
+        '''Get the nutritional values of many foods in one request (the foods.get_many method of the fixture server)'''
+        food_ids = [str(x) for x in food_ids]
+        foods = dict.fromkeys(food_ids)
+        if not food_ids:
+            return foods
+        data = self._request({'method': 'foods.get_many', 'food_ids': ','.join(food_ids)})
+        for cfood in standard_foods((data.get('foods') or {}).get('food')):
+            foods[cfood['food_id']] = standard_food(cfood)
+        return foods
+
+    def close(self):
+        if self._con is not None:
+            self._con.close()
+            self._con = None
+
+
+def get_source_factory(source=None):
+    '''Get the factory creating the nutrient source from its description
+
+    Parameters
+    ----------
+    source : str or None, optional
+        'fatsecret' (or None) for the fatsecret api, an http(s) url for a fatsecret compatible server (i.e. the fixture
+        server), or the file name prefix of a local food database (see reciper.fooddb)
+
+    Returns
+    -------
+    callable
+        creating the source (called once per lookup thread, see LookupService)
+    bool
+        True if the source is local (no rate limit or offline mode needed)
+    '''
+    if source is None or source == 'fatsecret':
+        return FatsecretSource, False
+    if source.startswith(('http://', 'https://')):
+        return (lambda: HttpSource(source)), False
+    from .fooddb import LocalFoodDatabase
+
+    # the local database is read only, so it is shared between the threads
+    food_db = LocalFoodDatabase(source)
+    return (lambda: food_db), True
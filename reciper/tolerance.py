@@ -0,0 +1,179 @@
+# reciper tolerance - the range of true nutrient values consistent with a rounded label value
+
+from logging import getLogger
+
+import numpy as np
+
+from .matrix import NUTRIENT_SCHEMA
+
+logger = getLogger(__name__)
+
+# the label rounding rules. For each nutrient:
+#   'zero' : true values below it are declared as 0
+#   'steps' : list of (upper bound, rounding step) - values below the upper bound are rounded to the step
+_FDA_FAT = {'zero': 0.5, 'steps': [(5, 0.5), (np.inf, 1)]}
+_FDA_GRAMS = {'zero': 0.5, 'steps': [(np.inf, 1)]}
+_FDA_MG = {'zero': 5, 'steps': [(140, 5), (np.inf, 10)]}
+_EU_GRAMS = {'zero': 0.5, 'steps': [(10, 0.1), (np.inf, 1)]}
+_EU_SATURATES = {'zero': 0.1, 'steps': [(10, 0.1), (np.inf, 1)]}
+# the eu rules are for salt (g), converted to sodium mg (salt = 2.5 * sodium)
+_EU_SODIUM = {'zero': 5, 'steps': [(400, 4), (np.inf, 40)]}
+
+
+def _fda_dv(nutrient):
+    '''The FDA rule for the vitamins and minerals declared as percent of the daily value (converted to the schema unit)'''
+    dv = NUTRIENT_SCHEMA[nutrient]['dv'] / 100
+    return {'zero': 2 * dv, 'steps': [(10 * dv, 2 * dv), (50 * dv, 5 * dv), (np.inf, 10 * dv)]}
+
+
+RULES = {
+    # US FDA (21 CFR 101.9)
+    'fda': {'calories': {'zero': 5, 'steps': [(50, 5), (np.inf, 10)]},
+            'fat': _FDA_FAT, 'saturated_fat': _FDA_FAT, 'trans_fat': _FDA_FAT,
+            'polyunsaturated_fat': _FDA_FAT, 'monounsaturated_fat': _FDA_FAT,
+            'cholesterol': {'zero': 2, 'steps': [(np.inf, 5)]},
+            'sodium': _FDA_MG, 'potassium': _FDA_MG,
+            'carbohydrate': _FDA_GRAMS, 'fiber': _FDA_GRAMS, 'sugar': _FDA_GRAMS, 'protein': _FDA_GRAMS,
+            'vitamin_a': _fda_dv('vitamin_a'), 'vitamin_c': _fda_dv('vitamin_c'), 'calcium': _fda_dv('calcium'), 'iron': _fda_dv('iron')},
+    # EU (guidance for regulation 1169/2011)
+    'eu': {'calories': {'zero': 0.5, 'steps': [(np.inf, 1)]},
+           'fat': _EU_GRAMS, 'carbohydrate': _EU_GRAMS, 'sugar': _EU_GRAMS, 'protein': _EU_GRAMS, 'fiber': _EU_GRAMS,
+           'saturated_fat': _EU_SATURATES, 'sodium': _EU_SODIUM},
+    # the label values are exact
+    'exact': {},
+}
+
+# the smallest error scale (so the weights of 0 label values stay finite)
+MIN_SCALE = 0.001
+
+
+def rounding_tolerance(value):
+    '''Get the uncertainty of a label value due to its rounding, for nutrients without a rounding rule
+
+    The rounding step is guessed from the number of decimals of the value (up to 3), and the tolerance is half a step
+
+    Parameters
+    ----------
+    value : float
+
+    Returns
+    -------
+    float
+        the maximal difference between the true value and the label value
+    '''
+    for cdecimals in range(4):
+        if abs(round(value, cdecimals) - value) < 1e-9:
+            return 0.5 * 10 ** -cdecimals
+    return 0.0005
+
+
+def label_interval(param, value, rules='fda'):
+    '''Get the range of true values that are declared as the label value
+
+    Parameters
+    ----------
+    param : str
+        the nutrient
+    value : float
+        the label value
+    rules : str or None, optional
+        the rounding rules ('fda', 'eu' or 'exact'). Nutrients without a rule use rounding_tolerance().
+        None or 'exact' for no tolerance
+
+    Returns
+    -------
+    (float, float)
+        the low and high true values
+    '''
+    if rules is None or rules == 'exact':
+        return value, value
+    if rules not in RULES:
+        raise ValueError('unknown rounding rules %s. Use one of %s' % (rules, list(RULES.keys())))
+    rule = RULES[rules].get(param)
+    if rule is None:
+        tolerance = rounding_tolerance(value)
+        return max(value - tolerance, 0), value + tolerance
+    if value == 0:
+        # values above the zero threshold can still round to 0 (i.e. cholesterol 2 to 2.5 mg, with 5 mg steps)
+        return 0, max(rule['zero'], rule['steps'][0][1] / 2)
+    prev_bound, prev_step = None, None
+    for cbound, cstep in rule['steps']:
+        if value < cbound:
+            break
+        prev_bound, prev_step = cbound, cstep
+    low = value - cstep / 2
+    if prev_bound is not None and low < prev_bound:
+        # the true values below the bracket bound are rounded to the smaller step of the previous bracket
+        # (i.e. fda fat 4.75 to 5 g rounds to 5 in 0.5 g steps, so the range of a 5 g label is 4.75 to 5.5)
+        low = min(prev_bound, value - prev_step / 2)
+    # true values below the zero threshold are declared as 0 (but keep the label value itself in the range)
+    low = min(max(low, rule['zero']), value)
+    return low, value + cstep / 2
+
+
+def round_label(param, value, rules='fda'):
+    '''Round a true nutrient value as it is declared on the label
+
+    Parameters
+    ----------
+    param : str
+        the nutrient
+    value : float
+        the true value
+    rules : str or None, optional
+        the rounding rules ('fda', 'eu' or 'exact'). Nutrients without a rule are not rounded
+
+    Returns
+    -------
+    float
+        the label value
+    '''
+    if rules is None or rules == 'exact':
+        return value
+    rule = RULES[rules].get(param)
+    if rule is None:
+        return value
+    if value < rule['zero']:
+        return 0.0
+    for cbound, cstep in rule['steps']:
+        if value < cbound:
+            break
+    return round(round(value / cstep) * cstep, 6)
+
+
+def label_intervals(values, rules='fda'):
+    '''Get the range of true values for each label value
+
+    Parameters
+    ----------
+    values : dict of {str: float}
+        the label value of each nutrient
+    rules : str or None, optional
+        the rounding rules (see label_interval())
+
+    Returns
+    -------
+    low : numpy.ndarray
+    high : numpy.ndarray
+        the low and high true value of each nutrient (in the values order)
+    '''
+    intervals = np.array([label_interval(cparam, cval, rules) for cparam, cval in values.items()], dtype=float).reshape(-1, 2)
+    return intervals[:, 0], intervals[:, 1]
+
+
+def error_scales(targets, low, high):
+    '''Get the scale of each parameter error, used to weight the errors in the objective
+
+    The scale is the label value (so errors are relative), but not smaller than the tolerance interval width
+    (so 0 label values get a finite weight)
+
+    Parameters
+    ----------
+    targets, low, high : numpy.ndarray
+        the label values and their tolerance intervals
+
+    Returns
+    -------
+    numpy.ndarray
+    '''
+    return np.maximum(np.maximum(np.abs(targets), high - low), MIN_SCALE)
@@ -0,0 +1,188 @@
+# reciper uncertainty - ingredient amount intervals from perturbed label and ingredient values
+
+from logging import getLogger
+from multiprocessing import Pool
+
+import numpy as np
+
+from .backend import LPBackend
+from .metrics import metrics
+from .solver import build_interval_problem, build_order_constraints, get_store, solve_recipe
+from .tolerance import error_scales, label_intervals
+
+logger = getLogger(__name__)
+
+
+def perturb(coeff, low, high, num_samples, matrix_noise, rng):
+    '''Create perturbed copies of the coefficient matrix and the label values
+
+    Parameters
+    ----------
+    coeff : numpy.ndarray
+        the nutrient x ingredient coefficient matrix
+    low, high : numpy.ndarray
+        the range of true values of each nutrient. The label values are drawn uniformly from it
+    num_samples : int
+        number of perturbed copies
+    matrix_noise : float
+        the relative standard deviation of the coefficient perturbation (normal)
+    rng : numpy.random.Generator
+
+    Returns
+    -------
+    coeffs : numpy.ndarray
+        the perturbed coefficients (samples x nutrients x ingredients)
+    targets : numpy.ndarray
+        the perturbed label values (samples x nutrients)
+    '''
+    coeffs = coeff[np.newaxis, :, :] * (1 + matrix_noise * rng.standard_normal((num_samples,) + coeff.shape))
+    np.maximum(coeffs, 0, out=coeffs)
+    targets = rng.uniform(low, high, (num_samples, len(low)))
+    return coeffs, targets
+
+
+def solve_batch(coeffs, targets, weights, A_order=None, b_order=None, method='highs'):
+    '''Solve many independent recipe problems as a single block diagonal linear program
+
+    Each sample is a block with its own ingredient and error variables (as in solver.build_interval_problem(),
+    with the sample label values as exact values).
+    Since the blocks are independent, the optimum of the combined problem is the optimum of each block.
+
+    Parameters
+    ----------
+    coeffs : numpy.ndarray
+        the coefficients (samples x nutrients x ingredients)
+    targets : numpy.ndarray
+        the label values (samples x nutrients)
+    weights : numpy.ndarray
+        the objective weight of each nutrient error
+    A_order, b_order : scipy.sparse matrix and numpy.ndarray or None, optional
+        the inequality constraints on the ingredient amounts of a single sample (i.e. the ingredient order),
+        repeated for each block
+    method : str, optional
+        the linear program method
+
+    Returns
+    -------
+    numpy.ndarray
+        the ingredient amounts (samples x ingredients), nan if the solve failed
+    '''
+    import scipy.sparse
+
+    num_samples, num_values, num_ingredients = coeffs.shape
+    # the block diagonal coefficient matrix (the ingredient variables of sample i are i * num_ingredients...)
+    sample_idx, value_idx, ingredient_idx = np.indices(coeffs.shape).reshape(3, -1)
+    coeff = scipy.sparse.csr_matrix((coeffs.ravel(), (sample_idx * num_values + value_idx, sample_idx * num_ingredients + ingredient_idx)),
+                                    shape=(num_samples * num_values, num_samples * num_ingredients))
+    targets = targets.ravel()
+    c, A_ub, b_ub, A_eq, b_eq = build_interval_problem(coeff, targets, targets, targets, np.tile(weights, num_samples))
+    if A_order is not None:
+        A_order = scipy.sparse.kron(scipy.sparse.identity(num_samples), A_order, format='csr')
+        A_order.resize((A_order.shape[0], A_ub.shape[1]))
+        A_ub = scipy.sparse.vstack([A_ub, A_order], format='csr')
+        b_ub = np.concatenate([b_ub, np.tile(b_order, num_samples)])
+    res = LPBackend(method, warm_start=False).solve(c, A_eq=A_eq, b_eq=b_eq, A_ub=A_ub, b_ub=b_ub)
+    if res.x is None:
+        logger.warning('batch solve failed: %s' % res.message)
+        return np.full((num_samples, num_ingredients), np.nan)
+    return res.x[:num_samples * num_ingredients].reshape(num_samples, num_ingredients)
+
+
+def _solve_batch_args(args):
+    return solve_batch(*args)
+
+
+def recipe_intervals(ingredients, values, names=None, num_samples=1000, rules='fda', matrix_noise=0.05,
+                     order=False, tail=None, tail_fraction=0.02, percentiles=(2.5, 97.5), chunk_size=250,
+                     processes=1, method='highs', seed=None, point=None):
+    '''Get confidence intervals of the ingredient amounts by solving randomly perturbed recipe problems
+
+    The label values are drawn uniformly from their rounding range, and the ingredient nutritional values
+    are perturbed by a relative normal noise. The perturbed problems are built as one array, and solved in chunks
+    (each chunk as a single block diagonal linear program), optionally in a process pool.
+
+    Parameters
+    ----------
+    ingredients : dict of {str: dict} or IngredientStore
+        the ingredient name and the nutritional values of a serving of it
+    values : dict of {str: float}
+        the label value for each nutritional parameter to fit
+    names : list of str or None, optional
+        the ingredients to use (from the store). None to use all ingredients
+    num_samples : int, optional
+        number of perturbed problems
+    rules : str or None, optional
+        the label rounding rules ('fda', 'eu' or 'exact') defining the range of true values of each label value
+    matrix_noise : float, optional
+        the relative standard deviation of the ingredient nutritional values
+    order, tail, tail_fraction : optional
+        the ingredient order constraints (see solver.solve_recipe())
+    percentiles : (float, float), optional
+        the percentiles of the interval
+    chunk_size : int, optional
+        number of perturbed problems solved together
+    processes : int or None, optional
+        number of worker processes. 1 to solve in the current process, None to use the number of cpus
+    method : str, optional
+        the linear program method
+    seed : int or None, optional
+        the random seed
+    point : dict or None, optional
+        the solve_recipe() result of the unperturbed problem (with the same options), if already solved. None to solve it
+
+    Returns
+    -------
+    dict with the following keys:
+        'amounts' : dict of {str: float}
+            the amount of each ingredient for the unperturbed problem
+        'intervals' : dict of {str: (float, float)}
+            the (low, high) percentiles of each ingredient amount
+        'median' : dict of {str: float}
+            the median amount of each ingredient
+        'std' : dict of {str: float}
+            the standard deviation of each ingredient amount
+        'num_solved' : int
+            number of perturbed problems solved successfully
+    '''
+    store = get_store(ingredients)
+    names = [store.names[x] for x in store.rows(names)]
+    params = list(values.keys())
+    rng = np.random.default_rng(seed)
+    coeff = store.matrix(params, names)
+    targets = np.array([values[x] for x in params], dtype=float)
+    low, high = label_intervals(values, rules)
+    weights = 1 / error_scales(targets, low, high)
+
+    if point is None:
+        point = solve_recipe(store, values, names, order=order, tail=tail, tail_fraction=tail_fraction, method=method, rules=rules)
+
+    A_order, b_order = None, None
+    if order or tail is not None:
+        A_order, b_order = build_order_constraints(len(names), len(names), tail, tail_fraction, order=order)
+    with metrics.timer('reciper_intervals_seconds'):
+        coeffs, samples = perturb(coeff, low, high, num_samples, matrix_noise, rng)
+        chunks = [(coeffs[x:x + chunk_size], samples[x:x + chunk_size], weights, A_order, b_order, method)
+                  for x in range(0, num_samples, chunk_size)]
+        if processes == 1:
+            amounts = [solve_batch(*x) for x in chunks]
+        else:
+            with Pool(processes) as pool:
+                amounts = pool.map(_solve_batch_args, chunks)
+    amounts = np.concatenate(amounts)
+    solved = ~np.isnan(amounts).any(axis=1)
+    amounts = amounts[solved]
+    logger.debug('solved %d of %d perturbed problems' % (len(amounts), num_samples))
+
+    result = {'amounts': point['amounts'], 'num_solved': int(solved.sum())}
+    if len(amounts) == 0:
+        result['intervals'] = {}
+        result['median'] = {}
+        result['std'] = {}
+        return result
+    low, high = np.percentile(amounts, percentiles, axis=0)
+    median = np.median(amounts, axis=0)
+    std = np.std(amounts, axis=0)
+    result['intervals'] = {cname: (float(low[idx]), float(high[idx])) for idx, cname in enumerate(names)}
+    result['median'] = {cname: float(median[idx]) for idx, cname in enumerate(names)}
+    result['std'] = {cname: float(std[idx]) for idx, cname in enumerate(names)}
+    return result
@@ -0,0 +1,218 @@
+# reciper units - normalize the ingredient servings to per gram nutritional values
+
+from logging import getLogger
+import re
+
+import numpy as np
+
+from .matrix import NUTRIENTS, parse_servings
+
+logger = getLogger(__name__)
+
+# grams per mass unit
+MASS_UNITS = {'g': 1.0, 'mg': 0.001, 'kg': 1000.0, 'oz': 28.349523, 'lb': 453.59237}
+
+# ml per volume unit
+VOLUME_UNITS = {'ml': 1.0, 'l': 1000.0, 'fl oz': 29.573530, 'cup': 236.58824, 'tbsp': 14.786765, 'tsp': 4.928922}
+
+# density (g/ml) of common liquid ingredients, matched as a substring of the food name (longest match first)
+DENSITIES = {'water': 1.0, 'milk': 1.03, 'skim milk': 1.035, 'cream': 1.01, 'heavy cream': 0.994, 'yogurt': 1.06,
+             'oil': 0.92, 'olive oil': 0.91, 'butter': 0.911, 'honey': 1.42, 'syrup': 1.33, 'maple syrup': 1.37,
+             'molasses': 1.4, 'vinegar': 1.01, 'soy sauce': 1.15, 'juice': 1.05, 'orange juice': 1.04, 'wine': 0.99,
+             'beer': 1.01, 'egg': 1.03, 'egg white': 1.04, 'ketchup': 1.15, 'mayonnaise': 0.91, 'sugar': 0.85,
+             'flour': 0.53, 'salt': 1.2, 'rice': 0.85, 'oats': 0.41, 'cocoa': 0.52}
+
+# density used for volume servings of foods not in DENSITIES
+DEFAULT_DENSITY = 1.0
+
+# the countable serving units (an integer number of servings in the milp solver mode), matched as a whole word of the
+# serving measurement_description (i.e. 'slice', '1 large egg')
+DISCRETE_UNITS = {'slice', 'slices', 'egg', 'eggs', 'piece', 'pieces', 'sachet', 'sachets', 'packet', 'packets', 'cookie',
+                  'cookies', 'cracker', 'crackers', 'bar', 'bars', 'tablet', 'tablets', 'capsule', 'capsules', 'clove',
+                  'cloves', 'pita', 'pitas', 'bun', 'buns', 'roll', 'rolls', 'muffin', 'muffins', 'tortilla', 'tortillas'}
+
+# the piece sizes, counted only when they are the whole measurement_description (fatsecret describes a whole egg or
+# fruit serving as 'large'), but not as a size of another unit (i.e. '1 cup, large')
+PIECE_SIZES = {'small', 'medium', 'large', 'extra', 'jumbo'}
+
+
+def is_discrete_unit(measurement_description):
+    '''Check if a serving unit is counted in whole pieces (i.e. slices or eggs, but not grams or cups)
+
+    Parameters
+    ----------
+    measurement_description : str or None
+        the serving measurement_description
+
+    Returns
+    -------
+    bool
+    '''
+    if not measurement_description:
+        return False
+    words = re.findall(r'[a-z]+', measurement_description.lower())
+    return any(x in DISCRETE_UNITS for x in words) or (len(words) > 0 and all(x in PIECE_SIZES for x in words))
+
+
+def get_density(food_name=None):
+    '''Get the density of a food
+
+    Parameters
+    ----------
+    food_name : str or None, optional
+        the food name. The longest DENSITIES key contained in the name is used
+
+    Returns
+    -------
+    float
+        the density (g/ml). DEFAULT_DENSITY if the food is not known
+    '''
+    if food_name is None:
+        return DEFAULT_DENSITY
+    name = food_name.lower()
+    matches = [x for x in DENSITIES if x in name]
+    if not matches:
+        logger.debug('density not known for food %s, using default' % food_name)
+        return DEFAULT_DENSITY
+    return DENSITIES[max(matches, key=len)]
+
+
+def get_servings(food):
+    '''Get the list of servings of a fatsecret food
+
+    Parameters
+    ----------
+    food : dict
+        the fatsecret food_get() result
+
+    Returns
+    -------
+    list of dict
+    '''
+    servings = food.get('servings', {}).get('serving', [])
+    if isinstance(servings, dict):
+        servings = [servings]
+    return servings
+
+
+def _serving_grams(servings, densities):
+    '''Get the weight in grams (nan if unknown) and whether the unit is a mass unit of each serving
+
+    The volume servings are converted with the density of their food, and the unknown units and non positive amounts
+    have no weight
+    '''
+    factors = np.full(len(servings), np.nan)
+    is_mass = np.zeros(len(servings), dtype=bool)
+    amounts = np.full(len(servings), np.nan)
+    for idx, cserving in enumerate(servings):
+        cunit = str(cserving.get('metric_serving_unit', '')).strip().lower()
+        if cunit in MASS_UNITS:
+            factors[idx] = MASS_UNITS[cunit]
+            is_mass[idx] = True
+        elif cunit in VOLUME_UNITS:
+            factors[idx] = VOLUME_UNITS[cunit] * densities[idx]
+        try:
+            amounts[idx] = float(cserving.get('metric_serving_amount'))
+        except (TypeError, ValueError):
+            pass
+    grams = amounts * factors
+    grams[~(grams > 0)] = np.nan
+    return grams, is_mass
+
+
+def normalize_foods(foods, cache=None):
+    '''Get the per gram nutritional values of fatsecret foods, using all the servings of each food
+
+    The servings of all the foods are parsed into one array. The per gram value of each nutrient is the total value
+    over the total weight of the servings with a metric weight (only the mass unit servings if the food has any, since
+    volume servings need a density), so the rounding of the individual serving values averages out. The weight of the
+    first serving counted in pieces (see is_discrete_unit(), i.e. '1 large egg') is kept as 'piece_grams' (None if the
+    food has no such serving), for the whole servings of the milp solver mode.
+
+    Parameters
+    ----------
+    foods : list of dict
+        the fatsecret food_get() results
+    cache : NutrientCache or None, optional
+        the cache for the normalized values (by food_id). None to not cache
+
+    Returns
+    -------
+    list of (dict or None)
+        the per gram serving dict of each food, None for foods without a serving with a known metric weight
+    '''
+    results = [None] * len(foods)
+    todo = []
+    for idx, cfood in enumerate(foods):
+        cfood_id = cfood.get('food_id')
+        if cache is not None and cfood_id is not None:
+            results[idx] = cache.get('per_gram', cfood_id)
+            # entries cached before the piece weight was kept are normalized again
+            if results[idx] is not None and 'piece_grams' not in results[idx]:
+                results[idx] = None
+        if results[idx] is None:
+            todo.append(idx)
+    if not todo:
+        return results
+    food_index = []
+    servings = []
+    densities = []
+    for cidx, idx in enumerate(todo):
+        cservings = get_servings(foods[idx])
+        cdensity = get_density(foods[idx].get('food_name'))
+        servings.extend(cservings)
+        food_index.extend([cidx] * len(cservings))
+        densities.extend([cdensity] * len(cservings))
+    food_index = np.array(food_index, dtype=int)
+    grams, is_mass = _serving_grams(servings, densities)
+    values = parse_servings(servings, NUTRIENTS, convert=False)
+    # use the mass servings of foods which have any, otherwise the volume servings
+    has_mass = np.zeros(len(todo), dtype=bool)
+    has_mass[food_index[is_mass & ~np.isnan(grams)]] = True
+    use = ~np.isnan(grams) & (is_mass | ~has_mass[food_index])
+    present = ~np.isnan(values) & use[:, np.newaxis]
+    total_values = np.zeros([len(todo), len(NUTRIENTS)])
+    total_grams = np.zeros([len(todo), len(NUTRIENTS)])
+    np.add.at(total_values, food_index, np.where(present, values, 0))
+    np.add.at(total_grams, food_index, np.where(present, grams[:, np.newaxis], 0))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        per_gram_values = total_values / total_grams
+    has_serving = np.zeros(len(todo), dtype=bool)
+    has_serving[food_index[use]] = True
+    # the weight of the first serving counted in pieces of each food
+    piece_grams = [None] * len(todo)
+    for cserving, cidx, cgrams in zip(servings, food_index.tolist(), grams.tolist()):
+        if piece_grams[cidx] is None and cgrams == cgrams and is_discrete_unit(cserving.get('measurement_description')):
+            piece_grams[cidx] = cgrams
+    for cidx, idx in enumerate(todo):
+        cfood = foods[idx]
+        if not has_serving[cidx]:
+            logger.warning('no metric serving found for food %s' % cfood.get('food_name'))
+            continue
+        normalized = {'measurement_description': 'g', 'metric_serving_amount': 1.0, 'metric_serving_unit': 'g',
+                      'serving_description': '1 g', 'piece_grams': piece_grams[cidx]}
+        for cnutrient, cval in zip(NUTRIENTS, per_gram_values[cidx].tolist()):
+            if cval == cval:
+                normalized[cnutrient] = cval
+        results[idx] = normalized
+        if cache is not None and cfood.get('food_id') is not None:
+            cache.set('per_gram', cfood['food_id'], normalized)
+    return results
+
+
+def normalize_food(food, cache=None):
+    '''Get the per gram nutritional values of a fatsecret food
+
+    Parameters
+    ----------
+    food : dict
+        the fatsecret food_get() result
+    cache : NutrientCache or None, optional
+        the cache for the normalized values (by food_id). None to not cache
+
+    Returns
+    -------
+    dict or None
+        the per gram serving dict (see normalize_foods()), None if none of the servings has a known metric weight
+    '''
+    return normalize_foods([food], cache)[0]
@@ -0,0 +1,15 @@
+# reciper tests - shared fixtures (run from the repository root: python -m pytest tests)
+
+import os
+
+import pytest
+
+from reciper.fixtures import load_fixtures
+
+# the recorded fatsecret responses of the benchmarks
+FIXTURES_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'fixtures', 'fatsecret.json')
+
+
+@pytest.fixture(scope='session')
+def recorded():
+    return load_fixtures(FIXTURES_FILE)
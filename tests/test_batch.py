@@ -0,0 +1,41 @@
+# reciper tests - reading the label files
+
+import pytest
+
+from reciper.batch import iter_labels
+
+
+def test_csv_labels(tmp_path):
+    filename = tmp_path / 'labels.csv'
+    filename.write_text('name,ingredients,order,tail,recipe_scale,calories,sodium_g\n'
+                        'a,flour; water ;salt,yes,2,,250,0.5\n'
+                        'b,flour;water,0,,4,100,\n'
+                        ',flour,,,,50,\n')
+    products = list(iter_labels(str(filename)))
+    assert products[0] == {'name': 'a', 'values': {'calories': 250, 'sodium': 500}, 'ingredients': ['flour', 'water', 'salt'],
+                           'order': True, 'tail': 2}
+    assert products[1] == {'name': 'b', 'values': {'calories': 100}, 'ingredients': ['flour', 'water'], 'order': False,
+                           'recipe_scale': 4}
+    # no order cell uses the default order
+    assert products[2] == {'name': 'product_2', 'values': {'calories': 50}, 'ingredients': ['flour']}
+
+
+def test_csv_invalid_order(tmp_path):
+    filename = tmp_path / 'labels.csv'
+    filename.write_text('name,ingredients,order,calories\na,flour,maybe,250\n')
+    with pytest.raises(ValueError):
+        list(iter_labels(str(filename)))
+
+
+def test_jsonl_labels(tmp_path):
+    filename = tmp_path / 'labels.jsonl'
+    filename.write_text('{"name": "a", "values": {"calories": 250}, "ingredients": ["flour"], "order": true}\n\n'
+                        '{"values": {"calcium_dv": 10}}\n')
+    products = list(iter_labels(str(filename)))
+    assert products[0]['order'] is True
+    assert products[1] == {'name': 'product_2', 'values': {'calcium': pytest.approx(130)}, 'ingredients': []}
+
+
+def test_unknown_label_format():
+    with pytest.raises(ValueError):
+        list(iter_labels('labels.txt'))
@@ -0,0 +1,106 @@
+# reciper tests - the sqlite nutrient cache
+
+import sqlite3
+import time
+
+import pytest
+
+from reciper.cache import CachedFatsecret, NutrientCache, OfflineError, normalize_query
+from reciper.sources import NutrientSource
+
+
+class CountingSource(NutrientSource):
+    '''A source returning a food for any id, counting the calls'''
+    def __init__(self, bulk=False):
+        self.bulk = bulk
+        self.calls = []
+
+    def foods_search(self, query):
+        self.calls.append(('search', query))
+        return [{'food_id': '1', 'food_name': query}]
+
+    def food_get(self, food_id):
+        self.calls.append(('food', food_id))
+        return {'food_id': food_id, 'servings': {'serving': []}}
+
+    def get_many(self, food_ids):
+        self.calls.append(('many', tuple(food_ids)))
+        return {x: {'food_id': x, 'servings': {'serving': []}} for x in food_ids}
+
+
+def test_set_get_stats():
+    cache = NutrientCache(':memory:')
+    assert cache.get('food', '1') is None
+    cache.set('food', '1', {'food_id': '1'})
+    assert cache.get('food', 1) == {'food_id': '1'}
+    stats = cache.stats()
+    assert stats['food'] == {'hits': 1, 'misses': 1, 'entries': 1}
+
+
+def test_ttl():
+    cache = NutrientCache(':memory:', ttl=0.05)
+    cache.set('search', 'egg', [])
+    assert cache.get('search', 'egg') == []
+    time.sleep(0.1)
+    assert cache.get('search', 'egg') is None
+    assert cache.keys('search') == []
+
+
+def test_lru_eviction_with_buffered_hits():
+    cache = NutrientCache(':memory:', max_entries=3)
+    for cidx in range(3):
+        cache.set('food', cidx, {'i': cidx})
+        time.sleep(0.01)
+    # the hit is buffered, but the eviction uses it: 1 is now the least recently used
+    cache.get('food', 0)
+    cache.set('food', 3, {'i': 3})
+    assert sorted(cache.keys('food')) == ['0', '2', '3']
+
+
+def test_access_times_written_on_close(tmp_path):
+    filename = str(tmp_path / 'cache.sqlite')
+    cache = NutrientCache(filename, flush_entries=1000, flush_interval=1000)
+    cache.set('food', '1', {})
+    con = sqlite3.connect(filename)
+    created = con.execute('SELECT accessed FROM entries').fetchone()[0]
+    time.sleep(0.01)
+    cache.get('food', '1')
+    # a hit does not write to the database
+    assert con.execute('SELECT accessed FROM entries').fetchone()[0] == created
+    cache.close()
+    assert con.execute('SELECT accessed FROM entries').fetchone()[0] > created
+    con.close()
+
+
+def test_normalize_query():
+    assert normalize_query('  Whole  Wheat FLOUR ') == 'whole wheat flour'
+
+
+def test_cached_client():
+    source = CountingSource()
+    client = CachedFatsecret(source, NutrientCache(':memory:'), offline=False)
+    assert client.foods_search('Egg ') == client.foods_search('egg')
+    client.food_get('7')
+    client.food_get('7')
+    assert source.calls == [('search', 'Egg '), ('food', '7')]
+
+
+def test_cached_client_get_many():
+    source = CountingSource(bulk=True)
+    cache = NutrientCache(':memory:')
+    client = CachedFatsecret(source, cache, offline=False)
+    client.food_get('1')
+    foods = client.get_many(['1', '2', '3'])
+    assert sorted(foods) == ['1', '2', '3']
+    # only the cache misses are looked up, in one call
+    assert source.calls == [('food', '1'), ('many', ('2', '3'))]
+
+
+def test_offline():
+    cache = NutrientCache(':memory:')
+    cache.set('food', '1', {'food_id': '1'})
+    client = CachedFatsecret(None, cache)
+    assert client.offline
+    with pytest.raises(OfflineError):
+        client.food_get('2')
+    assert client.get_many(['1', '2']) == {'1': {'food_id': '1'}, '2': None}
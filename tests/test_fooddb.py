@@ -0,0 +1,73 @@
+# reciper tests - the local FoodData Central food database
+
+import numpy as np
+import pytest
+
+from reciper.fooddb import DAILY_VALUES, ID_PREFIX, LocalFoodDatabase, import_fdc
+from reciper.sources import get_source_factory
+from reciper.units import normalize_food
+
+
+@pytest.fixture(scope='module')
+def database(tmp_path_factory):
+    fdc_dir = tmp_path_factory.mktemp('fdc')
+    (fdc_dir / 'food.csv').write_text('fdc_id,data_type,description\n'
+                                      '1,sr_legacy_food,"Egg, whole, raw"\n'
+                                      '2,foundation_food,"Flour, wheat, all-purpose"\n'
+                                      '3,branded_food,Chocolate chip cookie\n'
+                                      '4,sr_legacy_food,"Egg, white, raw"\n')
+    (fdc_dir / 'food_nutrient.csv').write_text('id,fdc_id,nutrient_id,amount\n'
+                                               '10,1,1008,143\n10,1,1004,9.5\n10,1,1162,0\n'
+                                               '20,2,2047,364\n20,2,1004,1\n20,2,1162,9\n20,2,1005,bad\n'
+                                               '30,3,1008,480\n'
+                                               '40,4,1008,52\n40,4,2047,60\n')
+    (fdc_dir / 'food_portion.csv').write_text('id,fdc_id,amount,modifier,portion_description,gram_weight\n'
+                                              '1,1,1,large,,50\n2,2,1,,cup,125\n3,2,1,,Quantity not specified,0\n')
+    prefix = str(tmp_path_factory.mktemp('db') / 'fdc')
+    assert import_fdc(str(fdc_dir), prefix, ['sr_legacy_food', 'foundation_food']) == 3
+    return LocalFoodDatabase(prefix)
+
+
+def test_import(database):
+    assert len(database) == 3
+    assert isinstance(database.data, np.memmap)
+    assert database.names == ['Egg, whole, raw', 'Flour, wheat, all-purpose', 'Egg, white, raw']
+
+
+def test_search(database):
+    # more shared words first, then the shorter name (then the import order)
+    assert [x['food_name'] for x in database.foods_search('raw egg')] == ['Egg, whole, raw', 'Egg, white, raw']
+    assert [x['food_name'] for x in database.foods_search('egg white')] == ['Egg, white, raw', 'Egg, whole, raw']
+    assert database.foods_search('wheat flour', max_results=1)[0]['food_id'] == ID_PREFIX + '2'
+    assert database.foods_search('chocolate') == []
+
+
+def test_food_get(database):
+    egg = database.food_get(ID_PREFIX + '1')
+    servings = egg['servings']['serving']
+    assert [x['measurement_description'] for x in servings] == ['g', '1 large']
+    assert servings[0]['calories'] == pytest.approx(143)
+    assert servings[1]['fat'] == pytest.approx(9.5 / 2)
+    # the preferred energy id, and the atwater energy when it is missing
+    assert database.food_get(ID_PREFIX + '4')['servings']['serving'][0]['calories'] == pytest.approx(52)
+    flour = database.food_get(ID_PREFIX + '2')['servings']['serving'][0]
+    assert flour['calories'] == pytest.approx(364)
+    # vitamin c is stored as percent of the daily value (as in fatsecret), a bad amount is missing
+    assert flour['vitamin_c'] == pytest.approx(900 / DAILY_VALUES['vitamin_c'], rel=1e-5)
+    assert 'carbohydrate' not in flour
+    with pytest.raises(ValueError):
+        database.food_get('1')
+
+
+def test_get_many(database):
+    foods = database.get_many([ID_PREFIX + '2', ID_PREFIX + '3', 'fatsecret-id', ID_PREFIX + '1'])
+    assert foods[ID_PREFIX + '3'] is None and foods['fatsecret-id'] is None
+    assert foods[ID_PREFIX + '1'] == database.food_get(ID_PREFIX + '1')
+    assert foods[ID_PREFIX + '2']['servings']['serving'][1]['measurement_description'] == 'cup'
+
+
+def test_source_factory_and_normalize(database):
+    factory, local = get_source_factory(database.prefix)
+    assert local
+    egg = normalize_food(factory().food_get(ID_PREFIX + '1'))
+    assert egg['calories'] == pytest.approx(1.43)
@@ -0,0 +1,74 @@
+# reciper tests - the gui background jobs (needs PyQt5)
+
+import threading
+
+import pytest
+
+QtCore = pytest.importorskip('PyQt5.QtCore')
+
+from reciper.jobs import JobManager  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def app():
+    return QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+
+
+@pytest.fixture
+def manager(app):
+    manager = JobManager(max_threads=1)
+    manager.messages = []
+    manager.progress.connect(lambda key, percent, message: manager.messages.append((key, message)))
+    yield manager
+    manager.cancel_all()
+    manager.wait()
+
+
+def _deliver(manager, app):
+    manager.wait()
+    app.processEvents()
+
+
+def test_replaced_job(manager, app):
+    # the newer job of a key replaces the running one, without reporting it as cancelled
+    started = threading.Event()
+    release = threading.Event()
+    results = []
+
+    def first(job):
+        started.set()
+        release.wait(5)
+        return 1
+
+    manager.submit('recipe', first, done=results.append)
+    started.wait(5)
+    manager.submit('recipe', lambda job: 2, done=results.append)
+    release.set()
+    _deliver(manager, app)
+    assert results == [2]
+    assert manager.messages == [('recipe', 'done')]
+    assert len(manager) == 0
+
+
+def test_cancel(manager, app):
+    release = threading.Event()
+    results = []
+    manager.submit('food', lambda job: release.wait(5), done=results.append)
+    assert manager.cancel('food')
+    assert not manager.cancel('food')
+    release.set()
+    _deliver(manager, app)
+    assert results == []
+    assert manager.messages == [('food', 'cancelled')]
+
+
+def test_failed(manager, app):
+    errors = []
+
+    def fail(job):
+        raise ValueError('no values')
+
+    manager.submit('recipe', fail, failed=lambda key, message: errors.append((key, message)))
+    _deliver(manager, app)
+    assert errors == [('recipe', 'no values')]
+    assert manager.messages == [('recipe', 'failed')]
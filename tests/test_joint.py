@@ -0,0 +1,100 @@
+# reciper tests - the joint (block diagonal) solve of many products with shared sub-recipes
+
+import numpy as np
+import pytest
+import scipy.sparse
+
+from reciper.batch import solve_products
+from reciper.joint import build_block_coeff, build_block_order_constraints, build_coupling, joint_groups, solve_joint
+from reciper.matrix import IngredientStore
+from reciper.solver import build_order_constraints, solve_recipe
+
+PARAMS = ['calories', 'fat', 'carbohydrate', 'protein', 'sodium', 'fiber']
+
+
+@pytest.fixture(scope='module')
+def store():
+    rng = np.random.default_rng(3)
+    return IngredientStore.from_servings({'i%d' % x: dict(zip(PARAMS, rng.uniform(0.01, 1, len(PARAMS)).tolist())) for x in range(8)})
+
+
+def _product(store, name, names, amounts, **fields):
+    values = store.matrix(PARAMS, names) @ np.asarray(amounts, dtype=float)
+    return dict({'name': name, 'values': dict(zip(PARAMS, values.tolist())), 'ingredients': names}, **fields)
+
+
+def test_block_coeff():
+    coeffs = [np.arange(6.0).reshape(2, 3), np.zeros((1, 0)), np.array([[7.0], [8.0], [9.0]])]
+    assert (build_block_coeff(coeffs).toarray() == scipy.sparse.block_diag(coeffs).toarray()).all()
+
+
+def test_block_order_constraints():
+    # the same rows as the per product constraints, with the columns offset to each product
+    specs = [(3, None, True), (5, 2, True), (4, 1, False), (2, None, False), (3, 0, True)]
+    A_ub, b_ub = build_block_order_constraints(np.array([x[0] for x in specs]),
+                                               np.array([x[0] if x[1] is None else x[1] for x in specs]),
+                                               np.array([x[2] for x in specs]), 20, tail_fraction=0.1)
+    expected = scipy.sparse.block_diag([build_order_constraints(n, n, tail, 0.1, order=corder)[0] for n, tail, corder in specs])
+    expected = np.hstack([expected.toarray(), np.zeros((expected.shape[0], 3))])
+    assert A_ub.shape == expected.shape and (b_ub == 0).all()
+    assert sorted(map(tuple, A_ub.toarray().round(9))) == sorted(map(tuple, expected.round(9)))
+
+
+def test_uncoupled_matches_separate(store):
+    products = [_product(store, 'a', ['i0', 'i1', 'i2'], [50, 30, 20]),
+                _product(store, 'b', ['i3', 'i1', 'i4', 'i5'], [40, 30, 20, 1], order=True, tail=3),
+                _product(store, 'c', ['i6', 'i7'], [10, 90]),
+                {'name': 'missing', 'values': {'calories': 100}, 'ingredients': ['i0', 'other']},
+                _product(store, 'd', ['i2', 'i0'], [5, 5], shared={'base': ['i0']})]
+    results = solve_joint(products, store, rules='exact', couple=False)
+    assert [x['name'] for x in results] == ['a', 'b', 'c', 'missing', 'd']
+    assert not results[3]['success'] and 'other' in results[3]['message']
+    for cproduct, cresult in zip(products, results):
+        if cproduct['name'] == 'missing':
+            continue
+        assert cresult['success']
+        separate = solve_recipe(store, cproduct['values'], cproduct['ingredients'], order=cproduct.get('order', False),
+                                tail=cproduct.get('tail'), rules='exact')
+        assert cresult['amounts'] == pytest.approx(separate['amounts'], abs=1e-5)
+        assert cresult['residuals'] == pytest.approx(separate['residuals'], abs=1e-5)
+
+
+def test_coupled_shared_amounts(store):
+    # the same dough (i0, i1) in three products, the last one with half the dough per label basis
+    base = {'dough': ['i0', 'i1']}
+    products = [_product(store, 'a', ['i0', 'i1', 'i2'], [40, 30, 30], shared=base),
+                _product(store, 'b', ['i0', 'i1', 'i3'], [40, 30, 30], shared=base),
+                _product(store, 'c', ['i4', 'i0', 'i1'], [65, 20, 15], shared={'dough': {'ingredients': ['i0', 'i1'], 'scale': 0.5}})]
+    results = solve_joint(products, store, rules='fda')
+    a, b, c = [x['amounts'] for x in results]
+    for cname in ('i0', 'i1'):
+        assert a[cname] == pytest.approx(b[cname], rel=1e-6)
+        assert c[cname] == pytest.approx(a[cname] / 2, rel=1e-6)
+    A_eq, b_eq = build_coupling([(0, ['i0', 'i1', 'i2']), (3, ['i0', 'i1', 'i3']), (6, ['i4', 'i0', 'i1'])],
+                                [{'dough': (['i0', 'i1'], 1.0)}, {'dough': (['i0', 'i1'], 1.0)}, {'dough': (['i0', 'i1'], 0.5)}], 9)
+    assert A_eq.shape == (4, 9) and (b_eq == 0).all()
+    assert A_eq.toarray()[2].tolist() == [-1, 0, 0, 0, 0, 0, 0, 2, 0]
+
+
+def test_groups_across_chunks():
+    # the products sharing a sub-recipe are far apart, and chained through a second sub-recipe (union find)
+    products = [{'name': 'p%d' % x} for x in range(8)]
+    products[0]['shared'] = {'dough': []}
+    products[6]['shared'] = {'dough': [], 'sauce': []}
+    products[3]['shared'] = {'sauce': []}
+    groups = joint_groups(products, 2)
+    assert sorted(x for cgroup in groups for x in cgroup) == list(range(8))
+    shared = [cgroup for cgroup in groups if 0 in cgroup][0]
+    assert {0, 3, 6} <= set(shared)
+    assert all(len(x) <= 2 for x in groups if x is not shared)
+    assert joint_groups([], 10) == []
+
+
+def test_batch_joint(store):
+    base = {'dough': ['i0', 'i1']}
+    products = [_product(store, 'p%d' % x, ['i0', 'i1', 'i%d' % (x + 2)], [40, 30, 30], shared=base if x % 3 == 0 else {})
+                for x in range(6)]
+    results = solve_products(products, store, processes=1, joint=2, rules='exact')
+    assert [x['name'] for x in results] == [x['name'] for x in products]
+    assert all(x['success'] for x in results)
+    assert results[0]['amounts']['i0'] == pytest.approx(results[3]['amounts']['i0'])
@@ -0,0 +1,98 @@
+# reciper tests - the rate limited concurrent lookups
+
+import time
+
+import pytest
+
+from reciper.cache import NutrientCache
+from reciper.lookup import LookupService, RateLimitedClient, RateLimiter
+from reciper.sources import NutrientSource
+
+
+class CountingLimiter:
+    '''A rate limiter counting the tokens taken'''
+    def __init__(self):
+        self.tokens = 0
+
+    def acquire(self):
+        self.tokens += 1
+
+
+class FlakySource(NutrientSource):
+    '''A source failing the first call of each food'''
+    def __init__(self):
+        self.calls = {}
+
+    def food_get(self, food_id):
+        self.calls[food_id] = self.calls.get(food_id, 0) + 1
+        if self.calls[food_id] == 1:
+            raise ConnectionError('dropped')
+        return {'food_id': food_id}
+
+
+def test_rate_limiter_burst_then_rate():
+    limiter = RateLimiter(rate=20, burst=2)
+    start = time.monotonic()
+    limiter.acquire()
+    limiter.acquire()
+    assert time.monotonic() - start < 0.04
+    for _ in range(4):
+        limiter.acquire()
+    # 4 tokens more than the burst, at 20 per second
+    assert time.monotonic() - start == pytest.approx(0.2, abs=0.06)
+
+
+def test_rate_limiter_no_limit():
+    limiter = RateLimiter(rate=None)
+    start = time.monotonic()
+    for _ in range(1000):
+        limiter.acquire()
+    assert time.monotonic() - start < 0.1
+
+
+def test_get_many_token_per_food():
+    # a source without a native bulk lookup takes a token (and has its own retries) per food
+    limiter = CountingLimiter()
+    source = FlakySource()
+    foods = RateLimitedClient(source, limiter, retries=1, backoff=0).get_many(['1', '2', '3'])
+    assert foods == {x: {'food_id': x} for x in ('1', '2', '3')}
+    assert source.calls == {'1': 2, '2': 2, '3': 2}
+    assert limiter.tokens == 6
+
+
+def test_service_rate_limits_each_food():
+    class Source(NutrientSource):
+        def food_get(self, food_id):
+            return {'food_id': food_id}
+
+    start = time.monotonic()
+    with LookupService(Source, cache=NutrientCache(':memory:'), offline=False, rate=20) as service:
+        foods = service.get_many([str(x) for x in range(30)])
+    assert len(foods) == 30
+    # 30 calls at 20 per second (the first 20 are the burst)
+    assert time.monotonic() - start > 0.4
+
+
+def test_retries_exhausted_take_a_token_per_attempt():
+    class Source(NutrientSource):
+        def food_get(self, food_id):
+            raise ConnectionError('down')
+
+    limiter = CountingLimiter()
+    foods = RateLimitedClient(Source(), limiter, retries=2, backoff=0).get_many(['1', '2'])
+    assert foods == {'1': None, '2': None}
+    assert limiter.tokens == 6
+
+
+def test_search_many_concurrent():
+    class Source(NutrientSource):
+        def foods_search(self, query):
+            time.sleep(0.1)
+            return [{'food_id': query}]
+
+    start = time.monotonic()
+    with LookupService(Source, cache=NutrientCache(':memory:'), offline=False, rate=None, max_workers=8) as service:
+        foods = service.search_many(['q%d' % x for x in range(8)])
+    assert foods == {'q%d' % x: [{'food_id': 'q%d' % x}] for x in range(8)}
+    # the 8 searches run in parallel
+    assert time.monotonic() - start < 0.5
@@ -0,0 +1,62 @@
+# reciper tests - the least squares solver modes
+
+import numpy as np
+import pytest
+import scipy.optimize
+
+from reciper.batch import solve_products
+from reciper.lsq import default_prior, solve_least_squares
+from reciper.matrix import IngredientStore
+from reciper.solver import solve_recipe
+
+
+@pytest.fixture
+def store():
+    return IngredientStore.from_servings({'a': {'calories': 4, 'fat': 0.1}, 'b': {'calories': 9, 'fat': 1}})
+
+
+@pytest.mark.parametrize('mode', ['nnls', 'lsq'])
+def test_least_squares_modes(store, mode):
+    res = solve_recipe(store, {'calories': 260, 'fat': 21}, mode=mode, rules='exact')
+    assert res['success'] and res['status'] == 0
+    assert res['message'].startswith(mode)
+    # 4a + 9b = 260 and 0.1a + b = 21
+    assert res['amounts']['a'] == pytest.approx(71 / 3.1, rel=0.05)
+    assert res['amounts']['b'] == pytest.approx(21 - 7.1 / 3.1, rel=0.05)
+    with pytest.raises(ValueError):
+        solve_recipe(store, {'calories': 260}, mode=mode, order=True)
+
+
+def test_lsq_prior():
+    assert default_prior(3, 11).tolist() == pytest.approx([6, 3, 2])
+    # one value and two identical ingredients: nnls picks any split, lsq the one nearest the prior
+    coeff = np.array([[1.0, 1.0]])
+    res = solve_least_squares(coeff, np.array([100.0]), np.array([0.01]), 'lsq', prior=np.array([80.0, 20.0]))
+    assert res.x.tolist() == pytest.approx([80, 20], abs=0.5)
+    with pytest.raises(ValueError):
+        solve_least_squares(coeff, np.array([100.0]), np.array([0.01]), 'l1')
+
+
+def test_nnls_iteration_limit(monkeypatch):
+    def nnls(*args, **kwargs):
+        raise RuntimeError('Maximum number of iterations reached.')
+
+    monkeypatch.setattr(scipy.optimize, 'nnls', nnls)
+    coeff = np.array([[1.0, 2.0]])
+    res = solve_least_squares(coeff, np.array([10.0]), np.array([1.0]), 'nnls')
+    assert (res.status, res.success, res.x, res.fun) == (1, False, None, None)
+    # lsq scales its prior from the bounded least squares solution instead
+    res = solve_least_squares(coeff, np.array([10.0]), np.array([1.0]), 'lsq')
+    assert res.success and res.status == 0
+    assert coeff @ res.x == pytest.approx([10], rel=0.05)
+
+
+def test_order_fields_fail_per_product():
+    # the products with the order or tail fields fail (and only them), without reading the labels in advance
+    ingredients = {'a': {'calories': 4}, 'b': {'calories': 9}}
+    products = [{'name': 'plain', 'values': {'calories': 100}, 'ingredients': ['a', 'b']},
+                {'name': 'ordered', 'values': {'calories': 100}, 'ingredients': ['a', 'b'], 'order': True},
+                {'name': 'tail', 'values': {'calories': 100}, 'ingredients': ['a', 'b'], 'tail': 1}]
+    results = solve_products(products, ingredients, processes=1, mode='nnls')
+    assert [x['success'] for x in results] == [True, False, False]
+    assert 'lp mode' in results[1]['message']
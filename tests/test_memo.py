@@ -0,0 +1,87 @@
+# reciper tests - the result memo of identical and similar recipe problems
+
+import numpy as np
+import pytest
+
+from reciper.matrix import IngredientStore
+from reciper.memo import ResultCache
+from reciper.metrics import metrics
+from reciper.solver import solve_recipe
+
+COEFF = np.array([[3.6, 7.2], [0.01, 0.81]])
+VALUES = {'calories': 250, 'fat': 10}
+
+
+def test_keys():
+    cache = ResultCache(decimals=2)
+    structure, value = cache.keys(['a', 'b'], COEFF, VALUES, {'order': False})
+    # the values are quantized, -0.0 is 0.0
+    assert cache.keys(['a', 'b'], COEFF, {'calories': 250.001, 'fat': 10}, {'order': False}) == (structure, value)
+    assert cache.keys(['a', 'b'], COEFF, {'calories': 0.0, 'fat': 10})[1] == cache.keys(['a', 'b'], COEFF, {'calories': -0.0, 'fat': 10})[1]
+    # a size variant has the same structure and a different value key
+    variant = cache.keys(['a', 'b'], COEFF, {'calories': 200, 'fat': 8}, {'order': False})
+    assert variant[0] == structure and variant[1] != value
+    # the names, parameters, coefficients and options are in the structure
+    for cother in [cache.keys(['b', 'a'], COEFF, VALUES, {'order': False}),
+                   cache.keys(['a', 'b'], COEFF, {'fat': 10, 'calories': 250}, {'order': False}),
+                   cache.keys(['a', 'b'], COEFF * 1.01, VALUES, {'order': False}),
+                   cache.keys(['a', 'b'], COEFF, VALUES, {'order': True}),
+                   cache.keys(['a', 'b'], COEFF, VALUES, {'order': False, 'method': 'highs-ipm'})]:
+        assert cother[0] != structure and cother[1] != value
+
+
+def test_get_set_copies_and_lru():
+    cache = ResultCache(max_entries=2)
+    result = {'amounts': {'a': 1.0}}
+    cache.set('s1', 'v1', result, basis=('basis',))
+    result['amounts']['a'] = 2.0
+    hit = cache.get('v1')
+    assert hit == {'amounts': {'a': 1.0}}
+    hit['amounts']['a'] = 3.0
+    assert cache.get('v1') == {'amounts': {'a': 1.0}}
+    assert cache.get_basis('s1') == ('basis',)
+    cache.set('s2', 'v2', {})
+    cache.get('v1')
+    cache.set('s3', 'v3', {})
+    # v2 is the least recently used result
+    assert cache.get('v2') is None and cache.get('v1') is not None and len(cache) == 2
+    cache.clear()
+    assert len(cache) == 0 and cache.get_basis('s1') is None
+
+
+@pytest.fixture
+def store():
+    return IngredientStore.from_servings({'flour': {'calories': 3.6, 'fat': 0.01},
+                                          'butter': {'calories': 7.2, 'fat': 0.81, 'piece_grams': 10}})
+
+
+def _memo_counts():
+    values = metrics.to_dict()['counters']
+    hits = {x['labels']['kind']: x['value'] for x in values.get('reciper_memo_hits_total', [])}
+    return hits.get('exact', 0), hits.get('near', 0), sum(x['value'] for x in values.get('reciper_memo_misses_total', []))
+
+
+def test_solve_recipe_memo(store):
+    metrics.reset()
+    memo = ResultCache()
+    first = solve_recipe(store, VALUES, memo=memo)
+    again = solve_recipe(store, dict(VALUES), memo=memo)
+    assert again == first
+    assert _memo_counts() == (1, 0, 1)
+    # a size variant is solved, starting from the basis of the same structure
+    variant = solve_recipe(store, {'calories': 200, 'fat': 8}, memo=memo)
+    assert variant['amounts'] != first['amounts']
+    assert _memo_counts() == (1, 1, 2)
+    metrics.reset()
+
+
+@pytest.mark.parametrize('options', [{'order': True}, {'rules': 'eu'}, {'rules': 'exact'}, {'mode': 'nnls'}, {'method': 'highs-ipm'},
+                                     {'mode': 'milp', 'integrality': [True, True]}, {'mode': 'milp', 'recipe_scale': 2}])
+def test_solve_recipe_memo_options(store, options):
+    # a result is not reused for other solve options
+    memo = ResultCache()
+    solve_recipe(store, VALUES, memo=memo, mode='milp')
+    solve_recipe(store, VALUES, memo=memo)
+    result = solve_recipe(store, VALUES, memo=memo, **options)
+    assert result == solve_recipe(store, VALUES, **options)
+    assert len(memo) == 3
@@ -0,0 +1,82 @@
+# reciper tests - the metrics registry, its export formats and the worker process metrics
+
+import json
+
+import pytest
+
+from reciper.batch import solve_products
+from reciper.metrics import Metrics, metrics
+
+
+def test_counters_and_histograms():
+    registry = Metrics()
+    registry.inc('hits_total', kind='food')
+    registry.inc('hits_total', 2, kind='food')
+    registry.inc('hits_total', kind='search')
+    registry.observe('reciper_solve_iterations', 3)
+    registry.observe('reciper_solve_iterations', 10000)
+    values = registry.to_dict()
+    assert sorted((x['labels']['kind'], x['value']) for x in values['counters']['hits_total']) == [('food', 3), ('search', 1)]
+    hist = values['histograms']['reciper_solve_iterations'][0]
+    # 3 is in the (2, 5] bucket, 10000 is above all the bounds
+    assert hist['counts'][2] == 1 and hist['counts'][-1] == 1
+    assert hist['sum'] == 10003 and hist['count'] == 2
+
+
+def test_pop_and_merge():
+    registry = Metrics()
+    registry.inc('a_total')
+    with registry.timer('b_seconds', call='x'):
+        pass
+    values = registry.pop()
+    assert registry.to_dict() == {'counters': {}, 'histograms': {}}
+    registry.merge(values)
+    registry.merge(values)
+    merged = registry.to_dict()
+    assert merged['counters']['a_total'][0]['value'] == 2
+    assert merged['histograms']['b_seconds'][0]['count'] == 2
+
+
+def test_json_export(tmp_path):
+    registry = Metrics()
+    registry.inc('a_total', kind='food')
+    filename = str(tmp_path / 'metrics.json')
+    registry.save(filename)
+    with open(filename) as fl:
+        assert json.load(fl) == registry.to_dict()
+
+
+def test_prometheus_export(tmp_path):
+    registry = Metrics()
+    registry.inc('a_total', kind='fo"od')
+    registry.observe('reciper_residual_relative', 0.015)
+    filename = str(tmp_path / 'metrics.prom')
+    registry.save(filename)
+    with open(filename) as fl:
+        lines = fl.read().splitlines()
+    assert '# TYPE a_total counter' in lines
+    assert 'a_total{kind="fo\\"od"} 1' in lines
+    assert '# TYPE reciper_residual_relative histogram' in lines
+    # the buckets are cumulative
+    assert 'reciper_residual_relative_bucket{le="0.01"} 0' in lines
+    assert 'reciper_residual_relative_bucket{le="0.02"} 1' in lines
+    assert 'reciper_residual_relative_bucket{le="+Inf"} 1' in lines
+    assert 'reciper_residual_relative_count 1' in lines
+
+
+@pytest.fixture
+def clean_metrics():
+    metrics.reset()
+    yield metrics
+    metrics.reset()
+
+
+def test_worker_metrics_merged_once(clean_metrics):
+    # a counter recorded before the pool starts (i.e. the lookups) is not merged back from the forked workers
+    clean_metrics.inc('before_pool_total')
+    products = [{'name': 'p%d' % x, 'values': {'calories': 100 + x}, 'ingredients': {'a': {'calories': 1}}} for x in range(8)]
+    results = solve_products(products, processes=4, chunksize=1, memo=False)
+    assert all(x['success'] for x in results)
+    values = clean_metrics.to_dict()
+    assert values['counters']['before_pool_total'][0]['value'] == 1
+    assert values['histograms']['reciper_product_seconds'][0]['count'] == 8
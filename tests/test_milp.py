@@ -0,0 +1,58 @@
+# reciper tests - the milp solver mode on foods normalized from recorded fatsecret responses
+
+import numpy as np
+import pytest
+
+from reciper.matrix import IngredientStore
+from reciper.solver import solve_recipe
+from reciper.units import normalize_food
+
+PARAMS = ['calories', 'fat', 'protein', 'carbohydrate']
+
+
+@pytest.fixture(scope='module')
+def foods(recorded):
+    return {x: normalize_food(recorded['foods'][recorded['searches'][x][0]['food_id']]) for x in ('egg', 'butter')}
+
+
+def test_normalize_keeps_piece_weight(foods):
+    # the recorded egg has a 50 g 'large' serving, and butter has no serving counted in pieces
+    assert foods['egg']['measurement_description'] == 'g'
+    assert foods['egg']['piece_grams'] == pytest.approx(50)
+    assert foods['butter']['piece_grams'] is None
+
+
+@pytest.mark.parametrize('egg_grams', [50.0, 80.0, 130.0])
+def test_milp_whole_eggs(foods, egg_grams):
+    store = IngredientStore.from_servings(foods)
+    names = ['egg', 'butter']
+    values = dict(zip(PARAMS, (store.matrix(PARAMS, names) @ np.array([egg_grams, 20.0])).tolist()))
+    lp = solve_recipe(store, values, names, mode='lp')
+    res = solve_recipe(store, values, names, mode='milp')
+    assert res['success']
+    assert 'pieces' not in lp
+    eggs = res['pieces']['egg']
+    assert eggs == round(eggs)
+    assert res['amounts']['egg'] == pytest.approx(eggs * 50, abs=1e-6)
+    assert 'butter' not in res['pieces']
+
+
+def test_milp_recipe_scale(foods):
+    # 3 eggs in a recipe of 2 label bases is 75 g of egg per basis
+    store = IngredientStore.from_servings(foods)
+    values = dict(zip(PARAMS, (store.matrix(PARAMS, ['egg']) @ np.array([75.0])).tolist()))
+    res = solve_recipe(store, values, ['egg'], mode='milp', recipe_scale=2)
+    assert res['pieces'] == {'egg': 3.0}
+    assert res['amounts']['egg'] == pytest.approx(75)
+
+
+def test_milp_without_highspy(foods, monkeypatch):
+    # scipy milp takes no starting solution, so the rounded seed is not computed
+    import reciper.solver
+
+    monkeypatch.setattr(reciper.solver.importlib.util, 'find_spec', lambda name: None)
+    monkeypatch.setattr(reciper.solver, 'round_seed', lambda *args: pytest.fail('round_seed called without highspy'))
+    store = IngredientStore.from_servings(foods)
+    values = dict(zip(PARAMS, (store.matrix(PARAMS, ['egg']) @ np.array([100.0])).tolist()))
+    res = solve_recipe(store, values, ['egg'], mode='milp')
+    assert res['pieces'] == {'egg': 2.0}
@@ -0,0 +1,90 @@
+# reciper tests - the streaming result writers and resume
+
+import csv
+import json
+
+import pytest
+
+from reciper.cli import main
+from reciper.output import get_format, open_writer, written_names
+
+
+def _result(name, **fields):
+    return dict({'name': name, 'success': True, 'status': 0, 'message': 'ok', 'iterations': 1,
+                 'amounts': {'flour': 10.0}, 'units': {'flour': 'g'}, 'residuals': {'calories': 0.0}}, **fields)
+
+
+def test_get_format():
+    assert get_format(None) == 'jsonl'
+    assert get_format('out.CSV') == 'csv'
+    assert get_format('out.parquet') == 'parquet'
+    assert get_format('out.jsonl') == 'jsonl'
+
+
+def test_jsonl_resume_truncates_partial_line(tmp_path):
+    filename = str(tmp_path / 'out.jsonl')
+    with open_writer(filename) as writer:
+        writer.write(_result('a'))
+        writer.write(_result('b'))
+    # a crash while writing the third record
+    with open(filename, 'a') as fl:
+        fl.write('{"name": "c", "succ')
+    assert written_names(filename) == {'a', 'b'}
+    with open_writer(filename, resume=True) as writer:
+        writer.write(_result('c'))
+    with open(filename) as fl:
+        assert [json.loads(x)['name'] for x in fl] == ['a', 'b', 'c']
+
+
+def test_jsonl_no_resume_overwrites(tmp_path):
+    filename = str(tmp_path / 'out.jsonl')
+    for cname in ('a', 'b'):
+        with open_writer(filename) as writer:
+            writer.write(_result(cname))
+    assert written_names(filename) == {'b'}
+
+
+def test_csv_resume(tmp_path):
+    filename = str(tmp_path / 'out.csv')
+    with open_writer(filename) as writer:
+        writer.write(_result('a', mip_gap=0.01, pieces={'egg': 2.0}))
+    with open_writer(filename, resume=True) as writer:
+        writer.write(_result('b'))
+    assert written_names(filename) == {'a', 'b'}
+    with open(filename, newline='') as fl:
+        rows = list(csv.DictReader(fl))
+    # a single header, the dict fields as json and the milp fields kept
+    assert [x['name'] for x in rows] == ['a', 'b']
+    assert json.loads(rows[0]['amounts']) == {'flour': 10.0}
+    assert float(rows[0]['mip_gap']) == pytest.approx(0.01)
+    assert json.loads(rows[0]['pieces']) == {'egg': 2.0}
+    assert rows[1]['pieces'] == ''
+
+
+def test_written_names_missing_file(tmp_path):
+    assert written_names(str(tmp_path / 'none.jsonl')) == set()
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        open_writer('out.txt', format='xml')
+
+
+def test_cli_resume(tmp_path, capsys):
+    labels = tmp_path / 'labels.jsonl'
+    labels.write_text(''.join('{"name": "p%d", "values": {"calories": %d}, "ingredients": {"a": {"calories": 1}}}\n' % (x, 100 + x)
+                              for x in range(3)))
+    output = str(tmp_path / 'out.jsonl')
+    main([str(labels), '-o', output, '-p', '1'])
+    with open(output) as fl:
+        lines = fl.readlines()
+    # the last product is lost in a crash, the others are not solved again
+    with open(output, 'w') as fl:
+        fl.writelines(lines[:2])
+    main([str(labels), '-o', output, '-p', '1', '--resume'])
+    with open(output) as fl:
+        assert sorted(json.loads(x)['name'] for x in fl) == ['p0', 'p1', 'p2']
+    # the output to stdout cannot be resumed
+    with pytest.raises(SystemExit):
+        main([str(labels), '--resume'])
+    assert '--resume needs --output' in capsys.readouterr().err
@@ -0,0 +1,53 @@
+# reciper tests - resolving raw label ingredient names with the local food index
+
+import pytest
+
+from reciper.cache import NutrientCache
+from reciper.resolver import FoodIndex, get_tokens, normalize_name
+
+
+@pytest.fixture
+def index():
+    index = FoodIndex()
+    for cfood_id, cname in enumerate(['Wheat Flour', 'Whole Wheat Flour', 'Sugar', 'Brown Sugar', 'Salt', 'Butter', 'Egg']):
+        index.add(cfood_id, cname)
+    return index
+
+
+def test_normalize_name():
+    assert normalize_name('Enriched Wheat Flour (Niacin, Iron [as ferrous sulfate]), 2% Salt!') == 'enriched wheat flour salt'
+    assert get_tokens('enriched wheat flour and salt') == {'wheat', 'flour', 'salt'}
+
+
+def test_resolve(index):
+    assert index.resolve('enriched wheat flour (niacin, iron)')[:2] == ('0', 'Wheat Flour')
+    assert index.resolve('SALT')[0] == '4'
+    # a misspelling with no shared word is matched by the trigrams
+    assert index.resolve('buter', threshold=0.3)[1] == 'Butter'
+
+
+def test_resolve_not_confident(index):
+    # a low score, and a best match too close to the second one
+    assert index.resolve('cane sugar') is None
+    assert index.resolve('cane sugar', threshold=0.3)[1] == 'Sugar'
+    assert index.resolve('cane sugar', threshold=0.3, margin=0.5) is None
+    assert index.resolve('xanthan gum') is None
+    assert len(index.search('sugar')) == 2
+
+
+def test_aliases(index, tmp_path):
+    cache = NutrientCache(str(tmp_path / 'cache.sqlite'))
+    index.add_alias('Cane Sugar (organic)', 2, cache)
+    assert index.resolve('cane sugar') == ('2', 'Sugar', 1.0)
+    # the aliases and the cached foods are loaded into a new index
+    for cfood_id, cname in index.names.items():
+        cache.set('food', cfood_id, {'food_id': cfood_id, 'food_name': cname})
+    loaded = FoodIndex.from_cache(cache)
+    assert len(loaded) == len(index)
+    assert loaded.resolve('cane sugar') == ('2', 'Sugar', 1.0)
+    cache.close()
+
+
+def test_add_twice(index):
+    index.add('0', 'Other name')
+    assert index.names['0'] == 'Wheat Flour'
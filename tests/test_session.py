@@ -0,0 +1,60 @@
+# reciper tests - the incremental solve session
+
+import pytest
+
+import reciper.session
+from reciper.session import SolveSession
+from reciper.solver import solve_recipe
+
+VALUES = {'calories': 250, 'fat': 10, 'protein': 5}
+INGREDIENTS = {'flour': {'calories': 3.6, 'fat': 0.01, 'protein': 0.1}, 'butter': {'calories': 7.2, 'fat': 0.81, 'protein': 0.01},
+               'egg': {'calories': 1.4, 'fat': 0.1, 'protein': 0.13}}
+
+
+@pytest.fixture
+def session():
+    session = SolveSession(VALUES, rules='exact')
+    for cname, cserving in INGREDIENTS.items():
+        session.add(cname, cserving)
+    return session
+
+
+def test_edits_keep_matrix(session):
+    session.remove('butter')
+    session.add('sugar', {'calories': 4})
+    session.add('egg', {'calories': 1.5, 'fat': 0.1, 'protein': 0.13})
+    session.set_values({'calories': 200, 'fat': 3, 'protein': 5, 'sugar': 10})
+    assert session.names == ['flour', 'egg', 'sugar']
+    assert session._coeff.tolist() == session.store.matrix(session.values.keys()).tolist()
+    assert 'sugar' in session and len(session) == 3
+
+
+def test_solve_matches_solve_recipe(session):
+    res = session.solve()
+    assert session.result is res
+    expected = solve_recipe(INGREDIENTS, VALUES, rules='exact')
+    assert res['amounts'] == pytest.approx(expected['amounts'], abs=1e-6)
+
+
+def test_edit_clears_result(session):
+    session.solve()
+    session.set_options(order=True)
+    assert session.result is None
+    with pytest.raises(ValueError):
+        session.set_options(colour='red')
+    assert SolveSession().solve() is None
+
+
+def test_stale_result_not_kept(session, monkeypatch):
+    # an edit while the solve runs (i.e. from the gui thread) makes the result stale
+    def edit_during_solve(*args, **kwargs):
+        session.remove('egg')
+        return solve_recipe(*args, **kwargs)
+
+    monkeypatch.setattr(reciper.session, 'solve_recipe', edit_during_solve)
+    res = session.solve()
+    # the result is of the snapshot (with the egg) and is not kept as the session result
+    assert 'egg' in res['amounts']
+    assert session.result is None
+    monkeypatch.undo()
+    assert 'egg' not in session.solve()['amounts']
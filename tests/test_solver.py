@@ -0,0 +1,50 @@
+# reciper tests - the recipe problem construction and the label order constraints
+
+import numpy as np
+import pytest
+
+from reciper.matrix import IngredientStore
+from reciper.solver import build_order_constraints, solve_recipe
+
+PARAMS = ['calories', 'carbohydrate', 'fat', 'protein']
+
+
+def test_order_constraints():
+    A_ub, b_ub = build_order_constraints(4, 6)
+    # x[i+1] - x[i] <= 0 for each adjacent pair, the error columns are not used
+    assert A_ub.toarray().tolist() == [[-1, 1, 0, 0, 0, 0], [0, -1, 1, 0, 0, 0], [0, 0, -1, 1, 0, 0]]
+    assert b_ub.tolist() == [0, 0, 0]
+
+
+def test_tail_constraints():
+    A_ub, b_ub = build_order_constraints(4, 5, tail=2, tail_fraction=0.1)
+    dense = A_ub.toarray()
+    # one order row for the head, then x[i] - 0.1 * sum(x) <= 0 for each tail ingredient
+    assert dense.shape == (3, 5)
+    assert dense[0].tolist() == [-1, 1, 0, 0, 0]
+    assert dense[1].tolist() == pytest.approx([-0.1, -0.1, 0.9, -0.1, 0])
+    assert dense[2].tolist() == pytest.approx([-0.1, -0.1, -0.1, 0.9, 0])
+    assert len(b_ub) == 3
+    A_tail, _ = build_order_constraints(4, 5, tail=2, order=False)
+    assert A_tail.shape == (2, 5)
+
+
+def test_solve_recovers_amounts():
+    rng = np.random.default_rng(0)
+    ingredients = {'i%d' % x: dict(zip(PARAMS, rng.uniform(0, 1, len(PARAMS)).tolist())) for x in range(3)}
+    store = IngredientStore.from_servings(ingredients)
+    names = ['i0', 'i1', 'i2']
+    amounts = np.array([50.0, 30.0, 20.0])
+    values = dict(zip(PARAMS, (store.matrix(PARAMS, names) @ amounts).tolist()))
+    res = solve_recipe(store, values, names, rules='exact', order=True)
+    assert res['success']
+    assert [res['amounts'][x] for x in names] == pytest.approx(amounts.tolist(), abs=1e-6)
+    assert all(abs(x) < 1e-6 for x in res['residuals'].values())
+
+
+def test_order_changes_solution():
+    # one label value and two identical ingredients: any split fits, the order keeps the first one the largest
+    store = IngredientStore.from_servings({'a': {'calories': 1}, 'b': {'calories': 1}})
+    res = solve_recipe(store, {'calories': 100}, ['a', 'b'], rules='exact', order=True)
+    assert res['amounts']['a'] >= res['amounts']['b'] - 1e-9
+    assert res['amounts']['a'] + res['amounts']['b'] == pytest.approx(100)
@@ -0,0 +1,69 @@
+# reciper tests - the nutrient sources and the fixture http server
+
+import threading
+
+import pytest
+
+from reciper.cache import NutrientCache
+from reciper.fixtures import FixtureSource, make_server
+from reciper.lookup import LookupService, RateLimitedClient, resolve_ingredients
+from reciper.sources import HttpSource
+
+
+class CountingLimiter:
+    '''A rate limiter counting the tokens taken'''
+    def __init__(self):
+        self.tokens = 0
+
+    def acquire(self):
+        self.tokens += 1
+
+
+def test_get_many_bulk_single_token(recorded):
+    limiter = CountingLimiter()
+    source = FixtureSource(fixtures=recorded)
+    food_ids = list(recorded['foods'])[:5]
+    foods = RateLimitedClient(source, limiter).get_many(food_ids + ['missing'])
+    assert foods['missing'] is None
+    assert all(foods[x]['food_id'] == x for x in food_ids)
+    assert limiter.tokens == 1
+    assert source.calls == 1
+
+
+@pytest.fixture
+def server(recorded):
+    source = FixtureSource(fixtures=recorded)
+    server = make_server(source)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_http_round_trip(server, recorded):
+    query, foods = next(iter(recorded['searches'].items()))
+    food_id = foods[0]['food_id']
+    with HttpSource(server.url) as source:
+        assert source.foods_search(query) == foods
+        assert source.food_get(food_id) == recorded['foods'][food_id]
+        many = source.get_many([food_id, 'missing'])
+        assert many == {food_id: recorded['foods'][food_id], 'missing': None}
+        with pytest.raises(ValueError):
+            source.food_get('missing')
+    # the bulk lookup is one request
+    assert server.source.calls == 4
+
+
+def test_http_unknown_path(server):
+    source = HttpSource(server.url + '/other')
+    with pytest.raises(LookupError):
+        source.food_get('1')
+
+
+def test_resolve_ingredients_over_http(server):
+    with LookupService(lambda: HttpSource(server.url), cache=NutrientCache(':memory:'), offline=False, rate=None) as service:
+        ingredients = resolve_ingredients(['egg', 'butter', 'no such food'], service)
+    assert sorted(ingredients) == ['butter', 'egg']
+    assert ingredients['egg']['measurement_description'] == 'g'
+    assert ingredients['egg']['piece_grams'] == pytest.approx(50)
@@ -0,0 +1,54 @@
+# reciper tests - the label rounding rules
+
+import numpy as np
+import pytest
+
+from reciper.tolerance import RULES, label_interval, label_intervals, round_label
+
+
+@pytest.mark.parametrize('param, value, rules, label', [
+    ('calories', 3, 'fda', 0), ('calories', 43, 'fda', 45), ('calories', 123, 'fda', 120),
+    ('fat', 0.4, 'fda', 0), ('fat', 4.3, 'fda', 4.5), ('fat', 7.4, 'fda', 7),
+    ('sodium', 137, 'fda', 135), ('sodium', 234, 'fda', 230),
+    ('calcium', 140, 'fda', 130),
+    ('fat', 3.27, 'eu', 3.3), ('fat', 12.6, 'eu', 13), ('sodium', 403, 'eu', 400),
+    ('fat', 3.27, 'exact', 3.27),
+])
+def test_round_label(param, value, rules, label):
+    assert round_label(param, value, rules) == pytest.approx(label)
+
+
+@pytest.mark.parametrize('rules', ['fda', 'eu'])
+def test_interval_contains_true_value(rules):
+    # any true value is within the interval of its rounded label value
+    rng = np.random.default_rng(0)
+    for cparam in RULES[rules]:
+        for ctrue in rng.uniform(0, 600, 200).tolist() + rng.uniform(0, 10, 200).tolist():
+            low, high = label_interval(cparam, round_label(cparam, ctrue, rules), rules)
+            assert low - 1e-9 <= ctrue <= high + 1e-9, (cparam, ctrue, low, high)
+
+
+def test_zero_and_exact_intervals():
+    assert label_interval('calories', 0) == (0, 5)
+    assert label_interval('fat', 4.5) == pytest.approx((4.25, 4.75))
+    assert label_interval('fat', 4.5, 'exact') == (4.5, 4.5)
+    low, high = label_intervals({'fat': 4.5, 'calories': 0})
+    assert low.tolist() == pytest.approx([4.25, 0])
+    assert high.tolist() == pytest.approx([4.75, 5])
+
+
+@pytest.mark.parametrize('param, value, rules, interval', [
+    # the values just below the bracket bound round onto it with the previous bracket step
+    ('fat', 5, 'fda', (4.75, 5.5)), ('fat', 6, 'fda', (5.5, 6.5)), ('calories', 50, 'fda', (47.5, 55)),
+    ('sodium', 140, 'fda', (137.5, 145)), ('fat', 10, 'eu', (9.95, 10.5)), ('sodium', 400, 'eu', (398, 420)),
+])
+def test_bracket_boundary_intervals(param, value, rules, interval):
+    assert label_interval(param, value, rules) == pytest.approx(interval)
+    low, high = interval
+    assert round_label(param, low + 1e-6, rules) == pytest.approx(value)
+    assert round_label(param, low - 1e-6, rules) != pytest.approx(value)
+
+
+def test_unknown_rules():
+    with pytest.raises(ValueError):
+        label_interval('fat', 1, 'mars')
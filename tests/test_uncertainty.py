@@ -0,0 +1,64 @@
+# reciper tests - the ingredient amount confidence intervals from perturbed problems
+
+import numpy as np
+import pytest
+
+from reciper.matrix import IngredientStore
+from reciper.solver import solve_recipe
+from reciper.tolerance import round_label
+from reciper.uncertainty import perturb, recipe_intervals, solve_batch
+
+PARAMS = ['calories', 'fat', 'carbohydrate', 'protein', 'sodium', 'fiber']
+
+
+@pytest.fixture(scope='module')
+def recipe():
+    rng = np.random.default_rng(1)
+    ingredients = {'i%d' % x: dict(zip(PARAMS, rng.uniform(0.01, 1, len(PARAMS)).tolist())) for x in range(3)}
+    ingredients['i0']['calories'] = 4.0
+    store = IngredientStore.from_servings(ingredients)
+    amounts = np.array([60.0, 30.0, 10.0])
+    true = store.matrix(PARAMS, ['i0', 'i1', 'i2']) @ amounts
+    return store, amounts, dict(zip(PARAMS, true.tolist()))
+
+
+def test_solve_batch_matches_single_solves(recipe):
+    store, _, values = recipe
+    names = ['i0', 'i1', 'i2']
+    coeff = store.matrix(PARAMS, names)
+    rng = np.random.default_rng(2)
+    targets = np.array([values[x] for x in PARAMS]) * rng.uniform(0.9, 1.1, (5, len(PARAMS)))
+    coeffs = np.repeat(coeff[np.newaxis], 5, axis=0)
+    weights = 1 / targets.mean(axis=0)
+    amounts = solve_batch(coeffs, targets, weights)
+    assert amounts.shape == (5, 3)
+    # each block is solved as the single problem with the sample values as exact values
+    for csample, camounts in zip(targets, amounts):
+        res = solve_recipe(store, dict(zip(PARAMS, csample.tolist())), names, rules='exact')
+        assert coeff @ camounts == pytest.approx(coeff @ np.array([res['amounts'][x] for x in names]), rel=1e-5)
+
+
+def test_perturb():
+    coeff = np.ones((2, 3))
+    coeffs, targets = perturb(coeff, np.array([1.0, 10.0]), np.array([2.0, 20.0]), 100, 0.05, np.random.default_rng(0))
+    assert coeffs.shape == (100, 2, 3) and targets.shape == (100, 2)
+    assert (coeffs >= 0).all() and coeffs.std() == pytest.approx(0.05, rel=0.2)
+    assert (targets[:, 0] >= 1).all() and (targets[:, 0] <= 2).all()
+    assert (targets[:, 1] >= 10).all() and (targets[:, 1] <= 20).all()
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_intervals_cover_true_amounts(recipe, processes):
+    store, amounts, true = recipe
+    values = {k: round_label(k, v) for k, v in true.items()}
+    res = recipe_intervals(store, values, num_samples=200, chunk_size=50, processes=processes, seed=0)
+    assert res['num_solved'] == 200
+    for cname, camount in zip(['i0', 'i1', 'i2'], amounts):
+        low, high = res['intervals'][cname]
+        assert low <= camount <= high
+        assert low <= res['median'][cname] <= high
+    # the point solution is the unperturbed solve
+    point = solve_recipe(store, values)
+    assert res['amounts'] == pytest.approx(point['amounts'])
+    # an already solved point is reused
+    assert recipe_intervals(store, values, num_samples=10, point={'amounts': {'x': 1}}, seed=0)['amounts'] == {'x': 1}
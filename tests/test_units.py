@@ -0,0 +1,75 @@
+# reciper tests - the nutrient schema units and the per gram normalization of the food servings
+
+import numpy as np
+import pytest
+
+from reciper.cache import NutrientCache
+from reciper.matrix import NUTRIENTS, harmonize_values, parse_servings, unit_factor
+from reciper.units import get_density, is_discrete_unit, normalize_food, normalize_foods
+
+
+def test_harmonize_values():
+    values = harmonize_values({'sodium_g': 0.5, 'calcium_dv': 10, 'calories_kj': 418.4, 'fat': 3, 'brand_x': 1})
+    assert values == pytest.approx({'sodium': 500, 'calcium': 130, 'calories': 100, 'fat': 3, 'brand_x': 1})
+    assert unit_factor('vitamin_a', '%dv') == pytest.approx(9)
+    with pytest.raises(ValueError):
+        unit_factor('trans_fat', '%dv')
+
+
+def test_parse_servings():
+    servings = [{'calories': '80', 'calcium': '10', 'fat': ''}, {'iron': 'x', 'protein': 2}]
+    values = parse_servings(servings)
+    assert values.shape == (2, len(NUTRIENTS))
+    row = dict(zip(NUTRIENTS, values[0].tolist()))
+    # calcium is converted from percent of the daily value, the empty and bad values are missing
+    assert row['calories'] == 80 and row['calcium'] == pytest.approx(130)
+    assert np.isnan(row['fat']) and np.isnan(values[1, NUTRIENTS.index('iron')])
+    assert parse_servings(servings, convert=False)[0, NUTRIENTS.index('calcium')] == 10
+
+
+def test_normalize_food_averages_servings():
+    food = {'food_id': '1', 'food_name': 'bread', 'servings': {'serving': [
+        {'measurement_description': 'slice', 'metric_serving_amount': '30', 'metric_serving_unit': 'g', 'calories': '80', 'calcium': '2'},
+        {'measurement_description': 'g', 'metric_serving_amount': '100', 'metric_serving_unit': 'g', 'calories': '265', 'calcium': '6'},
+        {'measurement_description': 'cup', 'metric_serving_amount': '240', 'metric_serving_unit': 'ml', 'calories': '1'}]}}
+    serving = normalize_food(food)
+    # the volume serving is not used when the food has mass servings
+    assert serving['calories'] == pytest.approx(345 / 130)
+    # calcium stays in percent of the daily value (converted when parsed into the store)
+    assert serving['calcium'] == pytest.approx(8 / 130)
+    assert serving['piece_grams'] == pytest.approx(30)
+
+
+def test_normalize_volume_and_bad_servings():
+    foods = [{'food_id': '2', 'food_name': 'Whole Milk', 'servings': {'serving': {
+                 'measurement_description': 'cup', 'metric_serving_amount': '1', 'metric_serving_unit': 'cup', 'calories': '150'}}},
+             {'food_id': '3', 'servings': {'serving': [{'metric_serving_amount': 'x', 'metric_serving_unit': 'g', 'calories': '1'},
+                                                       {'metric_serving_amount': '0', 'metric_serving_unit': 'g', 'calories': '1'},
+                                                       {'metric_serving_amount': '3', 'metric_serving_unit': 'pinch', 'calories': '1'}]}},
+             {'food_id': '4', 'servings': {'serving': []}}]
+    milk, bad, empty = normalize_foods(foods)
+    assert get_density('Whole Milk') == 1.03
+    assert milk['calories'] == pytest.approx(150 / (236.58824 * 1.03))
+    assert milk['piece_grams'] is None
+    assert bad is None and empty is None
+
+
+def test_normalize_cache():
+    cache = NutrientCache(':memory:')
+    food = {'food_id': '5', 'servings': {'serving': [{'metric_serving_amount': '10', 'metric_serving_unit': 'g', 'fat': '1'}]}}
+    assert normalize_foods([food], cache)[0]['fat'] == pytest.approx(0.1)
+    # the cached values are used (by food_id)
+    food['servings']['serving'][0]['fat'] = '2'
+    assert normalize_foods([food], cache)[0]['fat'] == pytest.approx(0.1)
+    # an entry cached without the piece weight is normalized again
+    cache.set('per_gram', '5', {'fat': 0.1})
+    assert normalize_foods([food], cache)[0]['fat'] == pytest.approx(0.2)
+
+
+@pytest.mark.parametrize('description, discrete', [('slice', True), ('1 large egg', True), ('2 slices (30g)', True),
+                                                   ('large', True), ('1 extra large', True), ('cookie, chocolate chip', True),
+                                                   ('1 cup, large', False), ('can', False), ('1 stick', False), ('whole', False),
+                                                   ('100 g', False), ('eggplant', False), ('barley', False), ('', False),
+                                                   (None, False)])
+def test_is_discrete_unit(description, discrete):
+    assert is_discrete_unit(description) == discrete